@@ -70,11 +70,16 @@ async def readiness_check():
         # Import here to avoid circular imports
         from app.main import ml_processor
 
-        if not ml_processor or not ml_processor.is_model_loaded():
-            raise HTTPException(status_code=503, detail="ML processor not ready")
+        if not ml_processor or not ml_processor.is_ready():
+            detail = "ML models warming up"
+            if ml_processor and ml_processor.warm_up_error:
+                detail = f"ML model warm-up failed: {ml_processor.warm_up_error}"
+            raise HTTPException(status_code=503, detail=detail)
 
-        return {"status": "ready"}
+        return {"status": "ready", "warm_up_seconds": ml_processor.warm_up_seconds}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("Readiness check failed", error=str(e))
         raise HTTPException(status_code=503, detail="Service not ready")
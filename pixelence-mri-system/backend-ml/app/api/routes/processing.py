@@ -1,20 +1,79 @@
 """
 DICOM processing routes
 """
+import asyncio
+import hashlib
+import json
 import os
 import shutil
-from typing import List, Dict, Any
-from fastapi import APIRouter, File, UploadFile, HTTPException, BackgroundTasks, Form
-from fastapi.responses import JSONResponse
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, File, UploadFile, HTTPException, Form, Header, Query
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 import structlog
 
 from app.core.config import settings
+from app.services.archive_reader import detect_archive_format
+from app.services.checkpoint import JobCheckpoint
+from app.services.embedding_index import FAISS_AVAILABLE, SEARCH_LEVELS
+from app.services.job_manager import (
+    DEFAULT_PRIORITY, PRIORITY_LANES, RESUBMITTABLE_STATUSES, DuplicateJobError
+)
+from app.services.previews import (
+    PREVIEW_ID_PATTERN, PREVIEW_MEDIA_TYPES, PREVIEW_SIZES, preview_path, previews_dir
+)
+from app.services.result_export import EXPORT_FORMATS, PYARROW_AVAILABLE, stream_export
+from app.services.slice_renderer import RENDER_FORMATS
+from app.services.subsampling import SAMPLING_MODES
 
 logger = structlog.get_logger(__name__)
 
 router = APIRouter()
 
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _content_digest(files: List[UploadFile], options: Dict[str, Any]) -> str:
+    """
+    Order-independent SHA-256 over the contents of the uploaded files, plus
+    the processing options, as the same files processed differently are a
+    different submission
+    """
+    file_digests = []
+    for file in files:
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: file.file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        file.file.seek(0)
+        file_digests.append(digest.hexdigest())
+
+    options_json = json.dumps(options, sort_keys=True)
+    return hashlib.sha256(("".join(sorted(file_digests)) + options_json).encode()).hexdigest()
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Timezone-aware query times as naive UTC, the form job timestamps are stored in"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _estimate_slices(files: List[UploadFile]) -> int:
+    """Slices in an upload: one per DICOM file, archives estimated from their size"""
+    slices = 0
+    for file in files:
+        if detect_archive_format(file.file) is None:
+            slices += 1
+            continue
+
+        file.file.seek(0, os.SEEK_END)
+        size = file.file.tell()
+        file.file.seek(0)
+        slices += max(1, size // settings.ESTIMATED_BYTES_PER_SLICE)
+
+    return slices
+
 
 class ProcessingRequest(BaseModel):
     """Request model for processing jobs"""
@@ -30,19 +89,38 @@ class JobStatusResponse(BaseModel):
     created_at: str
     updated_at: str
     result: Dict[str, Any] = None
+    partial_result: Dict[str, Any] = None
     error: str = None
 
 
 @router.post("/process-dicom", response_model=Dict[str, Any])
 async def process_dicom_files(
-    background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
-    job_id: str = Form(None, description="Optional job ID")
+    job_id: str = Form(None, description="Optional job ID"),
+    early_stop_confidence: float = Form(
+        None, description="Stop once the overall assessment reaches this confidence"
+    ),
+    priority: str = Form(DEFAULT_PRIORITY, description="Queue lane: urgent, high, normal or low"),
+    facility_id: str = Form(None, description="Facility the upload is scheduled fairly under"),
+    sampling: str = Form("full", description="full, or adaptive slice subsampling for triage"),
+    idempotency_key: str = Header(None, alias="Idempotency-Key")
 ):
-    """Upload and process DICOM files asynchronously"""
+    """Upload and process DICOM files, or ZIP/TAR study archives, asynchronously"""
     try:
         # Import here to avoid circular imports
-        from app.main import job_manager, ml_processor
+        from app.main import job_manager, admission_controller
+
+        if priority not in PRIORITY_LANES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid priority: {priority}. Allowed: {', '.join(PRIORITY_LANES)}"
+            )
+
+        if sampling not in SAMPLING_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid sampling: {sampling}. Allowed: {', '.join(SAMPLING_MODES)}"
+            )
 
         # Validate file count
         if len(files) == 0:
@@ -51,46 +129,107 @@ async def process_dicom_files(
         if len(files) > 10:  # Limit concurrent uploads
             raise HTTPException(status_code=400, detail="Too many files. Maximum 10 files allowed.")
 
-        # Validate file types
+        # Validate file types; archives are recognised by their magic bytes
         allowed_extensions = {'.dcm', '.dicom'}
         for file in files:
             ext = os.path.splitext(file.filename)[1].lower()
-            if ext not in allowed_extensions:
+            if ext not in allowed_extensions and detect_archive_format(file.file) is None:
                 raise HTTPException(
                     status_code=400,
-                    detail=f"Invalid file type: {file.filename}. Only DICOM files (.dcm, .dicom) are allowed."
+                    detail=f"Invalid file type: {file.filename}. Only DICOM files (.dcm, .dicom) "
+                           f"or ZIP/TAR archives of DICOM files are allowed."
                 )
 
         # Create job
         job_type = "dicom_processing"
+        estimated_slices = _estimate_slices(files)
         payload = {
             "file_count": len(files),
-            "file_names": [f.filename for f in files]
+            "file_names": [f.filename for f in files],
+            "estimated_slices": estimated_slices
         }
 
-        if not job_id:
-            job_id = await job_manager.create_job(job_type, payload)
-        else:
-            # Update existing job if provided
-            await job_manager.update_job_status(job_id, "processing", progress=10)
-
-        # Save uploaded files
-        upload_dir = os.path.join(settings.UPLOAD_DIR, job_id)
-        os.makedirs(upload_dir, exist_ok=True)
+        existing_job = job_id and await job_manager.get_job_status(job_id)
+        if existing_job and existing_job["status"] not in RESUBMITTABLE_STATUSES:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Job {job_id} is {existing_job['status']}; only failed or cancelled jobs can be resubmitted"
+            )
 
-        file_paths = []
-        for i, file in enumerate(files):
-            file_path = os.path.join(upload_dir, file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            file_paths.append(file_path)
+        submission_keys = []
+        if not existing_job:
+            # Retried or repeated uploads resolve to the job already created.
+            # Hashing a large archive takes seconds; keep the event loop free.
+            content_digest = await asyncio.to_thread(_content_digest, files, {
+                "sampling": sampling,
+                "early_stop_confidence": early_stop_confidence
+            })
+            submission_keys = job_manager.submission_keys(
+                tenant=facility_id,
+                idempotency_key=idempotency_key,
+                content_digest=content_digest
+            )
+            duplicate_id = await job_manager.find_duplicate_job(submission_keys)
+            if duplicate_id:
+                return await _duplicate_response(job_manager, duplicate_id)
 
-            # Update progress
-            progress = int(20 + (i / len(files)) * 30)
-            await job_manager.update_job_status(job_id, "processing", progress=progress)
+        # Refuse new work while the backlog is full
+        admission = await admission_controller.check(estimated_slices, priority)
+        if not admission.admitted:
+            raise HTTPException(
+                status_code=429,
+                detail="Processing backlog is full. Retry later.",
+                headers={"Retry-After": str(admission.retry_after_seconds)}
+            )
 
-        # Add processing task to background
-        background_tasks.add_task(process_dicom_background, job_id, file_paths)
+        if existing_job:
+            # Queued below once its new files are stored, like a new job
+            if not await job_manager.resubmit_job(job_id, **payload):
+                raise HTTPException(status_code=409, detail=f"Job {job_id} can no longer be resubmitted")
+            # Results of the earlier upload must not be resumed
+            await JobCheckpoint(job_manager.redis).clear(job_id)
+        else:
+            try:
+                # Queued only once its files are stored
+                job_id = await job_manager.create_job(
+                    job_type, payload, priority=priority, tenant=facility_id,
+                    job_id=job_id, enqueue=False, submission_keys=submission_keys
+                )
+            except DuplicateJobError as duplicate:
+                return await _duplicate_response(job_manager, duplicate.job_id)
+
+        try:
+            # Save uploaded files
+            upload_dir = os.path.join(settings.UPLOAD_DIR, job_id)
+            os.makedirs(upload_dir, exist_ok=True)
+
+            file_paths = []
+            upload_bytes = 0
+            for i, file in enumerate(files):
+                file_path = os.path.join(upload_dir, file.filename)
+                with open(file_path, "wb") as buffer:
+                    shutil.copyfileobj(file.file, buffer)
+                file_paths.append(file_path)
+                upload_bytes += os.path.getsize(file_path)
+
+                # Update progress
+                progress = int(20 + (i / len(files)) * 30)
+                await job_manager.update_job_status(job_id, "pending", progress=progress)
+
+            # Hand the job to the processing workers
+            await job_manager.update_job_payload(
+                job_id,
+                file_paths=file_paths,
+                upload_bytes=upload_bytes,
+                early_stop_confidence=early_stop_confidence,
+                sampling=sampling
+            )
+            await job_manager.enqueue_job(job_id)
+        except Exception:
+            # Nothing will pick the job up; a repeated upload may run again
+            await job_manager.update_job_status(job_id, "failed", error="Upload could not be stored")
+            await job_manager.release_submission(job_id, submission_keys)
+            raise
 
         logger.info("DICOM processing job initiated",
                    job_id=job_id,
@@ -98,9 +237,11 @@ async def process_dicom_files(
 
         return {
             "job_id": job_id,
-            "status": "processing",
-            "message": "DICOM files uploaded successfully. Processing started.",
-            "estimated_time": f"{len(files) * 30}s"  # Rough estimate
+            "status": "pending",
+            "message": "DICOM files uploaded successfully. Processing queued.",
+            "estimated_time": f"{round(admission.eta_seconds)}s",
+            "estimated_seconds": round(admission.eta_seconds, 1),
+            "queue_wait_seconds": round(admission.queue_wait_seconds, 1)
         }
 
     except HTTPException:
@@ -110,38 +251,14 @@ async def process_dicom_files(
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-async def process_dicom_background(job_id: str, file_paths: List[str]):
-    """Background task for DICOM processing"""
-    try:
-        # Import here to avoid circular imports
-        from app.main import job_manager, ml_processor
-
-        await job_manager.update_job_status(job_id, "processing", progress=50)
-
-        # Process files with ML model
-        results = await ml_processor.process_dicom_files(file_paths, job_id)
-
-        # Update job with results
-        await job_manager.update_job_status(
-            job_id,
-            "completed",
-            progress=100,
-            result=results
-        )
-
-        # Clean up uploaded files (optional - keep for debugging)
-        # shutil.rmtree(os.path.dirname(file_paths[0]), ignore_errors=True)
-
-        logger.info("DICOM processing completed", job_id=job_id)
-
-    except Exception as e:
-        logger.error("DICOM processing failed", job_id=job_id, error=str(e))
-        await job_manager.update_job_status(
-            job_id,
-            "failed",
-            progress=0,
-            error=str(e)
-        )
+async def _duplicate_response(job_manager, job_id: str) -> Dict[str, Any]:
+    existing = await job_manager.get_job_status(job_id)
+    return {
+        "job_id": job_id,
+        "status": existing["status"] if existing else "pending",
+        "message": "Duplicate submission. Returning the existing job.",
+        "duplicate": True
+    }
 
 
 @router.get("/job/{job_id}/status", response_model=JobStatusResponse)
@@ -192,6 +309,142 @@ async def get_job_results(job_id: str):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@router.get("/job/{job_id}/previews")
+async def list_job_previews(job_id: str):
+    """List a job's slice previews, in series and instance order once processing completed"""
+    try:
+        # Import here to avoid circular imports
+        from app.main import job_manager
+
+        job = await job_manager.get_job_status(job_id)
+
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        file_results = ((job.get("result") or {}).get("results") or {}).get("file_results") or []
+        slices = sorted(
+            (
+                {
+                    "preview_id": file_result["preview_id"],
+                    "file_path": file_result.get("file_path"),
+                    "series_instance_uid": file_result.get("series_instance_uid"),
+                    "instance_number": file_result.get("instance_number")
+                }
+                for file_result in file_results if file_result.get("preview_id")
+            ),
+            key=lambda item: (str(item["series_instance_uid"]), item["instance_number"] or 0)
+        )
+
+        if not slices:
+            # Still processing: list what has been rendered so far
+            thumbnail_dir = os.path.join(previews_dir(job_id), "thumbnail")
+            if os.path.isdir(thumbnail_dir):
+                slices = [
+                    {"preview_id": os.path.splitext(name)[0]}
+                    for name in sorted(os.listdir(thumbnail_dir))
+                    if name.endswith(f".{settings.PREVIEW_FORMAT}")
+                ]
+
+        base_url = f"/api/v1/job/{job_id}/preview"
+        for item in slices:
+            item["thumbnail_url"] = f"{base_url}/{item['preview_id']}?size=thumbnail"
+            item["preview_url"] = f"{base_url}/{item['preview_id']}?size=preview"
+
+        return {"job_id": job_id, "status": job["status"], "slices": slices, "count": len(slices)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Failed to list job previews", job_id=job_id, error=str(e))
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.get("/job/{job_id}/preview/{preview_id}")
+async def get_job_preview(
+    job_id: str,
+    preview_id: str,
+    size: str = Query("thumbnail", description="thumbnail or preview"),
+    if_none_match: str = Header(None, alias="If-None-Match")
+):
+    """Serve a slice thumbnail or preview image, revalidated by ETag"""
+    if size not in PREVIEW_SIZES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid size: {size}. Allowed: {', '.join(PREVIEW_SIZES)}"
+        )
+
+    if not PREVIEW_ID_PATTERN.match(preview_id) or not PREVIEW_ID_PATTERN.match(job_id):
+        raise HTTPException(status_code=404, detail="Preview not found")
+
+    path = preview_path(job_id, preview_id, size)
+    results_root = os.path.realpath(settings.RESULTS_DIR)
+    if not os.path.realpath(path).startswith(results_root + os.sep) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Preview not found")
+
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.PREVIEW_CACHE_MAX_AGE_SECONDS}"
+    }
+
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(path, media_type=PREVIEW_MEDIA_TYPES[settings.PREVIEW_FORMAT], headers=headers)
+
+
+@router.get("/job/{job_id}/render/{preview_id}")
+async def render_job_slice(
+    job_id: str,
+    preview_id: str,
+    center: float = Query(None, description="Window center; the slice default if omitted"),
+    width: float = Query(None, gt=0, description="Window width; the slice default if omitted"),
+    size: int = Query(None, gt=0, description="Longest side of the render in pixels"),
+    format: str = Query("png", description="png, webp or jpeg"),
+    quality: int = Query(None, ge=1, le=100, description="WebP or JPEG quality"),
+    frame: int = Query(None, ge=0, description="Frame of a multi-frame slice; the middle one if omitted")
+):
+    """Render a slice at the requested window/level, size and format"""
+    if format not in RENDER_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid format: {format}. Allowed: {', '.join(RENDER_FORMATS)}"
+        )
+
+    if not PREVIEW_ID_PATTERN.match(preview_id) or not PREVIEW_ID_PATTERN.match(job_id):
+        raise HTTPException(status_code=404, detail="Slice not found")
+
+    try:
+        # Import here to avoid circular imports
+        from app.main import slice_renderer
+
+        image, cached = await slice_renderer.render(
+            job_id, preview_id, center=center, width=width, max_side=size,
+            frame=frame, image_format=format, quality=quality
+        )
+
+        return Response(
+            content=image,
+            media_type=RENDER_FORMATS[format],
+            headers={
+                "Cache-Control": f"private, max-age={settings.PREVIEW_CACHE_MAX_AGE_SECONDS}",
+                "X-Render-Cache": "hit" if cached else "miss"
+            }
+        )
+
+    except (LookupError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Failed to render slice", job_id=job_id, preview_id=preview_id, error=str(e))
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
 @router.delete("/job/{job_id}")
 async def cancel_job(job_id: str):
     """Cancel a processing job"""
@@ -255,16 +508,178 @@ async def get_active_jobs():
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@router.get("/jobs/queue")
+async def get_queue_depths():
+    """Get queue depth per priority lane"""
+    try:
+        # Import here to avoid circular imports
+        from app.main import job_manager
+
+        depths = await job_manager.get_queue_depths()
+
+        return {"lanes": depths, "total_queued": sum(depths.values())}
+
+    except Exception as e:
+        logger.error("Failed to get queue depths", error=str(e))
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.get("/jobs/history")
+async def get_job_history(
+    status: str = Query(None, description="Filter by terminal status"),
+    facility_id: str = Query(None, description="Filter by facility"),
+    since: datetime = Query(None, description="Created at or after (ISO 8601)"),
+    until: datetime = Query(None, description="Created before (ISO 8601)"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Get finished jobs from the job history database"""
+    try:
+        # Import here to avoid circular imports
+        from app.main import job_history
+
+        if not job_history or not job_history.enabled:
+            raise HTTPException(status_code=503, detail="Job history database not available")
+
+        jobs = await job_history.query(
+            status=status, tenant=facility_id, since=_naive_utc(since), until=_naive_utc(until), limit=limit
+        )
+
+        return {"jobs": jobs, "count": len(jobs)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Failed to get job history", error=str(e))
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.get("/jobs/export")
+async def export_job_results(
+    format: str = Query("parquet", description="parquet or arrow (Arrow IPC stream)"),
+    since: datetime = Query(None, description="Finished at or after (ISO 8601); default 24h ago"),
+    until: datetime = Query(None, description="Finished before (ISO 8601); default now"),
+    status: str = Query("completed", description="Filter by terminal status"),
+    facility_id: str = Query(None, description="Filter by facility")
+):
+    """Stream per-file predictions of finished jobs as a columnar file"""
+    # Import here to avoid circular imports
+    from app.main import job_history
+
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid format: {format}. Allowed: {', '.join(EXPORT_FORMATS)}"
+        )
+
+    if not job_history or not job_history.enabled:
+        raise HTTPException(status_code=503, detail="Job history database not available")
+
+    if not PYARROW_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Columnar export requires pyarrow")
+
+    until = _naive_utc(until) or datetime.utcnow()
+    since = _naive_utc(since) or until - timedelta(hours=24)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+
+    extension = "parquet" if format == "parquet" else "arrows"
+    filename = f"job-results-{since:%Y%m%dT%H%M%S}-{until:%Y%m%dT%H%M%S}.{extension}"
+
+    return StreamingResponse(
+        stream_export(format, since, until, status=status, tenant=facility_id),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.get("/embeddings/similar")
+async def find_similar_slices(
+    job_id: str = Query(..., description="Job whose slices are the query"),
+    preview_id: str = Query(None, description="Query with this slice"),
+    series_instance_uid: str = Query(None, description="Query with this series; the whole job if neither is given"),
+    k: int = Query(10, ge=1, le=100, description="Matches to return"),
+    level: str = Query("slice", description="Match slices or series"),
+    approximate: bool = Query(False, description="Approximate nearest neighbours (requires faiss)")
+):
+    """Find slices or series of other jobs that look like a slice, series or whole job"""
+    if level not in SEARCH_LEVELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid level: {level}. Allowed: {', '.join(SEARCH_LEVELS)}"
+        )
+
+    try:
+        # Import here to avoid circular imports
+        from app.main import job_manager, embedding_index
+
+        job = await job_manager.get_job_status(job_id)
+
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        file_results = ((job.get("result") or {}).get("results") or {}).get("file_results") or []
+        matching = [
+            file_result for file_result in file_results
+            if "embedding_row" in file_result
+            and (preview_id is None or file_result.get("preview_id") == preview_id)
+            and (series_instance_uid is None
+                 or file_result.get("series_instance_uid") == series_instance_uid)
+        ]
+
+        if not matching:
+            raise HTTPException(status_code=404, detail="No indexed slices match the query")
+
+        # Rows of another model version's index point at unrelated embeddings
+        rows = [
+            file_result["embedding_row"] for file_result in matching
+            if file_result.get("embedding_index") == embedding_index.version
+        ]
+        if not rows:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Slices were indexed by another model version, not {embedding_index.version}"
+            )
+
+        try:
+            query = embedding_index.query_vector(rows)
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        matches = await asyncio.to_thread(
+            embedding_index.similar, query, k,
+            level=level, exclude_job_id=job_id, approximate=approximate
+        )
+
+        return {
+            "job_id": job_id,
+            "query_slices": len(rows),
+            "level": level,
+            "approximate": approximate and FAISS_AVAILABLE,
+            "matches": matches,
+            "count": len(matches)
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Failed to find similar slices", job_id=job_id, error=str(e))
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
 @router.get("/jobs/failed")
 async def get_failed_jobs():
-    """Get failed jobs for review"""
+    """Get failed jobs for review, with pending automatic retries and dead-lettered jobs"""
     try:
         # Import here to avoid circular imports
         from app.main import job_manager
 
         jobs = await job_manager.get_jobs_by_status("failed", limit=20)
 
-        return {"failed_jobs": jobs, "count": len(jobs)}
+        return {
+            "failed_jobs": jobs,
+            "count": len(jobs),
+            "scheduled_retries": await job_manager.get_scheduled_retries(),
+            "dead_letter": await job_manager.get_dead_letter_jobs()
+        }
 
     except Exception as e:
         logger.error("Failed to get failed jobs", error=str(e))
@@ -1,9 +1,18 @@
 """
 Logging configuration for structured logging
+
+Records are built on the calling thread but rendered and written by a
+background QueueListener, so log I/O never blocks the event loop.
+High-frequency info and debug events are rate limited per event name.
 """
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
-from typing import Any, Dict
+import threading
+import time
+from typing import Any, Dict, Optional
 
 try:
     import structlog
@@ -13,6 +22,70 @@ except ImportError:
 
 from app.core.config import settings
 
+# Levels that are never sampled away
+UNSAMPLED_LEVELS = {"warning", "error", "critical", "exception"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["NonBlockingQueueHandler"] = None
+_rate_limiter: Optional["EventRateLimiter"] = None
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without formatting them.
+
+    Rendering is left to the listener's handler; when the queue is full the
+    record is dropped and counted instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue is in-process, so the record needs no pickling or pre-formatting
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class EventRateLimiter:
+    """
+    structlog processor that rate limits events per event name.
+
+    Each limited event gets a token bucket refilled at its configured rate
+    per second (bursting up to one second's worth); events without a limit,
+    and warnings and errors, always pass.
+    """
+
+    def __init__(self, limits: Dict[str, float]):
+        self.limits = limits
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self.dropped: Dict[str, int] = {}
+
+    def __call__(self, logger, method_name: str, event_dict: Dict[str, Any]) -> Dict[str, Any]:
+        event = event_dict.get("event")
+        rate = self.limits.get(event)
+        if not rate or method_name in UNSAMPLED_LEVELS:
+            return event_dict
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(event, (rate, now))
+            tokens = min(rate, tokens + (now - updated_at) * rate)
+            if tokens < 1:
+                self._buckets[event] = (tokens, now)
+                self.dropped[event] = self.dropped.get(event, 0) + 1
+                raise structlog.DropEvent
+            self._buckets[event] = (tokens - 1, now)
+
+        return event_dict
+
 
 def setup_logging():
     """Setup structured logging configuration"""
@@ -28,42 +101,62 @@ def setup_logging():
         )
         return
 
-    # Configure structlog
+    global _listener, _queue_handler, _rate_limiter
+    if _listener is not None:
+        return
+
+    _rate_limiter = EventRateLimiter(settings.LOG_RATE_LIMITS)
+
+    # Cheap steps run on the caller; the timestamp must be taken there
+    timestamper = structlog.processors.TimeStamper(fmt="iso")
     shared_processors = [
-        structlog.stdlib.filter_by_level,
         structlog.stdlib.add_logger_name,
         structlog.stdlib.add_log_level,
-        structlog.stdlib.PositionalArgumentsFormatter(),
-        structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
-        structlog.processors.UnicodeDecoder(),
+        timestamper,
     ]
 
-    if settings.LOG_FORMAT == "json":
-        # JSON logging for production
-        shared_processors.append(structlog.processors.JSONRenderer())
-    else:
-        # Human-readable logging for development
-        shared_processors.extend([
-            structlog.processors.ExceptionPrettyPrinter(),
-            structlog.dev.ConsoleRenderer(colors=True),
-        ])
-
     structlog.configure(
-        processors=shared_processors,
+        processors=[
+            structlog.stdlib.filter_by_level,
+            _rate_limiter,
+            *shared_processors,
+            structlog.stdlib.PositionalArgumentsFormatter(),
+            structlog.processors.StackInfoRenderer(),
+            structlog.processors.format_exc_info,
+            structlog.processors.UnicodeDecoder(),
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+        ],
         context_class=dict,
         logger_factory=structlog.stdlib.LoggerFactory(),
         wrapper_class=structlog.stdlib.BoundLogger,
         cache_logger_on_first_use=True,
     )
 
-    # Configure standard library logging
-    logging.basicConfig(
-        format="%(message)s",
-        stream=sys.stdout,
-        level=getattr(logging, settings.LOG_LEVEL.upper()),
+    if settings.LOG_FORMAT == "json":
+        # JSON logging for production
+        renderer = structlog.processors.JSONRenderer()
+    else:
+        # Human-readable logging for development
+        renderer = structlog.dev.ConsoleRenderer(colors=True)
+
+    # Rendering and the write happen on the listener thread
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(structlog.stdlib.ProcessorFormatter(
+        processors=[structlog.stdlib.ProcessorFormatter.remove_processors_meta, renderer],
+        foreign_pre_chain=shared_processors,
+    ))
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE))
+    _listener = logging.handlers.QueueListener(
+        _queue_handler.queue, stream_handler, respect_handler_level=True
     )
+    _listener.start()
+    atexit.register(stop_logging)
+
+    # Configure standard library logging
+    root_logger = logging.getLogger()
+    root_logger.handlers = [_queue_handler]
+    root_logger.setLevel(getattr(logging, settings.LOG_LEVEL.upper()))
 
     # Suppress noisy loggers
     logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
@@ -71,6 +164,25 @@ def setup_logging():
     logging.getLogger("keras").setLevel(logging.WARNING)
 
 
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> Dict[str, Any]:
+    """Queue depth and dropped record counts for the metrics endpoint"""
+    if _queue_handler is None:
+        return {}
+    return {
+        "queued": _queue_handler.queue.qsize(),
+        "dropped_queue_full": _queue_handler.dropped,
+        "dropped_rate_limited": dict(_rate_limiter.dropped)
+    }
+
+
 def get_logger(name: str):
     """Get a configured logger instance"""
     if STRUCTLOG_AVAILABLE:
@@ -0,0 +1,32 @@
+"""
+Database models
+"""
+from sqlalchemy import JSON, Column, DateTime, Float, Index, Integer, String, Text
+from sqlalchemy.orm import declarative_base
+
+Base = declarative_base()
+
+
+class JobHistory(Base):
+    """Terminal job records, kept after the Redis copy expires"""
+
+    __tablename__ = "job_history"
+
+    job_id = Column(String(64), primary_key=True)
+    job_type = Column(String(64), nullable=False)
+    status = Column(String(16), nullable=False)
+    priority = Column(String(16))
+    tenant = Column(String(128))
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=False)
+    file_count = Column(Integer)
+    processing_time = Column(Float)
+    primary_finding = Column(String(32))
+    error = Column(Text)
+    result = Column(JSON)
+
+    __table_args__ = (
+        Index("ix_job_history_status_created_at", "status", "created_at"),
+        Index("ix_job_history_tenant_created_at", "tenant", "created_at"),
+        Index("ix_job_history_finished_at", "finished_at"),
+    )
@@ -0,0 +1,66 @@
+"""
+Redis connection pool management
+"""
+import time
+from typing import Any, Dict
+
+import redis.asyncio as redis
+import structlog
+
+from app.core.config import settings
+
+logger = structlog.get_logger(__name__)
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """Blocking connection pool that records how long callers wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    async def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.acquisitions += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool statistics for the metrics endpoint"""
+        return {
+            "max_connections": self.max_connections,
+            "acquisitions": self.acquisitions,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": (self.total_wait_seconds / self.acquisitions * 1000
+                            if self.acquisitions else 0.0),
+            "max_wait_ms": self.max_wait_seconds * 1000
+        }
+
+
+def create_redis_client() -> redis.Redis:
+    """Create the shared Redis client backed by a bounded connection pool"""
+    pool = InstrumentedConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        password=settings.REDIS_PASSWORD or None,
+        max_connections=settings.REDIS_POOL_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT_SECONDS,
+        socket_keepalive=True,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+        decode_responses=True
+    )
+
+    logger.info("Redis connection pool created",
+               max_connections=settings.REDIS_POOL_MAX_CONNECTIONS)
+    return redis.Redis(connection_pool=pool)
@@ -1,12 +1,12 @@
 """
 Database session management
 """
-import asyncpg
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 import structlog
 
 from app.core.config import settings
+from app.db.models import Base
 
 logger = structlog.get_logger(__name__)
 
@@ -15,6 +15,15 @@ engine = None
 async_session_maker = None
 
 
+def async_database_url(url: str) -> str:
+    """Map a plain database URL onto its async driver (asyncpg, or aiosqlite locally)"""
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
 async def init_db():
     """Initialize database connection"""
     global engine, async_session_maker
@@ -22,11 +31,15 @@ async def init_db():
     try:
         # Create async engine
         engine = create_async_engine(
-            settings.DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://"),
+            async_database_url(settings.DATABASE_URL),
             echo=False,
             future=True,
         )
 
+        # Create tables that do not exist yet
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
         # Create session maker
         async_session_maker = sessionmaker(
             engine, class_=AsyncSession, expire_on_commit=False
@@ -36,10 +49,17 @@ async def init_db():
 
     except Exception as e:
         logger.error("Failed to initialize database", error=str(e))
+        engine = None
+        async_session_maker = None
         # For development, continue without database
         logger.warning("Running without database - using in-memory storage")
 
 
+def is_db_available() -> bool:
+    """Check whether init_db connected successfully"""
+    return async_session_maker is not None
+
+
 async def get_db() -> AsyncSession:
     """Get database session"""
     if async_session_maker is None:
@@ -17,11 +17,18 @@ import structlog
 
 # Import our modules
 from app.core.config import settings
-from app.core.logging import setup_logging
+from app.core.logging import setup_logging, logging_stats
 from app.api.routes import processing, health
 from app.services.ml_processor import MLProcessor
 from app.services.job_manager import JobManager
-from app.db.session import init_db
+from app.services.worker import ProcessingWorker
+from app.services.job_history import JobHistoryStore
+from app.services.storage_janitor import StorageJanitor
+from app.services.admission import AdmissionController, ThroughputTracker
+from app.services.slice_renderer import SliceRenderer
+from app.services.embedding_index import EmbeddingIndex
+from app.db.session import init_db, close_db
+from app.db.redis_pool import create_redis_client
 
 # Setup structured logging
 setup_logging()
@@ -31,39 +38,83 @@ logger = structlog.get_logger(__name__)
 ml_processor = None
 job_manager = None
 redis_client = None
+processing_worker = None
+job_history = None
+storage_janitor = None
+admission_controller = None
+slice_renderer = None
+embedding_index = None
+warm_up_task = None
+
+
+async def _warm_up_in_background():
+    """Load models after the server is up; /health/ready reports when done"""
+    try:
+        await ml_processor.warm_up()
+    except Exception:
+        # Already logged; readiness reports the error
+        pass
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager"""
-    global ml_processor, job_manager, redis_client
+    global ml_processor, job_manager, redis_client, processing_worker, job_history
+    global storage_janitor, admission_controller, slice_renderer, embedding_index, warm_up_task
 
     # Startup
     logger.info("Starting Pixelence ML Service")
 
     # Initialize Redis
-    redis_client = redis.Redis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        db=settings.REDIS_DB,
-        decode_responses=True
-    )
+    redis_client = create_redis_client()
 
     # Initialize database
     await init_db()
 
     # Initialize services
-    job_manager = JobManager(redis_client)
-    ml_processor = MLProcessor()
+    job_history = JobHistoryStore()
+    await job_history.start()
+    job_manager = JobManager(redis_client, history=job_history)
+    await job_manager.start()
+    embedding_index = EmbeddingIndex()
+    ml_processor = MLProcessor(embedding_index=embedding_index)
+
+    # Warm up ML models without holding up startup; workers wait for it
+    warm_up_task = asyncio.create_task(_warm_up_in_background())
+
+    # Admit uploads against the backlog, using measured throughput
+    throughput = ThroughputTracker(redis_client)
+    admission_controller = AdmissionController(job_manager, throughput)
+
+    # Window/level renders for the viewer, from cached decoded slices
+    slice_renderer = SliceRenderer(job_manager)
+
+    # Start consuming the processing queue
+    processing_worker = ProcessingWorker(job_manager, ml_processor, throughput=throughput)
+    await processing_worker.start()
 
-    # Warm up ML models
-    await ml_processor.warm_up()
+    # Reclaim upload and results storage in the background
+    storage_janitor = StorageJanitor(job_manager)
+    await storage_janitor.start()
 
-    logger.info("ML Service startup complete")
+    logger.info("ML Service accepting requests, models warming up")
 
     yield
 
     # Shutdown
     logger.info("Shutting down ML Service")
+    if warm_up_task and not warm_up_task.done():
+        warm_up_task.cancel()
+    if storage_janitor:
+        await storage_janitor.stop()
+    if processing_worker:
+        await processing_worker.stop()
+    if slice_renderer:
+        slice_renderer.close()
+    if job_manager:
+        await job_manager.stop()
+    if job_history:
+        await job_history.stop()
+    await close_db()
     if ml_processor:
         await ml_processor.cleanup()
     if redis_client:
@@ -87,7 +138,7 @@ app.add_middleware(
 )
 
 # Include routers
-app.include_router(health.router, prefix="/health", tags=["health"])
+app.include_router(health.router, tags=["health"])
 app.include_router(processing.router, prefix="/api/v1", tags=["processing"])
 
 @app.get("/")
@@ -105,8 +156,22 @@ async def metrics():
     return {
         "active_jobs": await job_manager.get_active_jobs_count(),
         "completed_jobs_24h": await job_manager.get_completed_jobs_24h(),
+        "jobs_by_day_7d": await job_manager.get_job_counts_by_day(7),
+        "job_history": job_history.stats(),
+        "storage": storage_janitor.stats(),
+        "queue_depth": await job_manager.get_queue_depths(),
+        "retries": await job_manager.retry_stats(),
+        "admission": await admission_controller.stats(),
+        "job_cache": job_manager.cache_stats(),
+        "redis_pool": redis_client.connection_pool.stats(),
+        "logging": logging_stats(),
+        "decoding": ml_processor.decoder.stats(),
+        "render_cache": slice_renderer.stats(),
+        "embedding_index": embedding_index.stats(),
         "gpu_memory_usage": ml_processor.get_gpu_memory_usage(),
-        "model_loaded": ml_processor.is_model_loaded()
+        "model_loaded": ml_processor.is_model_loaded(),
+        "model_ready": ml_processor.is_ready(),
+        "warm_up_seconds": ml_processor.warm_up_seconds
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,47 @@
+"""
+Multi-process entry point for the ML service
+
+Starts INFERENCE_SERVER_COUNT inference server processes that own the
+models, then API_WORKERS uvicorn workers that handle uploads, status and
+DICOM decoding and send pixel tensors to the inference servers.
+
+    python -m app.serve
+"""
+import multiprocessing
+import os
+
+import uvicorn
+
+from app.core.config import settings
+from app.services.inference_server import inference_socket_paths, run_inference_server
+
+
+def main():
+    context = multiprocessing.get_context("spawn")
+    servers = [
+        context.Process(target=run_inference_server, args=(path,), name=f"inference-{index}")
+        for index, path in enumerate(inference_socket_paths())
+    ]
+    for server in servers:
+        server.start()
+
+    # Inherited by the uvicorn worker processes
+    os.environ["INFERENCE_MODE"] = "remote"
+
+    try:
+        uvicorn.run(
+            "app.main:app",
+            host=settings.API_HOST,
+            port=settings.API_PORT,
+            workers=settings.API_WORKERS,
+            log_level=settings.LOG_LEVEL.lower()
+        )
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.join(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Admission Control Service
+Measures processing throughput and admits uploads against the queued backlog
+"""
+import math
+import time
+from typing import Any, Dict, Optional
+import redis.asyncio as redis
+from redis.exceptions import WatchError
+import structlog
+
+from app.core.config import settings
+from app.services.job_manager import JobManager
+
+logger = structlog.get_logger(__name__)
+
+
+class ThroughputTracker:
+    """
+    Cluster-wide processing throughput, shared through Redis.
+
+    Keeps an exponential moving average of seconds per slice on one worker
+    slot, and the number of worker slots that sent a heartbeat recently.
+    """
+
+    def __init__(self, redis_client: redis.Redis):
+        self.redis = redis_client
+        self.throughput_key = "pixelence:throughput"
+        self.slots_key = "pixelence:worker_slots"
+
+    async def record_job(self, slices: int, seconds: float):
+        """Fold a finished job's per-slice time into the moving average"""
+        if slices <= 0 or seconds <= 0:
+            return
+
+        sample = seconds / slices
+        alpha = settings.THROUGHPUT_EMA_ALPHA
+
+        # Retried if another worker folded in a sample meanwhile
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(self.throughput_key)
+                    current = await pipe.hget(self.throughput_key, "seconds_per_slice")
+                    average = sample if current is None else alpha * sample + (1 - alpha) * float(current)
+
+                    pipe.multi()
+                    pipe.hset(self.throughput_key, mapping={
+                        "seconds_per_slice": average,
+                        "updated_at": time.time()
+                    })
+                    pipe.hincrby(self.throughput_key, "samples", 1)
+                    await pipe.execute()
+                    break
+
+                except WatchError:
+                    continue
+
+    async def heartbeat(self, worker_id: str, slots: int):
+        """Announce a worker's concurrent job slots"""
+        await self.redis.zadd(self.slots_key, {f"{worker_id}:{slots}": time.time()})
+
+    async def seconds_per_slice(self) -> float:
+        value = await self.redis.hget(self.throughput_key, "seconds_per_slice")
+        return float(value) if value is not None else settings.DEFAULT_SECONDS_PER_SLICE
+
+    async def worker_slots(self) -> int:
+        """Worker slots with a heartbeat inside the last three intervals"""
+        cutoff = time.time() - 3 * settings.WORKER_HEARTBEAT_SECONDS
+        await self.redis.zremrangebyscore(self.slots_key, 0, cutoff)
+        members = await self.redis.zrange(self.slots_key, 0, -1)
+        return sum(int(member.rsplit(":", 1)[1]) for member in members)
+
+    async def stats(self) -> Dict[str, Any]:
+        """Throughput statistics for the metrics endpoint"""
+        samples = await self.redis.hget(self.throughput_key, "samples")
+        return {
+            "seconds_per_slice": await self.seconds_per_slice(),
+            "samples": int(samples or 0),
+            "worker_slots": await self.worker_slots()
+        }
+
+
+class AdmissionDecision:
+    """Outcome of an admission check, with the ETA for the submission"""
+
+    def __init__(self, admitted: bool, queue_wait_seconds: float,
+                 processing_seconds: float, retry_after_seconds: Optional[int] = None):
+        self.admitted = admitted
+        self.queue_wait_seconds = queue_wait_seconds
+        self.processing_seconds = processing_seconds
+        self.retry_after_seconds = retry_after_seconds
+
+    @property
+    def eta_seconds(self) -> float:
+        return self.queue_wait_seconds + self.processing_seconds
+
+
+class AdmissionController:
+    """
+    Admits submissions while the backlog stays under ADMISSION_MAX_BACKLOG_SLICES.
+
+    Queue wait is the queued and in-flight backlog (in slices) times the
+    measured seconds per slice, spread over the live worker slots. Urgent
+    submissions are always admitted.
+    """
+
+    def __init__(self, job_manager: JobManager, throughput: ThroughputTracker):
+        self.job_manager = job_manager
+        self.throughput = throughput
+        self.rejected = 0
+
+    async def check(self, slices: int, priority: str) -> AdmissionDecision:
+        """Decide whether a submission of `slices` slices may be queued now"""
+        backlog = await self.job_manager.get_backlog_slices()
+        seconds_per_slice = await self.throughput.seconds_per_slice()
+        slots = max(await self.throughput.worker_slots(), 1)
+
+        queue_wait = backlog * seconds_per_slice / slots
+        processing = slices * seconds_per_slice
+        limit = settings.ADMISSION_MAX_BACKLOG_SLICES
+
+        if limit and priority != "urgent" and backlog + slices > limit:
+            # Time for enough of the backlog to drain to fit this submission
+            excess = backlog + slices - limit
+            retry_after = max(1, math.ceil(excess * seconds_per_slice / slots))
+            self.rejected += 1
+            logger.warning("Submission rejected by admission control",
+                          backlog_slices=backlog,
+                          slices=slices,
+                          retry_after=retry_after)
+            return AdmissionDecision(False, queue_wait, processing, retry_after)
+
+        return AdmissionDecision(True, queue_wait, processing)
+
+    async def stats(self) -> Dict[str, Any]:
+        """Admission statistics for the metrics endpoint"""
+        return {
+            "backlog_slices": await self.job_manager.get_backlog_slices(),
+            "max_backlog_slices": settings.ADMISSION_MAX_BACKLOG_SLICES,
+            "rejected": self.rejected,
+            **await self.throughput.stats()
+        }
@@ -0,0 +1,262 @@
+"""
+Archive Reader Service
+Streams DICOM members out of ZIP/TAR study exports without extracting to disk
+"""
+import io
+import os
+import tarfile
+import zipfile
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+import structlog
+
+from app.core.config import settings
+
+logger = structlog.get_logger(__name__)
+
+# DICOM Part 10 files carry a 128 byte preamble followed by "DICM"
+DICOM_PREAMBLE_LENGTH = 128
+DICOM_MAGIC = b"DICM"
+
+# Archive signatures, checked against the first bytes of an upload
+ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
+GZIP_MAGIC = b"\x1f\x8b"
+BZIP2_MAGIC = b"BZh"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+TAR_MAGIC_OFFSET = 257
+TAR_MAGIC = b"ustar"
+
+# Read size used when pulling members out of the archive stream
+READ_CHUNK_SIZE = 1024 * 1024
+
+DicomSource = Union[str, BinaryIO]
+
+
+def is_dicom_header(header: bytes) -> bool:
+    """Check whether the leading bytes of a file are a DICOM Part 10 header"""
+    return header[DICOM_PREAMBLE_LENGTH:DICOM_PREAMBLE_LENGTH + 4] == DICOM_MAGIC
+
+
+def detect_archive_format(fileobj: BinaryIO) -> Optional[str]:
+    """Detect 'zip' or 'tar' from magic bytes, leaving the stream position untouched"""
+    position = fileobj.tell()
+    header = fileobj.read(TAR_MAGIC_OFFSET + len(TAR_MAGIC))
+    fileobj.seek(position)
+
+    if header.startswith(ZIP_MAGIC):
+        return "zip"
+    if header.startswith((GZIP_MAGIC, BZIP2_MAGIC, XZ_MAGIC)):
+        # Compressed tarballs; tarfile's stream mode detects the codec itself
+        return "tar"
+    if header[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET + len(TAR_MAGIC)] == TAR_MAGIC:
+        return "tar"
+    return None
+
+
+def is_archive_path(file_path: str) -> bool:
+    """Check whether a stored upload is a ZIP/TAR archive"""
+    try:
+        with open(file_path, "rb") as fileobj:
+            return detect_archive_format(fileobj) is not None
+    except OSError:
+        return False
+
+
+def _read_member(stream: BinaryIO, name: str, size: int) -> Optional[bytes]:
+    """Read one archive member into memory if it is a DICOM file within size limits"""
+    max_bytes = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+    if size > max_bytes:
+        logger.warning("Skipping oversized archive member", member=name, size=size)
+        return None
+
+    header = stream.read(DICOM_PREAMBLE_LENGTH + len(DICOM_MAGIC))
+    if not is_dicom_header(header):
+        return None
+
+    buffer = bytearray(header)
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        if len(buffer) > max_bytes:
+            # Declared size can lie in crafted archives; stop reading either way
+            logger.warning("Skipping oversized archive member", member=name)
+            return None
+
+    return bytes(buffer)
+
+
+def _count_member(count: int) -> int:
+    """Count an archive entry, refusing archives with more than MAX_ARCHIVE_MEMBERS"""
+    count += 1
+    if count > settings.MAX_ARCHIVE_MEMBERS:
+        raise ValueError(f"Archive has more than {settings.MAX_ARCHIVE_MEMBERS} members")
+    return count
+
+
+def _iter_zip_members(fileobj: BinaryIO, names: Optional[Set[str]]) -> Iterator[Tuple[str, bytes]]:
+    count = 0
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            count = _count_member(count)
+            if names is not None and info.filename not in names:
+                continue
+            with archive.open(info) as member:
+                data = _read_member(member, info.filename, info.file_size)
+            if data is not None:
+                yield info.filename, data
+
+
+def _iter_tar_members(fileobj: BinaryIO, names: Optional[Set[str]]) -> Iterator[Tuple[str, bytes]]:
+    # "r|*" reads the archive strictly sequentially, so members are handed
+    # out as soon as they have been read
+    count = 0
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            count = _count_member(count)
+            if names is not None and info.name not in names:
+                continue
+            member = archive.extractfile(info)
+            if member is None:
+                continue
+            data = _read_member(member, info.name, info.size)
+            if data is not None:
+                yield info.name, data
+
+
+def iter_dicom_members(fileobj: BinaryIO, names: Optional[Set[str]] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (member name, DICOM bytes) for every DICOM member of an archive
+    stream, or only for the members in `names`; others are not read.
+
+    Raises ValueError once the archive exceeds MAX_ARCHIVE_MEMBERS entries or
+    MAX_ARCHIVE_UNCOMPRESSED_MB of DICOM data, e.g. a decompression bomb.
+    """
+    archive_format = detect_archive_format(fileobj)
+
+    if archive_format == "zip":
+        members = _iter_zip_members(fileobj, names)
+    elif archive_format == "tar":
+        members = _iter_tar_members(fileobj, names)
+    else:
+        raise ValueError("Unsupported archive format")
+
+    max_bytes = settings.MAX_ARCHIVE_UNCOMPRESSED_MB * 1024 * 1024
+    total_bytes = 0
+    for name, data in members:
+        total_bytes += len(data)
+        if total_bytes > max_bytes:
+            raise ValueError(f"Archive exceeds {settings.MAX_ARCHIVE_UNCOMPRESSED_MB} MB uncompressed")
+        yield name, data
+
+
+def member_source_name(archive_path: str, member_name: str) -> str:
+    """Name used to identify an archive member in job results"""
+    return f"{archive_path}!{member_name}"
+
+
+def iter_dicom_sources(file_paths: List[str]) -> Iterator[Tuple[str, DicomSource]]:
+    """
+    Yield (source name, source) pairs for a job's stored uploads.
+
+    Plain DICOM files are yielded as paths; archives are streamed and their
+    DICOM members yielded as in-memory file objects, one at a time.
+    """
+    for file_path in file_paths:
+        if not is_archive_path(file_path):
+            yield file_path, file_path
+            continue
+
+        member_count = 0
+        with open(file_path, "rb") as fileobj:
+            for member_name, data in iter_dicom_members(fileobj):
+                member_count += 1
+                yield member_source_name(file_path, member_name), io.BytesIO(data)
+
+        logger.info("Archive streamed",
+                   archive=os.path.basename(file_path),
+                   dicom_members=member_count)
+
+
+def _split_source_name(source_name: str) -> Tuple[str, Optional[str]]:
+    """Stored file of a source name, and its archive member name if it has one"""
+    if os.path.isfile(source_name):
+        return source_name, None
+
+    archive_path, separator, member_name = source_name.partition("!")
+    if separator and os.path.isfile(archive_path):
+        return archive_path, member_name
+
+    raise FileNotFoundError(f"DICOM source not found: {source_name}")
+
+
+def open_dicom_source(source_name: str) -> DicomSource:
+    """Reopen a source named in job results: a stored file, or an archive member"""
+    for _, source in iter_named_sources([source_name]):
+        return source
+
+    raise FileNotFoundError(f"DICOM source not found: {source_name}")
+
+
+def iter_named_sources(source_names: List[str]) -> Iterator[Tuple[str, DicomSource]]:
+    """
+    Yield (source name, source) pairs for sources named in job results or
+    shard payloads. Stored files come first, then the members of each
+    archive, which is streamed once for all of its members; members no
+    longer in the archive are skipped.
+    """
+    members: Dict[str, Set[str]] = {}
+    for source_name in source_names:
+        file_path, member_name = _split_source_name(source_name)
+        if member_name is None:
+            yield source_name, file_path
+        else:
+            members.setdefault(file_path, set()).add(member_name)
+
+    for archive_path, member_names in members.items():
+        with open(archive_path, "rb") as fileobj:
+            for member_name, data in iter_dicom_members(fileobj, member_names):
+                yield member_source_name(archive_path, member_name), io.BytesIO(data)
+
+
+class MemberCache:
+    """
+    Archive members kept in memory from one pass over a job's sources, up
+    to `max_bytes`, so that later passes over some of them only stream the
+    archive for the members that did not fit.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._members: Dict[str, bytes] = {}
+        self._bytes = 0
+
+    def keep(self, sources: Iterable[Tuple[str, DicomSource]]) -> Iterator[Tuple[str, DicomSource]]:
+        """Pass sources through, keeping the archive members that still fit"""
+        for name, source in sources:
+            if isinstance(source, io.BytesIO):
+                data = source.getvalue()
+                if self._bytes + len(data) <= self.max_bytes:
+                    self._members[name] = data
+                    self._bytes += len(data)
+            yield name, source
+
+    def open(self, source_names: Set[str]) -> Iterator[Tuple[str, DicomSource]]:
+        """
+        Yield (source name, source) pairs for `source_names`: kept members
+        first, which are then forgotten, and the rest reopened by name
+        """
+        remaining = []
+        for source_name in sorted(source_names):
+            data = self._members.pop(source_name, None)
+            if data is None:
+                remaining.append(source_name)
+                continue
+            self._bytes -= len(data)
+            yield source_name, io.BytesIO(data)
+
+        yield from iter_named_sources(remaining)
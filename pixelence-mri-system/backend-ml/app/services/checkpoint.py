@@ -0,0 +1,51 @@
+"""
+Job Checkpoint Service
+Per-file outcomes of a job, saved as batches complete so re-runs can resume
+"""
+import json
+from typing import Any, Dict, List
+import redis.asyncio as redis
+
+from app.services.job_manager import JOB_TTL_SECONDS
+
+
+class JobCheckpoint:
+    """
+    Redis hash per job mapping each file's source name to its result.
+
+    Failed files are recorded too, but only successful ones are returned
+    by `load`, so a retried or re-run job reprocesses just the files that
+    failed or were never reached.
+    """
+
+    def __init__(self, redis_client: redis.Redis):
+        self.redis = redis_client
+        self.checkpoint_prefix = "pixelence:checkpoint:"
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.checkpoint_prefix}{job_id}"
+
+    async def save(self, job_id: str, results: List[Dict[str, Any]]):
+        """Record the outcomes of a completed batch"""
+        if not results:
+            return
+
+        key = self._key(job_id)
+        await self.redis.hset(key, mapping={
+            result["file_path"]: json.dumps(result) for result in results
+        })
+        await self.redis.expire(key, JOB_TTL_SECONDS)
+
+    async def load(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        """Successful file results recorded so far, by source name"""
+        entries = await self.redis.hgetall(self._key(job_id))
+
+        completed = {}
+        for name, value in entries.items():
+            result = json.loads(value)
+            if "error" not in result:
+                completed[name] = result
+        return completed
+
+    async def clear(self, job_id: str):
+        await self.redis.delete(self._key(job_id))
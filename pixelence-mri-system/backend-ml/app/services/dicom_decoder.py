@@ -0,0 +1,304 @@
+"""
+DICOM Decoder Service
+Pixel data decoding with a per-transfer-syntax handler choice, run across a
+process pool with a bound on the data in flight
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple, Union
+import numpy as np
+import structlog
+
+from app.core.config import settings
+from app.services.archive_reader import DicomSource
+
+logger = structlog.get_logger(__name__)
+
+# Preference names mapped to their pydicom.config handler attributes
+HANDLER_ATTRIBUTES = {
+    "pylibjpeg": "pylibjpeg_handler",
+    "gdcm": "gdcm_handler",
+    "pillow": "pillow_handler",
+    "jpeg_ls": "jpegls_handler",
+    "rle": "rle_handler",
+    "numpy": "np_handler",
+}
+
+IMPLICIT_VR_LITTLE_ENDIAN = "1.2.840.10008.1.2"
+MODEL_INPUT_SIZE = (256, 256)
+
+# Usable handlers per transfer syntax, in preference order (per process)
+_handler_order: Dict[str, List[str]] = {}
+
+
+def handlers_for(transfer_syntax: str) -> List[str]:
+    """Installed handlers that can decode `transfer_syntax`, fastest first"""
+    if transfer_syntax not in _handler_order:
+        import pydicom
+
+        order = []
+        for name in settings.DICOM_HANDLER_PREFERENCE:
+            handler = getattr(pydicom.config, HANDLER_ATTRIBUTES.get(name, ""), None)
+            if (handler is not None and handler.is_available()
+                    and handler.supports_transfer_syntax(transfer_syntax)):
+                order.append(name)
+        _handler_order[transfer_syntax] = order
+
+    return _handler_order[transfer_syntax]
+
+
+def transfer_syntax_of(dataset) -> str:
+    file_meta = getattr(dataset, "file_meta", None)
+    return str(getattr(file_meta, "TransferSyntaxUID", IMPLICIT_VR_LITTLE_ENDIAN))
+
+
+def decode_pixels(dataset) -> Tuple[np.ndarray, str]:
+    """
+    Decode a dataset's pixel data with the preferred handler for its syntax.
+
+    A handler can claim a syntax whose decoder plugin is not installed, so
+    failures fall through to the next candidate, and a fallback that works is
+    moved to the front for the following slices.
+    """
+    transfer_syntax = transfer_syntax_of(dataset)
+    candidates = handlers_for(transfer_syntax)
+
+    if not candidates:
+        raise NotImplementedError(
+            f"No pixel data handler available for transfer syntax {transfer_syntax}"
+        )
+
+    last_error = None
+    for index, name in enumerate(list(candidates)):
+        try:
+            dataset.convert_pixel_data(handler_name=name)
+        except Exception as e:
+            last_error = e
+            continue
+
+        if index:
+            candidates.remove(name)
+            candidates.insert(0, name)
+        return dataset.pixel_array, name
+
+    raise last_error
+
+
+def preprocess_image(pixel_array: np.ndarray) -> np.ndarray:
+    """Preprocess DICOM pixel array for ML model"""
+    import cv2
+
+    # Convert to float32
+    image = pixel_array.astype(np.float32)
+
+    # Normalize to 0-1 range
+    image = (image - np.min(image)) / (np.max(image) - np.min(image) + 1e-8)
+
+    # Resize to model input size
+    image = cv2.resize(image, MODEL_INPUT_SIZE)
+
+    # Add channel dimension
+    image = np.expand_dims(image, axis=[0, -1])
+
+    return image
+
+
+def decode_dicom(file_path: str, source: Union[DicomSource, bytes, None] = None,
+                 preview_job_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Read, decode and preprocess one DICOM file (from `source` when given).
+
+    Besides the metadata and model input, the result carries the transfer
+    syntax, the handler used and the decode time for the decoder metrics.
+    With `preview_job_id`, the decoded pixels are also rendered to the
+    job's preview and thumbnail images.
+    """
+    import pydicom
+    from app.services.previews import write_previews
+
+    try:
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        dicom = pydicom.dcmread(source if source is not None else file_path)
+
+        started = time.perf_counter()
+        pixel_array, handler = decode_pixels(dicom)
+        decode_seconds = time.perf_counter() - started
+
+        transfer_syntax = transfer_syntax_of(dicom)
+
+        preview_id = None
+        if preview_job_id:
+            try:
+                preview_id = write_previews(preview_job_id, dicom, pixel_array, file_path)
+            except Exception as e:
+                # The viewer falls back to the full DICOM; inference goes on
+                logger.warning("Failed to write slice preview", file_path=file_path, error=str(e))
+
+        return {
+            "file_path": file_path,
+            "patient_id": getattr(dicom, 'PatientID', 'Unknown'),
+            "study_instance_uid": getattr(dicom, 'StudyInstanceUID', 'Unknown'),
+            "series_instance_uid": getattr(dicom, 'SeriesInstanceUID', 'Unknown'),
+            "modality": getattr(dicom, 'Modality', 'Unknown'),
+            "instance_number": int(getattr(dicom, 'InstanceNumber', 0) or 0),
+            "preview_id": preview_id,
+            "image": preprocess_image(pixel_array),
+            "decode": {
+                "transfer_syntax": transfer_syntax,
+                "transfer_syntax_name": pydicom.uid.UID(transfer_syntax).name,
+                "handler": handler,
+                "seconds": decode_seconds
+            }
+        }
+
+    except Exception as e:
+        logger.error("Failed to process DICOM file", file_path=file_path, error=str(e))
+        return {
+            "file_path": file_path,
+            "error": str(e),
+            "status": "failed"
+        }
+
+
+def _init_decode_process():
+    """Pool process initializer: import the decoders once, up front"""
+    from app.core.logging import setup_logging
+    from app.services.ml_processor import load_dependencies
+
+    setup_logging()
+    load_dependencies(include_models=False)
+
+
+def default_decode_processes() -> int:
+    """CPUs shared out between the API worker processes"""
+    return max(1, (os.cpu_count() or 1) // max(settings.API_WORKERS, 1))
+
+
+class DicomDecoder:
+    """
+    Decodes batches of DICOM files, in parallel across a process pool.
+
+    Files are submitted one task each. Archive members are sent as bytes and
+    files on disk as paths. Before submitting, a file's compressed size is
+    reserved against DECODE_MAX_INFLIGHT_MB and released when its result is
+    back, so concurrent jobs cannot queue unbounded data for the pool. A
+    file larger than the whole budget is admitted once nothing else is in
+    flight. With one process, files are decoded on a thread instead.
+    """
+
+    def __init__(self, processes: Optional[int] = None):
+        self.processes = processes or settings.DECODE_PROCESSES or default_decode_processes()
+        self.max_inflight_bytes = settings.DECODE_MAX_INFLIGHT_MB * 1024 * 1024
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight_bytes = 0
+        self._inflight_changed = asyncio.Condition()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def start(self):
+        """Create the process pool, if decoding is parallel"""
+        if self.processes > 1 and self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                # TensorFlow may be loaded in this process; never fork it
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_decode_process
+            )
+            # Spawn every process now rather than on the first job
+            for _ in range(self.processes):
+                self._executor.submit(os.getpid)
+
+    def close(self):
+        """Shut the process pool down, dropping queued work"""
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def decode_batch(self, batch: List[Tuple[str, DicomSource]],
+                           preview_job_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Decode every file of a batch, preserving order, writing previews under `preview_job_id`"""
+        return await asyncio.gather(*(
+            self._decode(file_path, source, preview_job_id) for file_path, source in batch
+        ))
+
+    async def _decode(self, file_path: str, source: Optional[DicomSource],
+                      preview_job_id: Optional[str]) -> Dict[str, Any]:
+        # Pool processes get paths, or the bytes of in-memory sources
+        if source is None or isinstance(source, str):
+            payload = source
+            size = os.path.getsize(source or file_path)
+        else:
+            payload = source.getvalue() if isinstance(source, io.BytesIO) else source.read()
+            size = len(payload)
+
+        await self._reserve(size)
+        try:
+            result = await self._submit(file_path, payload, preview_job_id)
+        finally:
+            await self._release(size)
+
+        decode = result.pop("decode", None)
+        if decode:
+            self._record(decode)
+            result["decode_seconds"] = decode["seconds"]
+        return result
+
+    async def _submit(self, file_path: str, payload,
+                      preview_job_id: Optional[str]) -> Dict[str, Any]:
+        self.start()
+        if self._executor is None:
+            return await asyncio.to_thread(decode_dicom, file_path, payload, preview_job_id)
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._executor, decode_dicom, file_path, payload, preview_job_id
+            )
+        except BrokenProcessPool:
+            # A decoder process died (e.g. out of memory); start a fresh pool next time
+            logger.error("Decode process pool broke, restarting", file_path=file_path)
+            self.close()
+            raise
+
+    async def _reserve(self, size: int):
+        async with self._inflight_changed:
+            await self._inflight_changed.wait_for(
+                lambda: self._inflight_bytes == 0
+                or self._inflight_bytes + size <= self.max_inflight_bytes
+            )
+            self._inflight_bytes += size
+
+    async def _release(self, size: int):
+        async with self._inflight_changed:
+            self._inflight_bytes -= size
+            self._inflight_changed.notify_all()
+
+    def _record(self, decode: Dict[str, Any]):
+        stats = self._stats.setdefault(decode["transfer_syntax"], {
+            "name": decode["transfer_syntax_name"],
+            "files": 0,
+            "decode_seconds": 0.0
+        })
+        stats["handler"] = decode["handler"]
+        stats["files"] += 1
+        stats["decode_seconds"] += decode["seconds"]
+
+    def stats(self) -> Dict[str, Any]:
+        """Handler choice and decode time per transfer syntax for the metrics endpoint"""
+        return {
+            "processes": self.processes,
+            "inflight_bytes": self._inflight_bytes,
+            "max_inflight_bytes": self.max_inflight_bytes,
+            "transfer_syntaxes": {
+                uid: {
+                    **stats,
+                    "mean_decode_seconds": stats["decode_seconds"] / stats["files"]
+                }
+                for uid, stats in self._stats.items()
+            }
+        }
@@ -0,0 +1,289 @@
+"""
+Embedding Index Service
+Append-only on-disk index of slice embeddings with top-k similarity search
+"""
+import fcntl
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import structlog
+
+from app.core.config import settings
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+logger = structlog.get_logger(__name__)
+
+SEARCH_LEVELS = ("slice", "series")
+
+# Slice fields stored with each embedding, returned with every match
+RECORD_FIELDS = (
+    "preview_id", "file_path", "patient_id", "study_instance_uid",
+    "series_instance_uid", "modality", "instance_number"
+)
+
+
+class EmbeddingIndex:
+    """
+    Slice embeddings of one model version, stored under
+    EMBEDDING_INDEX_DIR/<MODEL_VERSION>:
+
+      vectors.f32  L2-normalised float32 rows, memory-mapped for search
+      offsets.u64  byte offset of each row's record in records.jsonl
+      records.jsonl  job id and slice fields of each row
+      meta.json  embedding width, replaced atomically when first written
+
+    Appends take an exclusive file lock, so every API worker process can
+    write to the same index, and write the vectors last: a row is only
+    visible to readers once its record exists. Rows are never rewritten;
+    a re-run job appends its slices again and matches are de-duplicated.
+
+    Search is an exact, chunked matrix-vector product over the memory map.
+    With faiss installed, `approximate` searches an HNSW graph that is
+    built in the background and searches rows not yet in the graph exactly.
+
+    Row numbers only mean something within one index; `version` names it,
+    so callers keep it next to the rows they store.
+    """
+
+    def __init__(self, index_dir: Optional[str] = None):
+        self.index_dir = index_dir or os.path.join(settings.EMBEDDING_INDEX_DIR, settings.MODEL_VERSION)
+        self.version = os.path.basename(os.path.normpath(self.index_dir))
+        self.vectors_path = os.path.join(self.index_dir, "vectors.f32")
+        self.offsets_path = os.path.join(self.index_dir, "offsets.u64")
+        self.records_path = os.path.join(self.index_dir, "records.jsonl")
+        self.meta_path = os.path.join(self.index_dir, "meta.json")
+        self.lock_path = os.path.join(self.index_dir, "index.lock")
+        self.dim: Optional[int] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._map_lock = threading.Lock()
+        self._ann = None
+        self._ann_rows = 0
+        self._ann_lock = threading.Lock()
+        self._ann_builder: Optional[threading.Thread] = None
+        self.appended = 0
+        self.searches = 0
+
+    def _load_dim(self) -> Optional[int]:
+        """Embedding width, once any process has written the first row"""
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        return self.dim
+
+    def _row_bytes(self) -> int:
+        return self.dim * np.dtype(np.float32).itemsize
+
+    def _ensure_dim(self, dim: int):
+        """Fix the embedding width on the first append; later ones must match it"""
+        if self._load_dim() is None:
+            # Readers never see a partly written file
+            temp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"dim": dim, "model_version": self.version}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.meta_path)
+            self.dim = dim
+        elif self.dim != dim:
+            raise ValueError(f"Embedding width {dim} does not match the index ({self.dim})")
+
+    def append(self, records: List[Dict[str, Any]], vectors: np.ndarray) -> List[int]:
+        """Append slice embeddings; returns their row numbers"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        lines = [json.dumps(record).encode() + b"\n" for record in records]
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._ensure_dim(vectors.shape[1])
+
+            with open(self.vectors_path, "ab") as vectors_file, \
+                    open(self.offsets_path, "ab") as offsets_file, \
+                    open(self.records_path, "ab") as records_file:
+                # Drop the tail of an append that was interrupted part-way
+                rows = min(vectors_file.tell() // self._row_bytes(), offsets_file.tell() // 8)
+                vectors_file.truncate(rows * self._row_bytes())
+                offsets_file.truncate(rows * 8)
+
+                offsets = records_file.tell() + np.cumsum([0] + [len(line) for line in lines[:-1]])
+                records_file.write(b"".join(lines))
+                records_file.flush()
+                offsets_file.write(offsets.astype("<u8").tobytes())
+                offsets_file.flush()
+                vectors_file.write(np.ascontiguousarray(vectors).tobytes())
+
+        self.appended += len(records)
+        return list(range(rows, rows + len(records)))
+
+    def vectors(self) -> np.ndarray:
+        """Memory map of every complete row, remapped when the index has grown"""
+        if self._load_dim() is None or not os.path.exists(self.vectors_path):
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+
+        rows = os.path.getsize(self.vectors_path) // self._row_bytes()
+        with self._map_lock:
+            if self._vectors is None or len(self._vectors) != rows:
+                if rows == 0:
+                    return np.empty((0, self.dim), dtype=np.float32)
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                          shape=(rows, self.dim))
+            return self._vectors
+
+    def records(self, rows: List[int]) -> List[Dict[str, Any]]:
+        """Stored records of the given rows"""
+        records = []
+        with open(self.offsets_path, "rb") as offsets_file, open(self.records_path, "rb") as records_file:
+            for row in rows:
+                offsets_file.seek(row * 8)
+                records_file.seek(int(np.frombuffer(offsets_file.read(8), dtype="<u8")[0]))
+                records.append({**json.loads(records_file.readline()), "row": int(row)})
+        return records
+
+    def query_vector(self, rows: List[int]) -> np.ndarray:
+        """
+        Normalised mean embedding of some rows, e.g. the slices of a series.
+        Raises LookupError for rows the index does not have.
+        """
+        if max(rows) >= len(self.vectors()):
+            raise LookupError("Embedding rows are not in the index")
+        vector = np.asarray(self.vectors()[sorted(rows)], dtype=np.float32).mean(axis=0)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def search(self, query: np.ndarray, candidates: int,
+               approximate: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows and cosine similarities of the `candidates` nearest rows, best first"""
+        vectors = self.vectors()
+        self.searches += 1
+        query = np.asarray(query, dtype=np.float32)
+
+        start = 0
+        rows, scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if approximate and FAISS_AVAILABLE:
+            self._extend_ann(len(vectors))
+            with self._ann_lock:
+                if self._ann is not None and self._ann_rows:
+                    ann_scores, ann_rows = self._ann.search(query[np.newaxis], candidates)
+                    found = ann_rows[0] >= 0
+                    rows, scores = ann_rows[0][found].astype(np.int64), ann_scores[0][found]
+                    start = self._ann_rows
+
+        # Rows not covered by the graph (all of them for exact search)
+        chunk_rows = max(settings.EMBEDDING_SEARCH_CHUNK_ROWS, 1)
+        for chunk_start in range(start, len(vectors), chunk_rows):
+            chunk_scores = vectors[chunk_start:chunk_start + chunk_rows] @ query
+            top = _top(chunk_scores, candidates)
+            rows = np.concatenate([rows, top + chunk_start])
+            scores = np.concatenate([scores, chunk_scores[top]])
+
+            if len(rows) > candidates:
+                keep = _top(scores, candidates)
+                rows, scores = rows[keep], scores[keep]
+
+        order = np.argsort(-scores)
+        return rows[order], scores[order]
+
+    def _extend_ann(self, rows: int):
+        """Start adding rows missing from the HNSW graph in the background"""
+        if self._ann_rows >= rows or (self._ann_builder and self._ann_builder.is_alive()):
+            return
+        self._ann_builder = threading.Thread(target=self._build_ann, args=(rows,), daemon=True)
+        self._ann_builder.start()
+
+    def _build_ann(self, rows: int):
+        vectors = self.vectors()
+        batch_rows = max(settings.EMBEDDING_ANN_BUILD_BATCH_ROWS, 1)
+
+        with self._ann_lock:
+            if self._ann is None:
+                self._ann = faiss.IndexHNSWFlat(self.dim, 32, faiss.METRIC_INNER_PRODUCT)
+
+        while self._ann_rows < rows:
+            batch = np.ascontiguousarray(vectors[self._ann_rows:self._ann_rows + batch_rows])
+            # Searches wait for at most one batch
+            with self._ann_lock:
+                self._ann.add(batch)
+                self._ann_rows += len(batch)
+
+        logger.info("Embedding graph extended", rows=self._ann_rows)
+
+    def similar(self, query: np.ndarray, k: int, level: str = "slice",
+                exclude_job_id: Optional[str] = None, approximate: bool = False) -> List[Dict[str, Any]]:
+        """
+        Top-k matches for a query embedding, as slices or as series.
+
+        Matches from `exclude_job_id` and repeated rows of the same slice are
+        skipped; candidates are fetched EMBEDDING_SEARCH_OVERSAMPLE per match
+        and widened until k remain or the index is exhausted. A series scores
+        as its best matching slice.
+        """
+        total = len(self.vectors())
+        if not total or k < 1:
+            return []
+        candidates = k * max(settings.EMBEDDING_SEARCH_OVERSAMPLE, 1)
+
+        while True:
+            rows, scores = self.search(query, min(candidates, total), approximate=approximate)
+            matches = self._collect(rows, scores, k, level, exclude_job_id)
+            if len(matches) >= k or candidates >= total:
+                return matches
+            candidates *= 4
+
+    def _collect(self, rows: np.ndarray, scores: np.ndarray, k: int, level: str,
+                 exclude_job_id: Optional[str]) -> List[Dict[str, Any]]:
+        matches: Dict[Tuple, Dict[str, Any]] = {}
+        for record, score in zip(self.records(rows.tolist()), scores.tolist()):
+            if record["job_id"] == exclude_job_id:
+                continue
+
+            if level == "series":
+                key = (record["job_id"], record.get("series_instance_uid"))
+                if key in matches:
+                    matches[key]["matching_slices"] += 1
+                    continue
+                record = {
+                    "job_id": record["job_id"],
+                    "series_instance_uid": record.get("series_instance_uid"),
+                    "study_instance_uid": record.get("study_instance_uid"),
+                    "patient_id": record.get("patient_id"),
+                    "modality": record.get("modality"),
+                    "best_preview_id": record.get("preview_id"),
+                    "matching_slices": 1
+                }
+            else:
+                key = (record["job_id"], record.get("preview_id") or record.get("file_path"))
+                if key in matches:
+                    continue
+
+            # Rows arrive best first, so the first one seen per key is its score
+            record["score"] = score
+            matches[key] = record
+
+        return list(matches.values())[:k]
+
+    def stats(self) -> Dict[str, Any]:
+        """Index statistics for the metrics endpoint"""
+        rows = len(self.vectors())
+        return {
+            "rows": rows,
+            "dim": self.dim,
+            "size_mb": round(rows * (self.dim or 0) * 4 / (1024 * 1024), 1),
+            "appended": self.appended,
+            "searches": self.searches,
+            "approximate_available": FAISS_AVAILABLE,
+            "approximate_rows": self._ann_rows
+        }
+
+
+def _top(scores: np.ndarray, count: int) -> np.ndarray:
+    """Indices of the `count` highest scores, unordered"""
+    if len(scores) <= count:
+        return np.arange(len(scores))
+    return np.argpartition(scores, -count)[-count:]
@@ -0,0 +1,193 @@
+"""
+Inference Server
+Dedicated process that owns the models and serves predictions to API workers
+over a local socket, with pixel tensors passed through shared memory
+"""
+import asyncio
+import itertools
+import os
+import queue
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, Tuple
+import numpy as np
+import structlog
+
+from app.core.config import settings
+
+logger = structlog.get_logger(__name__)
+
+
+def inference_socket_paths() -> List[str]:
+    """Socket path of every configured inference server"""
+    return [
+        os.path.join(settings.INFERENCE_SOCKET_DIR, f"pixelence-inference-{index}.sock")
+        for index in range(max(settings.INFERENCE_SERVER_COUNT, 1))
+    ]
+
+
+def _authkey() -> bytes:
+    return settings.SECRET_KEY.encode()
+
+
+def _attach_shared_memory(name: str) -> SharedMemory:
+    """Attach to a client's segment without this process taking ownership of it"""
+    shm = SharedMemory(name=name)
+    # The client creates and unlinks the segment; stop the resource tracker
+    # from unlinking it (and warning) when this process exits
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _serve_connection(connection: Connection, model):
+    """Answer requests from one API worker connection until it closes"""
+    with connection:
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, OSError):
+                return
+
+            operation = request[0]
+
+            if operation == "ping":
+                connection.send(("ok", None))
+                continue
+
+            if operation != "predict":
+                connection.send(("error", f"Unknown operation: {operation}"))
+                continue
+
+            _, shm_name, shape, dtype = request
+            shm = None
+            try:
+                shm = _attach_shared_memory(shm_name)
+                images = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+                # One array, or [predictions, embeddings] with an embedding output
+                outputs = model.predict(images, verbose=0)
+                del images
+                connection.send(("ok", outputs))
+            except Exception as e:
+                logger.error("Inference request failed", error=str(e))
+                connection.send(("error", str(e)))
+            finally:
+                if shm is not None:
+                    shm.close()
+
+
+def run_inference_server(socket_path: str):
+    """Load the models and serve predictions on `socket_path` (process entry point)"""
+    from app.core.logging import setup_logging
+    from app.services.ml_processor import MLProcessor
+
+    setup_logging()
+    # This process owns the model, whatever mode the API workers run in
+    settings.INFERENCE_MODE = "local"
+    # Only runs the model; API workers decode, so no decode pool here
+    processor = MLProcessor(decode_processes=1)
+    asyncio.run(processor.warm_up())
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    listener = Listener(socket_path, family="AF_UNIX", authkey=_authkey())
+    logger.info("Inference server listening", socket_path=socket_path)
+
+    try:
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                logger.warning("Rejected inference connection", error=str(e))
+                continue
+
+            threading.Thread(
+                target=_serve_connection, args=(connection, processor.model), daemon=True
+            ).start()
+    finally:
+        listener.close()
+
+
+class RemoteInferenceClient:
+    """
+    Client side of the inference servers.
+
+    Exposes `predict(images, verbose=0)` like a Keras model, so MLProcessor
+    can use it in place of a local model. Connections are pooled and spread
+    over the configured servers round-robin; calls block and are meant to be
+    run off the event loop.
+    """
+
+    def __init__(self, socket_paths: List[str] = None):
+        self.socket_paths = socket_paths or inference_socket_paths()
+        self._next_path = itertools.cycle(self.socket_paths)
+        self._path_lock = threading.Lock()
+        self._idle: "queue.Queue[Connection]" = queue.Queue()
+
+    def _acquire(self) -> Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            with self._path_lock:
+                path = next(self._next_path)
+            return Client(path, family="AF_UNIX", authkey=_authkey())
+
+    def _call(self, request: Tuple) -> Any:
+        connection = self._acquire()
+        try:
+            connection.send(request)
+            status, payload = connection.recv()
+        except Exception:
+            # Drop connections that failed mid-request
+            connection.close()
+            raise
+
+        self._idle.put(connection)
+        if status != "ok":
+            raise RuntimeError(f"Inference server error: {payload}")
+        return payload
+
+    def ping(self):
+        """Round-trip a no-op request"""
+        self._call(("ping",))
+
+    def wait_until_available(self, timeout: float):
+        """Block until every inference server answers, e.g. while models load"""
+        deadline = time.monotonic() + timeout
+        for path in self.socket_paths:
+            while True:
+                try:
+                    with Client(path, family="AF_UNIX", authkey=_authkey()) as connection:
+                        connection.send(("ping",))
+                        connection.recv()
+                    break
+                except (OSError, EOFError):
+                    if time.monotonic() > deadline:
+                        raise TimeoutError("Inference servers did not become available")
+                    time.sleep(0.5)
+
+    def predict(self, images: np.ndarray, verbose: int = 0):
+        """
+        Run a batch through the remote model; the pixels travel via shared
+        memory. Returns what the model's predict returns, including every
+        output of a multi-output model.
+        """
+        images = np.ascontiguousarray(images)
+        shm = SharedMemory(create=True, size=max(images.nbytes, 1))
+        try:
+            np.ndarray(images.shape, dtype=images.dtype, buffer=shm.buf)[...] = images
+            return self._call(("predict", shm.name, images.shape, images.dtype.str))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def close(self):
+        """Close pooled connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
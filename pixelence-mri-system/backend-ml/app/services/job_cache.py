@@ -0,0 +1,110 @@
+"""
+Job Record Cache
+In-process LRU of encoded job records, bounded by size and age
+"""
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class JobRecordCache:
+    """
+    Size- and TTL-bounded LRU cache of job records.
+
+    Records are kept as their JSON encoding and decoded on every `get`, so
+    callers get their own copy and cannot corrupt the cache by mutating it.
+
+    Every write and invalidation of a job bumps a generation counter. A
+    record read from Redis is cached with the generation taken before the
+    read (see `generation`) and dropped if the job changed meanwhile, so a
+    slow read cannot re-cache a record that was already superseded.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        # Generation of the latest change of recently changed jobs; changes
+        # older than `_floor` are forgotten and treated as just happened
+        self._generation = 0
+        self._changed: "OrderedDict[str, int]" = OrderedDict()
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of a cached record, or None if absent or expired"""
+        entry = self._entries.get(job_id)
+
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[job_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(job_id)
+        self.hits += 1
+        return json.loads(entry[1])
+
+    def generation(self) -> int:
+        """Token to pass to `put` for a record read after this call"""
+        return self._generation
+
+    def put(self, job_id: str, job_data: str, generation: Optional[int] = None):
+        """
+        Cache an encoded record, evicting the least recently used beyond
+        max_size. Without `generation` the record is a write of this process
+        and always cached; with it, it is skipped if the job changed since.
+        """
+        if generation is None:
+            self._mark_changed(job_id)
+        elif self._changed.get(job_id, self._floor) > generation:
+            self.stale_puts += 1
+            return
+
+        if self.max_size <= 0:
+            return
+
+        self._entries[job_id] = (time.monotonic() + self.ttl_seconds, job_data)
+        self._entries.move_to_end(job_id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, job_id: str):
+        """Drop a record after it changed elsewhere"""
+        self._mark_changed(job_id)
+        if self._entries.pop(job_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        """Drop every record, e.g. when invalidations may have been missed"""
+        self._generation += 1
+        self._floor = self._generation
+        self._changed.clear()
+        self._entries.clear()
+
+    def _mark_changed(self, job_id: str):
+        self._generation += 1
+        self._changed[job_id] = self._generation
+        self._changed.move_to_end(job_id)
+
+        while len(self._changed) > max(self.max_size, 1):
+            _, forgotten = self._changed.popitem(last=False)
+            self._floor = max(self._floor, forgotten)
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache statistics for the metrics endpoint"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "stale_puts": self.stale_puts
+        }
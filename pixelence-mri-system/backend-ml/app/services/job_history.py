@@ -0,0 +1,259 @@
+"""
+Job History Service
+Write-behind persistence of terminal jobs to SQL, and indexed history queries
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import structlog
+
+from app.core.config import settings
+from app.db import session as db_session
+from app.db.models import JobHistory
+
+logger = structlog.get_logger(__name__)
+
+UPSERT_COLUMNS = (
+    "status", "priority", "tenant", "finished_at", "file_count",
+    "processing_time", "primary_finding", "error", "result"
+)
+
+
+def _parse_timestamp(value: Optional[str]) -> datetime:
+    return datetime.fromisoformat(value) if value else datetime.utcnow()
+
+
+def job_to_row(job_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten a Redis job record into a job_history row"""
+    result = job_dict.get("result") or {}
+    assessment = (result.get("results") or {}).get("overall_assessment") or {}
+
+    return {
+        "job_id": job_dict["job_id"],
+        "job_type": job_dict.get("job_type", "unknown"),
+        "status": job_dict["status"],
+        "priority": job_dict.get("priority"),
+        "tenant": job_dict.get("tenant"),
+        "created_at": _parse_timestamp(job_dict.get("created_at")),
+        "finished_at": _parse_timestamp(job_dict.get("updated_at")),
+        "file_count": result.get("file_count"),
+        "processing_time": result.get("processing_time"),
+        "primary_finding": assessment.get("primary_finding"),
+        "error": job_dict.get("error"),
+        "result": job_dict.get("result")
+    }
+
+
+class JobHistoryStore:
+    """
+    Buffers terminal job records and flushes them in batched upserts.
+
+    Records are flushed when JOB_HISTORY_BATCH_SIZE rows are buffered or
+    JOB_HISTORY_FLUSH_INTERVAL_SECONDS have passed. The buffer holds at most
+    JOB_HISTORY_BUFFER_SIZE rows; when it is full, writers wait up to
+    JOB_HISTORY_ENQUEUE_TIMEOUT_SECONDS and the record is dropped after that.
+    A batch that fails to flush is retried after an exponential backoff, up
+    to JOB_HISTORY_FLUSH_MAX_ATTEMPTS times, before it is dropped.
+    """
+
+    def __init__(self):
+        self._buffer: asyncio.Queue = asyncio.Queue(maxsize=settings.JOB_HISTORY_BUFFER_SIZE)
+        self._flush_task: Optional[asyncio.Task] = None
+        # Batch being flushed or waiting for its retry
+        self._pending: List[Dict[str, Any]] = []
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flush_failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return db_session.is_db_available()
+
+    async def start(self):
+        """Start the background flusher"""
+        if self.enabled:
+            self._flush_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher after writing whatever is still buffered"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+
+        rows = self._pending + self._drain(self._buffer.qsize())
+        self._pending = []
+        if rows and not await self._flush(rows):
+            self.rows_dropped += len(rows)
+
+    async def record(self, job_dict: Dict[str, Any]):
+        """Queue a terminal job record for persistence"""
+        if not self.enabled:
+            return
+
+        try:
+            await asyncio.wait_for(
+                self._buffer.put(job_to_row(job_dict)),
+                settings.JOB_HISTORY_ENQUEUE_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            self.rows_dropped += 1
+            logger.warning("Job history buffer full, record dropped", job_id=job_dict["job_id"])
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        rows = []
+        while len(rows) < limit and not self._buffer.empty():
+            rows.append(self._buffer.get_nowait())
+        return rows
+
+    async def _run(self):
+        while True:
+            # Block for the first row, then gather more until size or time triggers
+            rows = [await self._buffer.get()]
+            flush_at = time.monotonic() + settings.JOB_HISTORY_FLUSH_INTERVAL_SECONDS
+
+            while len(rows) < settings.JOB_HISTORY_BATCH_SIZE:
+                remaining = flush_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(self._buffer.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+                rows.extend(self._drain(settings.JOB_HISTORY_BATCH_SIZE - len(rows)))
+
+            await self._flush_with_retry(rows)
+
+    async def _flush_with_retry(self, rows: List[Dict[str, Any]]):
+        # Retried in place, so a later record of the same job is never
+        # written before this one
+        self._pending = rows
+        attempts = max(settings.JOB_HISTORY_FLUSH_MAX_ATTEMPTS, 1)
+
+        for attempt in range(1, attempts + 1):
+            if await self._flush(rows):
+                self._pending = []
+                return
+            if attempt < attempts:
+                await asyncio.sleep(settings.JOB_HISTORY_RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+
+        self._pending = []
+        self.rows_dropped += len(rows)
+        logger.error("Job history batch dropped", rows=len(rows), attempts=attempts)
+
+    async def _flush(self, rows: List[Dict[str, Any]]) -> bool:
+        """Upsert a batch of rows in one multi-row statement; returns whether it was written"""
+        # A retried job reaches a terminal status again; keep the latest
+        latest = {row["job_id"]: row for row in rows}
+        rows = list(latest.values())
+
+        dialect = db_session.engine.dialect.name
+        insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+        statement = insert(JobHistory).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[JobHistory.job_id],
+            set_={column: statement.excluded[column] for column in UPSERT_COLUMNS}
+        )
+
+        try:
+            async with db_session.async_session_maker() as session:
+                await session.execute(statement)
+                await session.commit()
+            self.rows_written += len(rows)
+            return True
+        except Exception as e:
+            self.flush_failures += 1
+            logger.error("Failed to flush job history", rows=len(rows), error=str(e))
+            return False
+
+    async def finished_jobs(self, job_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Status and finish time of those of `job_ids` that are in history"""
+        found: Dict[str, Dict[str, Any]] = {}
+
+        async with db_session.async_session_maker() as session:
+            # Chunked to stay under the database's bound parameter limit
+            for start in range(0, len(job_ids), 500):
+                rows = await session.execute(
+                    select(JobHistory.job_id, JobHistory.status, JobHistory.finished_at)
+                    .where(JobHistory.job_id.in_(job_ids[start:start + 500]))
+                )
+                for job_id, status, finished_at in rows:
+                    found[job_id] = {"status": status, "finished_at": finished_at.isoformat()}
+        return found
+
+    async def count_by_status_since(self, status: str, since: datetime) -> int:
+        """Count jobs with a status created after `since`"""
+        async with db_session.async_session_maker() as session:
+            count = await session.scalar(
+                select(func.count())
+                .select_from(JobHistory)
+                .where(JobHistory.status == status, JobHistory.created_at > since)
+            )
+        return count or 0
+
+    async def daily_counts(self, days: int = 7) -> Dict[str, Dict[str, int]]:
+        """Job counts per day and status over the last `days` days"""
+        since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) \
+            - timedelta(days=days - 1)
+        day = func.date(JobHistory.created_at)
+
+        async with db_session.async_session_maker() as session:
+            rows = await session.execute(
+                select(day, JobHistory.status, func.count())
+                .where(JobHistory.created_at >= since)
+                .group_by(day, JobHistory.status)
+            )
+
+        counts: Dict[str, Dict[str, int]] = {}
+        for row_day, status, count in rows:
+            counts.setdefault(str(row_day), {})[status] = count
+        return counts
+
+    async def query(self, status: str = None, tenant: str = None,
+                    since: datetime = None, until: datetime = None,
+                    limit: int = 100) -> List[Dict[str, Any]]:
+        """Historical jobs, newest first, without their full results"""
+        statement = select(JobHistory).order_by(JobHistory.created_at.desc()).limit(limit)
+
+        if status:
+            statement = statement.where(JobHistory.status == status)
+        if tenant:
+            statement = statement.where(JobHistory.tenant == tenant)
+        if since:
+            statement = statement.where(JobHistory.created_at >= since)
+        if until:
+            statement = statement.where(JobHistory.created_at < until)
+
+        async with db_session.async_session_maker() as session:
+            records = (await session.scalars(statement)).all()
+
+        return [
+            {
+                "job_id": record.job_id,
+                "job_type": record.job_type,
+                "status": record.status,
+                "priority": record.priority,
+                "tenant": record.tenant,
+                "created_at": record.created_at.isoformat(),
+                "finished_at": record.finished_at.isoformat(),
+                "file_count": record.file_count,
+                "processing_time": record.processing_time,
+                "primary_finding": record.primary_finding,
+                "error": record.error
+            }
+            for record in records
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        """Persister statistics for the metrics endpoint"""
+        return {
+            "enabled": self.enabled,
+            "buffered": self._buffer.qsize(),
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "flush_failures": self.flush_failures
+        }
@@ -2,104 +2,826 @@
 Job Manager Service
 Handles async job processing and status tracking with Redis
 """
+import asyncio
 import json
+import random
 import uuid
 import time
-from typing import Dict, List, Optional, Any
+from typing import Any, Callable, Dict, List, Optional
 from datetime import datetime, timedelta
 import redis.asyncio as redis
+from redis.exceptions import WatchError
 import structlog
 
 from app.core.config import settings
+from app.services.job_cache import JobRecordCache
+from app.services.job_history import JobHistoryStore
 
 logger = structlog.get_logger(__name__)
 
+# Queue lanes in priority order. Strict lanes are always served first; the
+# remaining lanes age, so a job waiting QUEUE_AGING_SECONDS competes as if it
+# were one lane higher.
+PRIORITY_LANES = ("urgent", "high", "normal", "low")
+STRICT_PRIORITY_LANES = ("urgent",)
+DEFAULT_PRIORITY = "normal"
+DEFAULT_TENANT = "default"
+
+# Jobs, and the submission keys pointing at them, expire after 24 hours
+JOB_TTL_SECONDS = 86400
+
+# Once a job reaches one of these it is never moved to another status,
+# except by an explicit retry of a failed job
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# A job given again with a new upload must have stopped in one of these
+RESUBMITTABLE_STATUSES = ("failed", "cancelled")
+
+# Child jobs of a sharded job; their results live on in the parent, so
+# they are not persisted to job history
+SHARD_JOB_TYPE = "dicom_shard"
+
+
+class DuplicateJobError(Exception):
+    """Raised when a submission matches an existing job"""
+
+    def __init__(self, job_id: str):
+        super().__init__(f"Duplicate of job {job_id}")
+        self.job_id = job_id
+
 
 class JobManager:
     """Manages async processing jobs"""
 
-    def __init__(self, redis_client: redis.Redis):
+    def __init__(self, redis_client: redis.Redis, history: JobHistoryStore = None):
         self.redis = redis_client
+        # Terminal jobs are handed to the history store for SQL persistence
+        self.history = history
         self.job_prefix = "pixelence:job:"
-        self.queue_name = "pixelence:processing_queue"
+        self.queue_prefix = "pixelence:queue:"
+        self.submission_prefix = "pixelence:submission:"
+        self.running_key = "pixelence:running"
+        self.lease_key = "pixelence:leases"
+        self.backlog_key = "pixelence:backlog"
+        self.retry_key = "pixelence:retry_schedule"
+        self.dead_letter_key = "pixelence:dead_letter"
+        self.invalidation_channel = "pixelence:job_invalidations"
+
+        # Records of hot jobs; kept coherent across processes by publishing
+        # the job id on every write
+        self.instance_id = uuid.uuid4().hex
+        self.cache = JobRecordCache(settings.JOB_CACHE_MAX_SIZE, settings.JOB_CACHE_TTL_SECONDS)
+        self._invalidation_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start listening for job record invalidations"""
+        self._invalidation_task = asyncio.create_task(self._listen_for_invalidations())
+
+    async def stop(self):
+        """Stop listening for job record invalidations"""
+        if self._invalidation_task:
+            self._invalidation_task.cancel()
+            await asyncio.gather(self._invalidation_task, return_exceptions=True)
+            self._invalidation_task = None
+
+    async def _listen_for_invalidations(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.invalidation_channel)
+                # Writes made while unsubscribed were missed
+                self.cache.clear()
+
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    origin, _, job_id = message["data"].partition(":")
+                    if origin != self.instance_id:
+                        self.cache.invalidate(job_id)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Job invalidation listener disconnected", error=str(e))
+                self.cache.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    async def _job_written(self, job_id: str, job_dict: Optional[Dict[str, Any]]):
+        """Refresh the local cache and tell other processes a job record changed"""
+        if job_dict is None:
+            self.cache.invalidate(job_id)
+        else:
+            self.cache.put(job_id, json.dumps(job_dict))
+        await self.redis.publish(self.invalidation_channel, f"{self.instance_id}:{job_id}")
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Job record cache statistics"""
+        return self.cache.stats()
+
+    def _tenant_queue_key(self, lane: str, tenant: str) -> str:
+        """FIFO list of a tenant's jobs within a lane"""
+        return f"{self.queue_prefix}{lane}:tenant:{tenant}"
+
+    def _lane_tenants_key(self, lane: str) -> str:
+        """Sorted set of tenants with queued jobs, scored by virtual service time"""
+        return f"{self.queue_prefix}{lane}:tenants"
+
+    def _lane_waiting_key(self, lane: str) -> str:
+        """Sorted set of queued job ids in a lane, scored by enqueue time"""
+        return f"{self.queue_prefix}{lane}:waiting"
+
+    async def create_job(self, job_type: str, payload: Dict[str, Any],
+                         priority: str = DEFAULT_PRIORITY, tenant: str = None,
+                         job_id: str = None, enqueue: bool = True,
+                         submission_keys: List[str] = None) -> str:
+        """
+        Create a new processing job.
+
+        `priority` selects the queue lane and `tenant` (e.g. the facility) the
+        fair-share bucket within it. With `enqueue=False` the job is only
+        recorded; call `enqueue_job` once its inputs are in place.
+
+        `submission_keys` (see `submission_keys`) make creation idempotent:
+        if any key already maps to a live job (one that has not failed or
+        been cancelled), DuplicateJobError is raised with that job's id and
+        nothing is created.
+        """
+        if priority not in PRIORITY_LANES:
+            raise ValueError(f"Invalid priority: {priority}")
 
-    async def create_job(self, job_type: str, payload: Dict[str, Any]) -> str:
-        """Create a new processing job"""
-        job_id = str(uuid.uuid4())
+        job_id = job_id or str(uuid.uuid4())
         job_key = f"{self.job_prefix}{job_id}"
 
         job_data = {
             "job_id": job_id,
             "job_type": job_type,
             "status": "pending",
+            "priority": priority,
+            "tenant": tenant or DEFAULT_TENANT,
             "payload": payload,
             "created_at": datetime.utcnow().isoformat(),
             "updated_at": datetime.utcnow().isoformat(),
             "progress": 0,
             "result": None,
+            "partial_result": None,
             "error": None
         }
 
-        # Store job data
-        await self.redis.set(job_key, json.dumps(job_data))
+        # Store job data, expiring after 24 hours
+        if submission_keys:
+            await self._claim_submission(job_key, job_data, submission_keys)
+        else:
+            await self.redis.set(job_key, json.dumps(job_data), ex=JOB_TTL_SECONDS)
+        await self._job_written(job_id, job_data)
 
         # Add to processing queue
-        await self.redis.lpush(self.queue_name, job_id)
+        if enqueue:
+            await self._enqueue(job_id, job_data["priority"], job_data["tenant"])
 
-        # Set expiration (24 hours)
-        await self.redis.expire(job_key, 86400)
-
-        logger.info("Job created", job_id=job_id, job_type=job_type)
+        logger.info("Job created",
+                   job_id=job_id,
+                   job_type=job_type,
+                   priority=priority,
+                   tenant=job_data["tenant"])
         return job_id
 
+    def submission_keys(self, tenant: str = None, idempotency_key: str = None,
+                        content_digest: str = None) -> List[str]:
+        """Build the dedup keys identifying a submission, scoped to its tenant"""
+        tenant = tenant or DEFAULT_TENANT
+        keys = []
+        if idempotency_key:
+            keys.append(f"{self.submission_prefix}{tenant}:key:{idempotency_key}")
+        if content_digest:
+            keys.append(f"{self.submission_prefix}{tenant}:content:{content_digest}")
+        return keys
+
+    async def _claim_submission(self, job_key: str, job_data: Dict[str, Any],
+                                submission_keys: List[str]):
+        """
+        Store a new job and point its submission keys at it in one transaction,
+        or raise if a key belongs to a live job. The keys are watched, so of
+        two concurrent submissions exactly one is created.
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(*submission_keys)
+                    for key in submission_keys:
+                        existing_id = await pipe.get(key)
+                        if existing_id and await self._is_live_submission(existing_id):
+                            logger.info("Duplicate submission", job_id=existing_id)
+                            raise DuplicateJobError(existing_id)
+
+                    # Unclaimed, or the job expired, failed or was cancelled;
+                    # the submission may run again
+                    pipe.multi()
+                    pipe.set(job_key, json.dumps(job_data), ex=JOB_TTL_SECONDS)
+                    for key in submission_keys:
+                        pipe.set(key, job_data["job_id"], ex=JOB_TTL_SECONDS)
+                    await pipe.execute()
+                    return
+
+                except WatchError:
+                    continue
+
+    async def _is_live_submission(self, job_id: str) -> bool:
+        """Whether a job still stands for its submission; failed and cancelled ones do not"""
+        existing = await self.get_job_status(job_id)
+        return existing is not None and existing["status"] not in ("failed", "cancelled")
+
+    async def release_submission(self, job_id: str, submission_keys: List[str]):
+        """Free submission keys still pointing at a job, e.g. after its upload failed"""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for key in submission_keys:
+                try:
+                    await pipe.watch(key)
+                    if await pipe.get(key) == job_id:
+                        pipe.multi()
+                        pipe.delete(key)
+                        await pipe.execute()
+                except WatchError:
+                    # Claimed by another submission meanwhile
+                    pass
+                finally:
+                    await pipe.reset()
+
+    async def find_duplicate_job(self, submission_keys: List[str]) -> Optional[str]:
+        """Id of a live job already created for one of the submission keys"""
+        for key in submission_keys:
+            existing_id = await self.redis.get(key)
+            if existing_id and await self._is_live_submission(existing_id):
+                return existing_id
+        return None
+
+    async def enqueue_job(self, job_id: str) -> bool:
+        """Queue an existing job in its priority lane"""
+        job_dict = await self.get_job_status(job_id)
+
+        if not job_dict:
+            return False
+
+        await self._add_to_backlog(job_dict)
+        await self._enqueue(
+            job_id,
+            job_dict.get("priority", DEFAULT_PRIORITY),
+            job_dict.get("tenant", DEFAULT_TENANT)
+        )
+        return True
+
+    async def _add_to_backlog(self, job_dict: Dict[str, Any]):
+        """Count a job's slices as outstanding work until it finishes"""
+        if job_dict["job_type"] == SHARD_JOB_TYPE:
+            # Already counted in full by the parent until it is reduced
+            return
+
+        payload = job_dict.get("payload") or {}
+        slices = payload.get("estimated_slices") or payload.get("file_count") or 1
+        await self.redis.hset(self.backlog_key, job_dict["job_id"], slices)
+
+    async def remove_from_backlog(self, *job_ids: str):
+        """Stop counting jobs as outstanding work"""
+        if job_ids:
+            await self.redis.hdel(self.backlog_key, *job_ids)
+
+    async def sweep_backlog(self) -> int:
+        """Drop backlog entries of jobs that expired, were deleted or finished unnoticed"""
+        stale = []
+        for job_id in await self.redis.hkeys(self.backlog_key):
+            job_dict = await self.get_job_status(job_id)
+            if job_dict is None or job_dict["status"] in TERMINAL_STATUSES:
+                stale.append(job_id)
+
+        await self.remove_from_backlog(*stale)
+        if stale:
+            logger.info("Stale backlog entries removed", count=len(stale))
+        return len(stale)
+
+    async def get_backlog_slices(self) -> int:
+        """Slices of all queued and processing jobs"""
+        values = await self.redis.hvals(self.backlog_key)
+        return sum(int(value) for value in values)
+
+    async def update_job_payload(self, job_id: str, **updates) -> bool:
+        """Merge fields into a job's payload"""
+        def apply(job_dict: Dict[str, Any]) -> bool:
+            job_dict["payload"].update(updates)
+            return True
+
+        return await self._modify_job(job_id, apply) is not None
+
+    async def _enqueue(self, job_id: str, lane: str, tenant: str):
+        """
+        Push a job onto its tenant's list within a lane.
+
+        The push and the tenant joining the lane's rotation are one
+        transaction, watched against concurrent pops (see `_pop_from_lane`).
+        """
+        tenants_key = self._lane_tenants_key(lane)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(tenants_key)
+
+                    # Tenants joining a lane start at the lane's current virtual time so
+                    # an idle tenant cannot bank credit and then monopolise the lane
+                    lowest = await pipe.zrange(tenants_key, 0, 0, withscores=True)
+                    start_pass = lowest[0][1] if lowest else 0.0
+
+                    pipe.multi()
+                    pipe.lpush(self._tenant_queue_key(lane, tenant), job_id)
+                    pipe.zadd(tenants_key, {tenant: start_pass}, nx=True)
+                    pipe.zadd(self._lane_waiting_key(lane), {job_id: time.time()})
+                    await pipe.execute()
+                    return
+
+                except WatchError:
+                    continue
+
     async def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
-        """Get job status"""
+        """Get job status, from the local cache when it holds the record"""
+        job_dict = self.cache.get(job_id)
+        if job_dict is not None:
+            return job_dict
+
+        # Taken before the read, so a change arriving meanwhile is not overwritten
+        generation = self.cache.generation()
         job_key = f"{self.job_prefix}{job_id}"
         job_data = await self.redis.get(job_key)
 
         if not job_data:
             return None
 
+        self.cache.put(job_id, job_data, generation)
         return json.loads(job_data)
 
     async def update_job_status(self, job_id: str, status: str,
                               progress: int = None, result: Any = None,
-                              error: str = None):
-        """Update job status"""
-        job_key = f"{self.job_prefix}{job_id}"
-        job_data = await self.redis.get(job_key)
+                              error: str = None, partial_result: Dict[str, Any] = None,
+                              run_id: str = None):
+        """
+        Update job status.
 
-        if not job_data:
-            logger.warning("Attempted to update non-existent job", job_id=job_id)
-            return
+        Terminal statuses are final: updating a completed, failed or cancelled
+        job is ignored, so a worker finishing late cannot overwrite a
+        cancellation. With the `run_id` from `start_processing`, the update
+        is also ignored once that run is no longer the job's current one.
+        Returns whether the update was applied.
+        """
+        def apply(job_dict: Dict[str, Any]) -> bool:
+            if job_dict["status"] in TERMINAL_STATUSES:
+                return False
+            if run_id is not None and not self._is_current_run(job_dict, run_id):
+                return False
 
-        job_dict = json.loads(job_data)
-        job_dict["status"] = status
-        job_dict["updated_at"] = datetime.utcnow().isoformat()
+            job_dict["status"] = status
 
-        if progress is not None:
-            job_dict["progress"] = progress
+            if progress is not None:
+                job_dict["progress"] = progress
 
-        if result is not None:
-            job_dict["result"] = result
+            if result is not None:
+                job_dict["result"] = result
 
-        if error is not None:
-            job_dict["error"] = error
+            if partial_result is not None:
+                job_dict["partial_result"] = partial_result
 
-        await self.redis.set(job_key, json.dumps(job_dict))
+            if error is not None:
+                job_dict["error"] = error
+
+            return True
+
+        job_dict = await self._modify_job(job_id, apply)
+
+        if job_dict is None:
+            logger.warning("Job status update skipped",
+                          job_id=job_id,
+                          status=status)
+            return False
+
+        if status in TERMINAL_STATUSES:
+            await self._stop_running(job_id)
 
         logger.info("Job status updated",
                    job_id=job_id,
                    status=status,
                    progress=progress)
+        return True
+
+    async def fail_job(self, job_id: str, error: str, progress: int = None,
+                       run_id: str = None) -> bool:
+        """
+        Mark a job failed and schedule its automatic retry.
+
+        Each failure counts an attempt. Until JOB_MAX_ATTEMPTS runs have
+        failed, the job is put on the retry schedule after an exponential
+        backoff with jitter; after that it goes to the dead-letter list.
+        Shard jobs are never retried on their own; their parent is.
+        `run_id` works as for `update_job_status`. Returns whether the job
+        was marked failed.
+        """
+        retry_at = None
+
+        def apply(job_dict: Dict[str, Any]) -> bool:
+            nonlocal retry_at
+            if job_dict["status"] in TERMINAL_STATUSES:
+                return False
+            if run_id is not None and not self._is_current_run(job_dict, run_id):
+                return False
+
+            attempts = job_dict.get("attempts", 0) + 1
+            retryable = job_dict["job_type"] != SHARD_JOB_TYPE
+            retry_at = None
+            if retryable and attempts < settings.JOB_MAX_ATTEMPTS:
+                retry_at = time.time() + self._retry_delay(attempts)
+
+            job_dict["status"] = "failed"
+            job_dict["error"] = error
+            job_dict["attempts"] = attempts
+            job_dict["next_retry_at"] = retry_at
+            job_dict["dead_lettered"] = retryable and retry_at is None
+            if progress is not None:
+                job_dict["progress"] = progress
+            return True
+
+        def schedule(pipe, job_dict: Dict[str, Any]):
+            # In the same transaction as the status, so a failed job is
+            # never left off the retry schedule
+            pipe.zrem(self.running_key, job_id)
+            pipe.zrem(self.lease_key, job_id)
+            if retry_at is not None:
+                pipe.zadd(self.retry_key, {job_id: retry_at})
+            elif job_dict["dead_lettered"]:
+                pipe.lpush(self.dead_letter_key, job_id)
+                pipe.ltrim(self.dead_letter_key, 0, settings.DEAD_LETTER_MAX_SIZE - 1)
+
+        job_dict = await self._modify_job(job_id, apply, schedule)
+
+        if job_dict is None:
+            logger.warning("Job failure not recorded", job_id=job_id)
+            return False
+
+        if retry_at is not None:
+            logger.info("Job retry scheduled",
+                       job_id=job_id,
+                       attempts=job_dict["attempts"],
+                       retry_in=f"{retry_at - time.time():.0f}s")
+        elif job_dict["dead_lettered"]:
+            logger.warning("Job dead-lettered",
+                          job_id=job_id,
+                          attempts=job_dict["attempts"],
+                          error=error)
+        return True
+
+    @staticmethod
+    def _retry_delay(attempts: int) -> float:
+        """Exponential backoff with jitter: half the capped delay plus up to half again"""
+        delay = min(
+            settings.RETRY_MAX_DELAY_SECONDS,
+            settings.RETRY_BASE_DELAY_SECONDS * 2 ** (attempts - 1)
+        )
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def promote_due_retries(self) -> int:
+        """
+        Requeue failed jobs whose retry time has come, at most
+        RETRY_PROMOTE_BATCH_SIZE per call.
+
+        An entry leaves the schedule only once its job is queued, so a
+        poller stopping part-way leaves it due for the next poll.
+        """
+        due = await self.redis.zrangebyscore(
+            self.retry_key, 0, time.time(), start=0, num=settings.RETRY_PROMOTE_BATCH_SIZE
+        )
+
+        promoted = 0
+        for job_id in due:
+            job_dict = await self.get_job_status(job_id)
+            status = job_dict["status"] if job_dict else None
+
+            if status == "failed":
+                # Of concurrent pollers only one moves the job to pending
+                if await self.retry_failed_job(job_id, reset_attempts=False):
+                    promoted += 1
+            elif status == "pending":
+                # Promoted by a poller that stopped before queueing it; a
+                # job queued twice only runs once
+                await self._enqueue(
+                    job_id,
+                    job_dict.get("priority", DEFAULT_PRIORITY),
+                    job_dict.get("tenant", DEFAULT_TENANT)
+                )
+                await self.redis.zrem(self.retry_key, job_id)
+            else:
+                # Expired, cancelled or already running
+                await self.redis.zrem(self.retry_key, job_id)
+
+        return promoted
+
+    async def get_scheduled_retries(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Failed jobs waiting for an automatic retry, soonest first"""
+        entries = await self.redis.zrange(self.retry_key, 0, limit - 1, withscores=True)
+        return [
+            {"job_id": job_id, "retry_at": datetime.utcfromtimestamp(retry_at).isoformat()}
+            for job_id, retry_at in entries
+        ]
+
+    async def get_dead_letter_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Jobs that failed every attempt, most recent first"""
+        job_ids = await self.redis.lrange(self.dead_letter_key, 0, limit - 1)
+
+        jobs = []
+        for job_id in job_ids:
+            job_dict = await self.get_job_status(job_id)
+            if job_dict:
+                jobs.append(job_dict)
+        return jobs
+
+    async def retry_stats(self) -> Dict[str, int]:
+        """Retry schedule and dead-letter sizes"""
+        return {
+            "scheduled": await self.redis.zcard(self.retry_key),
+            "dead_letter": await self.redis.llen(self.dead_letter_key)
+        }
+
+    async def _modify_job(self, job_id: str,
+                          apply: Callable[[Dict[str, Any]], bool],
+                          queue_more: Optional[Callable[[Any, Dict[str, Any]], None]] = None
+                          ) -> Optional[Dict[str, Any]]:
+        """
+        Read-modify-write a job record atomically.
+
+        `apply` mutates the decoded record and returns False to abort. The
+        write is retried if the record changed concurrently. `queue_more`
+        adds commands to the same transaction, given the pipeline and the
+        updated record. Returns the written record, or None if the job is
+        missing or `apply` aborted.
+        """
+        job_key = f"{self.job_prefix}{job_id}"
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(job_key)
+                    job_data = await pipe.get(job_key)
+
+                    if not job_data:
+                        return None
+
+                    job_dict = json.loads(job_data)
+                    if not apply(job_dict):
+                        return None
+                    job_dict["updated_at"] = datetime.utcnow().isoformat()
+
+                    pipe.multi()
+                    pipe.set(job_key, json.dumps(job_dict), keepttl=True)
+                    if queue_more:
+                        queue_more(pipe, job_dict)
+                    await pipe.execute()
+                    break
+
+                except WatchError:
+                    continue
+
+        await self._job_written(job_id, job_dict)
+
+        if job_dict["status"] in TERMINAL_STATUSES:
+            await self.remove_from_backlog(job_id)
+            if self.history and job_dict["job_type"] != SHARD_JOB_TYPE:
+                await self.history.record(job_dict)
+
+        return job_dict
+
+    async def start_processing(self, job_id: str, timeout_seconds: int = None) -> Optional[str]:
+        """
+        Move a pending job to processing and register its deadline.
+
+        Returns the id of this run, or None if the job was not pending. The
+        worker passes it to its status updates and cancellation checks, so
+        it stops, and its writes are ignored, once the job is requeued or
+        failed under it and a later run may have started.
+        """
+        timeout_seconds = timeout_seconds or settings.JOB_TIMEOUT_SECONDS
+        run_id = uuid.uuid4().hex
+
+        def apply(job_dict: Dict[str, Any]) -> bool:
+            if job_dict["status"] != "pending":
+                return False
+            job_dict["status"] = "processing"
+            job_dict["run_id"] = run_id
+            return True
+
+        if await self._modify_job(job_id, apply) is None:
+            return None
+
+        await self.redis.zadd(self.running_key, {job_id: time.time() + timeout_seconds})
+        await self.redis.zadd(self.lease_key, {job_id: time.time() + settings.JOB_LEASE_SECONDS})
+        return run_id
+
+    @staticmethod
+    def _is_current_run(job_dict: Dict[str, Any], run_id: str) -> bool:
+        return job_dict["status"] == "processing" and job_dict.get("run_id") == run_id
+
+    async def renew_leases(self, job_ids: List[str]):
+        """Extend the leases of jobs this worker is running, so they are not taken as orphaned"""
+        if job_ids:
+            expires_at = time.time() + settings.JOB_LEASE_SECONDS
+            # Only existing leases; a job that finished meanwhile must not get one back
+            await self.redis.zadd(self.lease_key, {job_id: expires_at for job_id in job_ids}, xx=True)
+
+    async def release_lease(self, job_id: str):
+        """Stop watching a processing job for a dead worker, e.g. a parent waiting on its shards"""
+        await self.redis.zrem(self.lease_key, job_id)
+
+    async def _stop_running(self, job_id: str):
+        await self.redis.zrem(self.running_key, job_id)
+        await self.release_lease(job_id)
+
+    async def requeue_orphaned_jobs(self) -> int:
+        """
+        Requeue processing jobs whose lease expired because their worker died,
+        so they resume from their checkpoint. A job orphaned JOB_MAX_ATTEMPTS
+        times is failed instead, as it may be what kills its workers.
+        """
+        expired = await self.redis.zrangebyscore(self.lease_key, 0, time.time())
+
+        requeued = 0
+        for job_id in expired:
+            # Whoever removes the lease owns the recovery
+            if not await self.redis.zrem(self.lease_key, job_id):
+                continue
+
+            def apply(job_dict: Dict[str, Any]) -> bool:
+                if job_dict["status"] != "processing":
+                    return False
+                job_dict["orphaned"] = job_dict.get("orphaned", 0) + 1
+                if job_dict["orphaned"] < settings.JOB_MAX_ATTEMPTS:
+                    # A worker that is only stalled sees its run superseded
+                    job_dict["status"] = "pending"
+                    job_dict.pop("run_id", None)
+                return True
+
+            job_dict = await self._modify_job(job_id, apply)
+            if job_dict is None:
+                continue
+
+            if job_dict["status"] == "processing":
+                await self.fail_job(job_id, "Worker stopped responding")
+                continue
+
+            await self.redis.zrem(self.running_key, job_id)
+            await self._add_to_backlog(job_dict)
+            await self._enqueue(
+                job_id,
+                job_dict.get("priority", DEFAULT_PRIORITY),
+                job_dict.get("tenant", DEFAULT_TENANT)
+            )
+            requeued += 1
+            logger.warning("Orphaned job requeued", job_id=job_id, orphaned=job_dict["orphaned"])
+
+        return requeued
+
+    async def is_job_cancelled(self, job_id: str, run_id: str = None) -> bool:
+        """
+        Check whether a job has been cancelled (or has expired), or, given
+        a `run_id`, whether that run is no longer the job's current one
+        """
+        job_dict = await self.get_job_status(job_id)
+        if job_dict is None or job_dict["status"] == "cancelled":
+            return True
+        return run_id is not None and not self._is_current_run(job_dict, run_id)
+
+    async def expire_overdue_jobs(self) -> int:
+        """
+        Fail processing jobs that are past their deadline, e.g. hung in their
+        worker. Only the overdue run is failed, in the same transaction that
+        schedules the retry, so its worker stops at its next cancellation
+        check and a run started meanwhile is left alone.
+        """
+        overdue = await self.redis.zrangebyscore(self.running_key, 0, time.time())
+
+        expired_count = 0
+        for job_id in overdue:
+            job_dict = await self.get_job_status(job_id)
+            if job_dict is None or job_dict["status"] in TERMINAL_STATUSES:
+                await self._stop_running(job_id)
+                continue
+            if job_dict["status"] != "processing":
+                continue
+
+            # Read after the run, so a restart in between shows as a new deadline
+            deadline = await self.redis.zscore(self.running_key, job_id)
+            if deadline is None or deadline > time.time():
+                continue
+
+            if await self.fail_job(job_id, "Job timed out", run_id=job_dict.get("run_id")):
+                expired_count += 1
+
+        if expired_count:
+            logger.warning("Overdue jobs failed", expired_count=expired_count)
+        return expired_count
 
     async def get_next_job(self) -> Optional[str]:
-        """Get next job from queue"""
-        job_id = await self.redis.rpop(self.queue_name)
-        return job_id
+        """
+        Get next job from queue.
+
+        Strict lanes are served first. Other lanes are ranked by their index
+        minus the age of their oldest job in QUEUE_AGING_SECONDS units, so a
+        low-priority backlog is never starved. Within the chosen lane tenants
+        are served by weighted round-robin (stride scheduling on TENANT_WEIGHTS).
+        """
+        for lane in self._lanes_by_rank(await self._oldest_waiting()):
+            job_id = await self._pop_from_lane(lane)
+            if job_id:
+                return job_id
+
+        return None
+
+    async def _oldest_waiting(self) -> Dict[str, float]:
+        """Enqueue time of the oldest job in every non-empty lane"""
+        oldest = {}
+        for lane in PRIORITY_LANES:
+            head = await self.redis.zrange(self._lane_waiting_key(lane), 0, 0, withscores=True)
+            if head:
+                oldest[lane] = head[0][1]
+        return oldest
+
+    def _lanes_by_rank(self, oldest: Dict[str, float]) -> List[str]:
+        """Order non-empty lanes by effective priority"""
+        now = time.time()
+        aging = max(settings.QUEUE_AGING_SECONDS, 1)
+
+        def rank(lane: str):
+            if lane in STRICT_PRIORITY_LANES:
+                return (0, PRIORITY_LANES.index(lane))
+            effective = PRIORITY_LANES.index(lane) - (now - oldest[lane]) / aging
+            return (1, effective)
+
+        return sorted(oldest, key=rank)
+
+    async def _pop_from_lane(self, lane: str) -> Optional[str]:
+        """
+        Pop the next job of the lane's least-served tenant.
+
+        The pop and the tenant's rotation update run in one transaction under
+        WATCH, so a concurrent enqueue can never leave a tenant with queued
+        jobs outside the rotation.
+        """
+        tenants_key = self._lane_tenants_key(lane)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(tenants_key)
+                    tenants = await pipe.zrange(tenants_key, 0, -1)
+
+                    empty = []
+                    job_id = None
+                    for tenant in tenants:
+                        tenant_queue = self._tenant_queue_key(lane, tenant)
+                        await pipe.watch(tenant_queue)
+                        queued = await pipe.llen(tenant_queue)
+                        if queued:
+                            job_id = await pipe.lindex(tenant_queue, -1)
+                            break
+                        empty.append(tenant)
+
+                    if not job_id and not empty:
+                        return None
+
+                    pipe.multi()
+                    if empty:
+                        pipe.zrem(tenants_key, *empty)
+
+                    if job_id:
+                        pipe.rpop(tenant_queue)
+                        pipe.zrem(self._lane_waiting_key(lane), job_id)
+
+                        if queued == 1:
+                            # Leave the rotation; rejoining resets to the lane's virtual time
+                            pipe.zrem(tenants_key, tenant)
+                        else:
+                            weight = settings.TENANT_WEIGHTS.get(tenant, 1.0)
+                            pipe.zincrby(tenants_key, 1.0 / max(weight, 1e-6), tenant)
+
+                    await pipe.execute()
+                    return job_id
+
+                except WatchError:
+                    continue
+
+    async def _dequeue(self, job_id: str, job_dict: Dict[str, Any]):
+        """Remove a job from its lane if it is still queued"""
+        lane = job_dict.get("priority", DEFAULT_PRIORITY)
+        tenant = job_dict.get("tenant", DEFAULT_TENANT)
+
+        await self.redis.lrem(self._tenant_queue_key(lane, tenant), 0, job_id)
+        await self.redis.zrem(self._lane_waiting_key(lane), job_id)
 
     async def get_active_jobs_count(self) -> int:
-        """Get count of active jobs"""
+        """Get count of active jobs; shards are part of their parent's job"""
         # Get all job keys
         pattern = f"{self.job_prefix}*"
         job_keys = await self.redis.keys(pattern)
@@ -109,18 +831,23 @@ class JobManager:
             job_data = await self.redis.get(key)
             if job_data:
                 job_dict = json.loads(job_data)
-                if job_dict["status"] in ["pending", "processing"]:
+                if (job_dict["status"] in ["pending", "processing"]
+                        and job_dict["job_type"] != SHARD_JOB_TYPE):
                     active_count += 1
 
         return active_count
 
     async def get_completed_jobs_24h(self) -> int:
         """Get count of completed jobs in last 24 hours"""
+        cutoff_time = datetime.utcnow() - timedelta(hours=24)
+
+        if self.history and self.history.enabled:
+            return await self.history.count_by_status_since("completed", cutoff_time)
+
         pattern = f"{self.job_prefix}*"
         job_keys = await self.redis.keys(pattern)
 
         completed_count = 0
-        cutoff_time = datetime.utcnow() - timedelta(hours=24)
 
         for key in job_keys:
             job_data = await self.redis.get(key)
@@ -132,6 +859,29 @@ class JobManager:
 
         return completed_count
 
+    async def get_job_counts_by_day(self, days: int = 7) -> Dict[str, Dict[str, int]]:
+        """Get job counts per creation day and status, e.g. for the weekly volume chart"""
+        if self.history and self.history.enabled:
+            return await self.history.daily_counts(days)
+
+        # Without a database only jobs still in Redis (24h) are counted
+        pattern = f"{self.job_prefix}*"
+        job_keys = await self.redis.keys(pattern)
+
+        cutoff_day = (datetime.utcnow() - timedelta(days=days - 1)).date()
+        counts: Dict[str, Dict[str, int]] = {}
+
+        for key in job_keys:
+            job_data = await self.redis.get(key)
+            if job_data:
+                job_dict = json.loads(job_data)
+                created_day = datetime.fromisoformat(job_dict["created_at"]).date()
+                if created_day >= cutoff_day:
+                    day_counts = counts.setdefault(created_day.isoformat(), {})
+                    day_counts[job_dict["status"]] = day_counts.get(job_dict["status"], 0) + 1
+
+        return counts
+
     async def cleanup_old_jobs(self, days: int = 7):
         """Clean up jobs older than specified days"""
         pattern = f"{self.job_prefix}*"
@@ -146,6 +896,8 @@ class JobManager:
                 job_dict = json.loads(job_data)
                 if datetime.fromisoformat(job_dict["created_at"]) < cutoff_time:
                     await self.redis.delete(key)
+                    await self.remove_from_backlog(job_dict["job_id"])
+                    await self._job_written(job_dict["job_id"], None)
                     cleaned_count += 1
 
         logger.info("Old jobs cleaned up", cleaned_count=cleaned_count, days=days)
@@ -153,59 +905,108 @@ class JobManager:
 
     async def get_job_queue_length(self) -> int:
         """Get current queue length"""
-        return await self.redis.llen(self.queue_name)
+        depths = await self.get_queue_depths()
+        return sum(depths.values())
 
-    async def retry_failed_job(self, job_id: str) -> bool:
-        """Retry a failed job"""
-        job_key = f"{self.job_prefix}{job_id}"
-        job_data = await self.redis.get(job_key)
+    async def get_queue_depths(self) -> Dict[str, int]:
+        """Get queue length per priority lane"""
+        depths = {}
+        for lane in PRIORITY_LANES:
+            depths[lane] = await self.redis.zcard(self._lane_waiting_key(lane))
+        return depths
 
-        if not job_data:
-            return False
+    async def retry_failed_job(self, job_id: str, reset_attempts: bool = True) -> bool:
+        """
+        Retry a failed job.
+
+        Manual retries reset the attempt count, so a dead-lettered job gets
+        its automatic retries again; the scheduler keeps counting.
+        """
+        def apply(job_dict: Dict[str, Any]) -> bool:
+            if job_dict["status"] != "failed":
+                return False
+
+            # Reset job status
+            job_dict["status"] = "pending"
+            job_dict["error"] = None
+            job_dict["progress"] = 0
+            job_dict["next_retry_at"] = None
+            job_dict["dead_lettered"] = False
+            if reset_attempts:
+                job_dict["attempts"] = 0
+            return True
 
-        job_dict = json.loads(job_data)
+        job_dict = await self._modify_job(job_id, apply)
 
-        if job_dict["status"] != "failed":
+        if job_dict is None:
             return False
 
-        # Reset job status
-        job_dict["status"] = "pending"
-        job_dict["error"] = None
-        job_dict["progress"] = 0
-        job_dict["updated_at"] = datetime.utcnow().isoformat()
+        await self.redis.lrem(self.dead_letter_key, 0, job_id)
 
-        await self.redis.set(job_key, json.dumps(job_dict))
-        await self.redis.lpush(self.queue_name, job_id)
+        await self._add_to_backlog(job_dict)
+        await self._enqueue(
+            job_id,
+            job_dict.get("priority", DEFAULT_PRIORITY),
+            job_dict.get("tenant", DEFAULT_TENANT)
+        )
+        # Only now, so a promotion interrupted before queueing is picked up again
+        await self.redis.zrem(self.retry_key, job_id)
 
         logger.info("Job retry initiated", job_id=job_id)
         return True
 
-    async def cancel_job(self, job_id: str) -> bool:
-        """Cancel a pending job"""
-        job_key = f"{self.job_prefix}{job_id}"
-        job_data = await self.redis.get(job_key)
+    async def resubmit_job(self, job_id: str, **payload_updates) -> Optional[Dict[str, Any]]:
+        """
+        Reset a failed or cancelled job to pending for a new upload, merging
+        `payload_updates` into its payload. The caller queues it with
+        `enqueue_job` once the files are stored. Returns None, changing
+        nothing, if the job is missing or in any other state.
+        """
+        def apply(job_dict: Dict[str, Any]) -> bool:
+            if job_dict["status"] not in RESUBMITTABLE_STATUSES:
+                return False
 
-        if not job_data:
-            return False
+            job_dict.update(
+                status="pending", progress=10, error=None, result=None, partial_result=None,
+                attempts=0, next_retry_at=None, dead_lettered=False
+            )
+            job_dict["payload"].update(payload_updates)
+            return True
 
-        job_dict = json.loads(job_data)
+        def unschedule(pipe, job_dict: Dict[str, Any]):
+            pipe.zrem(self.retry_key, job_id)
+            pipe.lrem(self.dead_letter_key, 0, job_id)
 
-        if job_dict["status"] not in ["pending", "processing"]:
-            return False
+        return await self._modify_job(job_id, apply, unschedule)
+
+    async def cancel_job(self, job_id: str) -> bool:
+        """
+        Cancel a pending job, a failed job awaiting its automatic retry, or
+        signal a processing job to stop at its next checkpoint
+        """
+        def apply(job_dict: Dict[str, Any]) -> bool:
+            awaiting_retry = job_dict["status"] == "failed" and job_dict.get("next_retry_at")
+            if job_dict["status"] not in ["pending", "processing"] and not awaiting_retry:
+                return False
 
-        job_dict["status"] = "cancelled"
-        job_dict["updated_at"] = datetime.utcnow().isoformat()
+            job_dict["status"] = "cancelled"
+            return True
 
-        await self.redis.set(job_key, json.dumps(job_dict))
+        job_dict = await self._modify_job(job_id, apply)
+
+        if job_dict is None:
+            return False
 
-        # Remove from queue if present
-        await self.redis.lrem(self.queue_name, 0, job_id)
+        # Remove from queue and retry schedule if present
+        await self._dequeue(job_id, job_dict)
+        await self._stop_running(job_id)
+        await self.redis.zrem(self.retry_key, job_id)
 
         logger.info("Job cancelled", job_id=job_id)
         return True
 
     async def get_jobs_by_status(self, status: str, limit: int = 50) -> List[Dict[str, Any]]:
-        """Get jobs by status"""
+        """Get jobs by status, leaving out shards of sharded jobs"""
         pattern = f"{self.job_prefix}*"
         job_keys = await self.redis.keys(pattern)
 
@@ -214,7 +1015,7 @@ class JobManager:
             job_data = await self.redis.get(key)
             if job_data:
                 job_dict = json.loads(job_data)
-                if job_dict["status"] == status:
+                if job_dict["status"] == status and job_dict["job_type"] != SHARD_JOB_TYPE:
                     jobs.append(job_dict)
                     if len(jobs) >= limit:
                         break
@@ -4,28 +4,96 @@ Handles DICOM image processing with TensorFlow/Keras models
 """
 import asyncio
 import os
+import threading
 import time
-from typing import Dict, List, Optional, Tuple, Any
+from itertools import islice
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 import numpy as np
-import tensorflow as tf
-import pydicom
-from PIL import Image
-import cv2
-from sklearn.preprocessing import StandardScaler
 import structlog
 
 from app.core.config import settings
+from app.services.archive_reader import DicomSource, MemberCache, iter_dicom_sources
+from app.services.dicom_decoder import DicomDecoder
+from app.services.embedding_index import RECORD_FIELDS, EmbeddingIndex
+from app.services.result_aggregator import CLASS_NAMES, IncrementalAggregator
+from app.services.subsampling import SubsamplingPlan, read_slice_order
 
 logger = structlog.get_logger(__name__)
 
+# Heavy dependencies are imported by load_dependencies() during warm-up, so
+# importing this module (and binding the API) does not wait for TensorFlow
+tf = None
+pydicom = None
+cv2 = None
+StandardScaler = None
+_dependencies_lock = threading.Lock()
+
+PartialResultCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+BatchResultsCallback = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+CancellationCheck = Callable[[], Awaitable[bool]]
+
+
+class ProcessingCancelled(Exception):
+    """Raised at a stage boundary when the job has been cancelled"""
+
+
+class ProcessingTimeout(Exception):
+    """Raised at a stage boundary when the job has passed its deadline"""
+
+
+def load_dependencies(include_models: bool = True):
+    """
+    Import pydicom and OpenCV, plus TensorFlow and scikit-learn unless
+    `include_models` is False (API workers using a remote inference server)
+    """
+    global tf, pydicom, cv2, StandardScaler
+
+    with _dependencies_lock:
+        if pydicom is None:
+            import cv2 as _cv2
+            import pydicom as _pydicom
+            cv2 = _cv2
+            # Assigned last: other threads treat a set `pydicom` as loaded
+            pydicom = _pydicom
+
+        if include_models and tf is None:
+            import tensorflow as _tf
+            from sklearn.preprocessing import StandardScaler as _StandardScaler
+            StandardScaler = _StandardScaler
+            tf = _tf
+
+
+async def _batched(iterable: Iterable, size: int) -> AsyncIterator[List]:
+    """
+    Split an iterable into lists of at most `size` items. Each list is pulled
+    in a worker thread, as that may read and decompress archive members.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = await asyncio.to_thread(list, islice(iterator, max(size, 1)))
+        if not batch:
+            return
+        yield batch
+
 
 class MLProcessor:
     """ML processing service for DICOM images"""
 
-    def __init__(self):
+    def __init__(self, decode_processes: Optional[int] = None,
+                 embedding_index: Optional[EmbeddingIndex] = None):
         self.model = None
         self.scaler = None
         self.is_warmed_up = False
+        self.warm_up_error: Optional[str] = None
+        self.warm_up_seconds: Optional[float] = None
+        self.gpu_available = []
+        self.decoder = DicomDecoder(decode_processes)
+        self.embedding_index = embedding_index
+        # Set once warm-up has finished; workers wait on it before taking jobs
+        self.ready = asyncio.Event()
+
+    def _configure_gpu(self):
+        """Detect GPUs and configure memory growth"""
         self.gpu_available = tf.config.list_physical_devices('GPU')
 
         # Configure GPU memory growth
@@ -42,27 +110,56 @@ class MLProcessor:
                 logger.warning("Failed to configure GPU", error=str(e))
 
     async def warm_up(self):
-        """Warm up the ML models"""
+        """Import dependencies, load and warm up the ML models off the event loop"""
         try:
             logger.info("Warming up ML models")
+            start_time = time.perf_counter()
 
-            # Load or create model
-            await self._load_model()
-
-            # Create sample input for warm-up
-            sample_input = np.random.rand(1, 256, 256, 1).astype(np.float32)
-
-            # Run inference to warm up
-            _ = self.model.predict(sample_input, verbose=0)
+            await asyncio.to_thread(self._warm_up_sync)
 
+            self.warm_up_seconds = time.perf_counter() - start_time
             self.is_warmed_up = True
-            logger.info("ML models warmed up successfully")
+            self.ready.set()
+            logger.info("ML models warmed up successfully",
+                       warm_up_seconds=f"{self.warm_up_seconds:.2f}")
 
         except Exception as e:
+            self.warm_up_error = str(e)
             logger.error("Failed to warm up ML models", error=str(e))
             raise
 
-    async def _load_model(self):
+    def _warm_up_sync(self):
+        # Decode processes start importing while the model loads
+        self.decoder.start()
+
+        if settings.INFERENCE_MODE == "remote":
+            self._connect_inference_server()
+            return
+
+        load_dependencies()
+        self._configure_gpu()
+
+        # Load or create model
+        self._load_model()
+
+        # Create sample input for warm-up
+        sample_input = np.random.rand(1, 256, 256, 1).astype(np.float32)
+
+        # Run inference to warm up
+        _ = self.model.predict(sample_input, verbose=0)
+
+    def _connect_inference_server(self):
+        """Use the shared inference server processes instead of a local model"""
+        from app.services.inference_server import RemoteInferenceClient
+
+        load_dependencies(include_models=False)
+
+        client = RemoteInferenceClient()
+        client.wait_until_available(settings.INFERENCE_CONNECT_TIMEOUT_SECONDS)
+        self.model = client
+        logger.info("Connected to inference servers", servers=len(client.socket_paths))
+
+    def _load_model(self):
         """Load the TensorFlow/Keras model"""
         model_path = os.path.join(settings.MODEL_PATH, f"dicom_processor_{settings.MODEL_VERSION}")
 
@@ -72,9 +169,12 @@ class MLProcessor:
             logger.info("Loaded existing model", path=model_path)
         else:
             # Create new model for demo purposes
-            await self._create_demo_model()
+            self._create_demo_model()
             logger.info("Created demo model")
 
+        if settings.EMBEDDINGS_ENABLED:
+            self._add_embedding_output()
+
         # Load or create scaler
         scaler_path = os.path.join(settings.MODEL_PATH, "scaler.pkl")
         if os.path.exists(scaler_path):
@@ -83,7 +183,7 @@ class MLProcessor:
         else:
             self.scaler = StandardScaler()
 
-    async def _create_demo_model(self):
+    def _create_demo_model(self):
         """Create a demo CNN model for DICOM processing"""
         self.model = tf.keras.Sequential([
             tf.keras.layers.Input(shape=(256, 256, 1)),
@@ -96,7 +196,7 @@ class MLProcessor:
             tf.keras.layers.Flatten(),
             tf.keras.layers.Dense(128, activation='relu'),
             tf.keras.layers.Dropout(0.5),
-            tf.keras.layers.Dense(64, activation='relu'),
+            tf.keras.layers.Dense(64, activation='relu', name='embedding'),
             tf.keras.layers.Dense(3, activation='softmax')  # 3 classes: normal, abnormal, enhanced
         ])
 
@@ -106,25 +206,150 @@ class MLProcessor:
             metrics=['accuracy']
         )
 
-        logger.info("Demo model created", architecture=self.model.summary())
-
-    async def process_dicom_files(self, file_paths: List[str], job_id: str) -> Dict[str, Any]:
-        """Process multiple DICOM files"""
+        logger.info("Demo model created",
+                   layers=len(self.model.layers),
+                   parameters=self.model.count_params())
+
+    def _add_embedding_output(self):
+        """
+        Make the model also output its penultimate Dense layer, so slice
+        embeddings come out of the same forward pass as the predictions
+        """
+        dense_layers = [
+            layer for layer in self.model.layers[:-1] if isinstance(layer, tf.keras.layers.Dense)
+        ]
+        if not dense_layers:
+            logger.warning("Model has no Dense layer to take embeddings from")
+            return
+
+        embedding_layer = dense_layers[-1]
+        self.model = tf.keras.Model(
+            inputs=self.model.inputs,
+            outputs=[self.model.output, embedding_layer.output]
+        )
+        logger.info("Embedding output added",
+                   layer=embedding_layer.name,
+                   dim=embedding_layer.units)
+
+    async def process_dicom_files(self, file_paths: List[str], job_id: str,
+                                  on_partial_result: Optional[PartialResultCallback] = None,
+                                  early_stop_confidence: Optional[float] = None,
+                                  is_cancelled: Optional[CancellationCheck] = None,
+                                  deadline: Optional[float] = None,
+                                  sources: Optional[Iterable[Tuple[str, DicomSource]]] = None,
+                                  resume_from: Optional[Dict[str, Dict[str, Any]]] = None,
+                                  on_batch_results: Optional[BatchResultsCallback] = None,
+                                  preview_job_id: Optional[str] = None,
+                                  index_job_id: Optional[str] = None,
+                                  sampling: str = "full"
+                                  ) -> Dict[str, Any]:
+        """
+        Process multiple DICOM files, streaming DICOM members out of any archives.
+
+        `sources` replaces `file_paths` with explicit (name, source) pairs,
+        e.g. the slices of one shard.
+
+        `resume_from` holds successful file results of an earlier run, by
+        source name; those files are not decoded or inferred again but are
+        included in the aggregate. Every batch's per-file results are passed
+        to `on_batch_results` (e.g. to checkpoint them) once inferred.
+
+        With `preview_job_id`, slice previews and thumbnails are rendered
+        from the same decode and stored under that job's results directory.
+        With `index_job_id`, slice embeddings are appended to the embedding
+        index under that job and each file result gets its `embedding_row`
+        and the `embedding_index` version the row belongs to.
+
+        `sampling="adaptive"` infers an evenly spaced subset of each series,
+        then the skipped slices around uncertain or disagreeing samples (see
+        SubsamplingPlan); skipped slices are not decoded, so get no preview.
+        The aggregate records the sampling mode and coverage.
+
+        Files are inferred in batches of BATCH_SIZE. After each batch the running
+        aggregate is handed to `on_partial_result`, at most once per
+        PARTIAL_RESULT_INTERVAL_SECONDS. When `early_stop_confidence` (or the
+        EARLY_STOP_CONFIDENCE setting) is reached, remaining files are skipped.
+
+        Before decoding and before inference of every batch, `is_cancelled` and
+        the `deadline` (a time.monotonic() value) are checked, raising
+        ProcessingCancelled or ProcessingTimeout so the worker is freed.
+        """
         start_time = time.time()
-        results = []
+        aggregator = IncrementalAggregator()
+        if early_stop_confidence is None:
+            early_stop_confidence = settings.EARLY_STOP_CONFIDENCE
+        last_published = None
+        results_by_name: Dict[str, Dict[str, Any]] = dict(resume_from or {})
+
+        async def run_batches(batch_sources: Iterable[Tuple[str, DicomSource]]) -> bool:
+            """Decode and infer sources batch by batch; True once stopped early"""
+            nonlocal last_published
+
+            async for batch in _batched(batch_sources, settings.BATCH_SIZE):
+                await self._check_continue(job_id, is_cancelled, deadline)
+                decoded = await self.decoder.decode_batch(batch, preview_job_id)
+
+                await self._check_continue(job_id, is_cancelled, deadline)
+                results = await self._infer_batch(decoded)
+                await self._index_embeddings(index_job_id, results)
+                aggregator.add_batch(results)
+                results_by_name.update((result["file_path"], result) for result in results)
+                if on_batch_results:
+                    await on_batch_results(results)
+
+                if aggregator.should_stop_early(early_stop_confidence,
+                                                settings.EARLY_STOP_MIN_FILES):
+                    return True
+
+                now = time.monotonic()
+                if on_partial_result and (
+                    last_published is None
+                    or now - last_published >= settings.PARTIAL_RESULT_INTERVAL_SECONDS
+                ):
+                    last_published = now
+                    await on_partial_result(aggregator.snapshot())
+
+            return False
 
         try:
-            for file_path in file_paths:
-                result = await self._process_single_dicom(file_path)
-                results.append(result)
+            resumed_files = len(resume_from or {})
+            if resume_from:
+                aggregator.add_batch(list(resume_from.values()))
+
+            if sampling == "adaptive":
+                # The header pass streams every source once; later passes get
+                # the members it kept and only re-read the others by name
+                members = MemberCache(settings.SUBSAMPLE_CACHE_MAX_MB * 1024 * 1024)
+                if sources is None:
+                    sources = iter_dicom_sources(file_paths)
+
+                plan = SubsamplingPlan(*await asyncio.to_thread(read_slice_order, members.keep(sources)))
+                early_stopped = await run_batches(members.open(plan.initial() - set(results_by_name)))
+                if not early_stopped:
+                    refinement = plan.refinement(results_by_name) - set(results_by_name)
+                    early_stopped = await run_batches(members.open(refinement))
+                sampling_summary = plan.summary(results_by_name)
+            else:
+                if sources is None:
+                    sources = iter_dicom_sources(file_paths)
+                if resume_from:
+                    sources = ((name, source) for name, source in sources if name not in resume_from)
+                early_stopped = await run_batches(sources)
+                sampling_summary = {"mode": "full"}
 
             # Aggregate results
-            aggregated = self._aggregate_results(results)
+            aggregated = aggregator.result()
+            aggregated["early_stopped"] = early_stopped
+            aggregated["sampling"] = sampling_summary
 
             processing_time = time.time() - start_time
             logger.info("DICOM processing completed",
                        job_id=job_id,
-                       files_processed=len(file_paths),
+                       files_processed=aggregator.total_files,
+                       resumed_files=resumed_files,
+                       early_stopped=early_stopped,
+                       sampling=sampling_summary["mode"],
+                       coverage=sampling_summary.get("coverage"),
                        processing_time=f"{processing_time:.2f}s")
 
             return {
@@ -132,68 +357,105 @@ class MLProcessor:
                 "status": "completed",
                 "results": aggregated,
                 "processing_time": processing_time,
-                "file_count": len(file_paths)
+                "file_count": aggregator.total_files,
+                "resumed_files": resumed_files,
+                "model_version": settings.MODEL_VERSION
             }
 
+        except (ProcessingCancelled, ProcessingTimeout):
+            raise
         except Exception as e:
             logger.error("DICOM processing failed", job_id=job_id, error=str(e))
             raise
 
-    async def _process_single_dicom(self, file_path: str) -> Dict[str, Any]:
-        """Process a single DICOM file"""
-        try:
-            # Read DICOM file
-            dicom = pydicom.dcmread(file_path)
-
-            # Extract pixel data
-            pixel_array = dicom.pixel_array
-
-            # Preprocess image
-            processed_image = self._preprocess_image(pixel_array)
-
-            # Run ML inference
-            predictions = self.model.predict(processed_image, verbose=0)
+    async def _check_continue(self, job_id: str, is_cancelled: Optional[CancellationCheck],
+                              deadline: Optional[float]):
+        """Stage boundary: stop if the job was cancelled or ran out of time"""
+        if deadline is not None and time.monotonic() > deadline:
+            logger.warning("DICOM processing timed out", job_id=job_id)
+            raise ProcessingTimeout(f"Job {job_id} exceeded its processing deadline")
+
+        if is_cancelled is not None and await is_cancelled():
+            logger.info("DICOM processing cancelled", job_id=job_id)
+            raise ProcessingCancelled(f"Job {job_id} was cancelled")
+
+    async def _process_batch(self, batch: List[Tuple[str, DicomSource]]) -> List[Dict[str, Any]]:
+        """Decode a batch of DICOM files and run them through the model in one forward pass"""
+        decoded = await self.decoder.decode_batch(batch)
+        results = await self._infer_batch(decoded)
+        await self._index_embeddings(None, results)
+        return results
 
-            # Post-process results
-            result = self._postprocess_predictions(predictions[0])
+    async def _infer_batch(self, decoded: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run the successfully decoded files of a batch through the model"""
+        loaded = [item for item in decoded if 'error' not in item]
 
-            return {
-                "file_path": file_path,
-                "patient_id": getattr(dicom, 'PatientID', 'Unknown'),
-                "study_instance_uid": getattr(dicom, 'StudyInstanceUID', 'Unknown'),
-                "series_instance_uid": getattr(dicom, 'SeriesInstanceUID', 'Unknown'),
-                "modality": getattr(dicom, 'Modality', 'Unknown'),
-                "predictions": result,
-                "confidence": float(np.max(predictions[0]))
-            }
+        if loaded:
+            try:
+                # Run ML inference off the event loop so status and cancel
+                # requests are still served while a batch is inferred
+                images = np.concatenate([item.pop('image') for item in loaded])
+                started = time.perf_counter()
+                outputs = await asyncio.to_thread(self.model.predict, images, verbose=0)
+                inference_seconds = (time.perf_counter() - started) / len(loaded)
+
+                # Models with an embedding output return [predictions, embeddings]
+                if isinstance(outputs, (list, tuple)):
+                    predictions, embeddings = outputs[0], outputs[1]
+                else:
+                    predictions, embeddings = outputs, None
+
+                # Post-process results
+                for index, (item, prediction) in enumerate(zip(loaded, predictions)):
+                    item["predictions"] = self._postprocess_predictions(prediction)
+                    item["confidence"] = float(np.max(prediction))
+                    item["inference_seconds"] = inference_seconds
+                    if embeddings is not None:
+                        item["embedding"] = embeddings[index]
 
+            except Exception as e:
+                logger.error("Batch inference failed", batch_size=len(loaded), error=str(e))
+                for item in loaded:
+                    file_path = item["file_path"]
+                    item.clear()
+                    item.update({"file_path": file_path, "error": str(e), "status": "failed"})
+
+        return decoded
+
+    async def _index_embeddings(self, job_id: Optional[str], results: List[Dict[str, Any]]):
+        """Move a batch's embeddings out of its results and into the index under `job_id`"""
+        embedded = [item for item in results if "embedding" in item]
+        if not embedded:
+            return
+
+        vectors = np.stack([item.pop("embedding") for item in embedded])
+        if not job_id or self.embedding_index is None:
+            return
+
+        records = [
+            {"job_id": job_id, **{field: item.get(field) for field in RECORD_FIELDS}}
+            for item in embedded
+        ]
+        try:
+            rows = await asyncio.to_thread(self.embedding_index.append, records, vectors)
         except Exception as e:
-            logger.error("Failed to process DICOM file", file_path=file_path, error=str(e))
-            return {
-                "file_path": file_path,
-                "error": str(e),
-                "status": "failed"
-            }
-
-    def _preprocess_image(self, pixel_array: np.ndarray) -> np.ndarray:
-        """Preprocess DICOM pixel array for ML model"""
-        # Convert to float32
-        image = pixel_array.astype(np.float32)
+            # Similar-case search misses these slices; the job goes on
+            logger.warning("Failed to index slice embeddings", job_id=job_id, error=str(e))
+            return
 
-        # Normalize to 0-1 range
-        image = (image - np.min(image)) / (np.max(image) - np.min(image) + 1e-8)
+        for item, row in zip(embedded, rows):
+            item["embedding_row"] = row
+            item["embedding_index"] = self.embedding_index.version
 
-        # Resize to model input size
-        image = cv2.resize(image, (256, 256))
-
-        # Add channel dimension
-        image = np.expand_dims(image, axis=[0, -1])
-
-        return image
+    async def _process_single_dicom(self, file_path: str,
+                                    source: Optional[DicomSource] = None) -> Dict[str, Any]:
+        """Process a single DICOM file"""
+        results = await self._process_batch([(file_path, source)])
+        return results[0]
 
     def _postprocess_predictions(self, predictions: np.ndarray) -> Dict[str, float]:
         """Convert model predictions to human-readable results"""
-        class_names = ['normal', 'abnormal', 'enhanced']
+        class_names = CLASS_NAMES
         results = {}
 
         for i, class_name in enumerate(class_names):
@@ -208,51 +470,25 @@ class MLProcessor:
 
     def _aggregate_results(self, results: List[Dict]) -> Dict[str, Any]:
         """Aggregate results from multiple files"""
-        if not results:
-            return {"error": "No results to aggregate"}
-
-        # Filter out failed results
-        successful_results = [r for r in results if 'error' not in r]
-
-        if not successful_results:
-            return {"error": "All files failed processing"}
-
-        # Aggregate predictions
-        aggregated = {
-            "total_files": len(results),
-            "successful_files": len(successful_results),
-            "failed_files": len(results) - len(successful_results),
-            "findings": []
-        }
-
-        # Group by primary finding
-        finding_counts = {}
-        for result in successful_results:
-            finding = result['predictions']['primary_finding']
-            finding_counts[finding] = finding_counts.get(finding, 0) + 1
-
-        # Determine overall assessment
-        most_common_finding = max(finding_counts, key=finding_counts.get)
-        confidence = finding_counts[most_common_finding] / len(successful_results)
-
-        aggregated["overall_assessment"] = {
-            "primary_finding": most_common_finding,
-            "confidence": confidence,
-            "finding_distribution": finding_counts
-        }
-
-        # Add individual file results
-        aggregated["file_results"] = successful_results
-
-        return aggregated
+        aggregator = IncrementalAggregator()
+        aggregator.add_batch(results)
+        return aggregator.result()
 
     async def cleanup(self):
         """Cleanup resources"""
-        if self.model:
+        self.decoder.close()
+        if self.model and settings.INFERENCE_MODE == "remote":
+            self.model.close()
+            logger.info("ML processor cleaned up")
+        elif self.model:
             # Clear Keras session
             tf.keras.backend.clear_session()
             logger.info("ML processor cleaned up")
 
+    def is_ready(self) -> bool:
+        """Check if warm-up has completed and jobs can be processed"""
+        return self.is_warmed_up
+
     def is_model_loaded(self) -> bool:
         """Check if model is loaded"""
         return self.model is not None
@@ -0,0 +1,133 @@
+"""
+Preview Service
+Downscaled, default-windowed slice renders written during ingest for the viewer
+"""
+import hashlib
+import os
+import re
+from collections.abc import Sequence
+from typing import Optional, Tuple
+import numpy as np
+
+from app.core.config import settings
+
+PREVIEW_SIZES = ("thumbnail", "preview")
+PREVIEW_MEDIA_TYPES = {"webp": "image/webp", "png": "image/png"}
+
+# Preview ids are SOPInstanceUIDs or hex digests; anything else is rejected
+PREVIEW_ID_PATTERN = re.compile(r"^[0-9A-Za-z._-]{1,128}$")
+
+
+def previews_dir(job_id: str) -> str:
+    return os.path.join(settings.RESULTS_DIR, job_id, "previews")
+
+
+def preview_path(job_id: str, preview_id: str, size: str) -> str:
+    return os.path.join(previews_dir(job_id), size, f"{preview_id}.{settings.PREVIEW_FORMAT}")
+
+
+def preview_id_for(dicom, file_path: str) -> str:
+    """SOPInstanceUID of the slice, or a digest of its source name"""
+    uid = str(getattr(dicom, "SOPInstanceUID", ""))
+    if uid and PREVIEW_ID_PATTERN.match(uid):
+        return uid
+    return hashlib.sha1(file_path.encode()).hexdigest()
+
+
+def _first(value) -> Optional[float]:
+    """First value of a possibly multi-valued window attribute"""
+    if isinstance(value, Sequence) and not isinstance(value, str):
+        value = value[0] if len(value) else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def header_window(dicom) -> Tuple[Optional[float], Optional[float]]:
+    """First WindowCenter and WindowWidth of the header, if present"""
+    return _first(getattr(dicom, "WindowCenter", None)), _first(getattr(dicom, "WindowWidth", None))
+
+
+def render_default_window(dicom, pixel_array: np.ndarray) -> np.ndarray:
+    """
+    8-bit render of a slice with its default window.
+
+    Uses the modality rescale and the header's first WindowCenter/Width,
+    falling back to the 0.5-99.5 percentile range; MONOCHROME1 is inverted.
+    Multi-frame data renders its middle frame; colour data is passed through.
+    """
+    pixels = pixel_array
+    samples = int(getattr(dicom, "SamplesPerPixel", 1) or 1)
+
+    if samples == 1 and pixels.ndim == 3:
+        pixels = pixels[pixels.shape[0] // 2]
+    elif samples > 1 and pixels.ndim == 4:
+        pixels = pixels[pixels.shape[0] // 2]
+
+    if samples > 1:
+        return pixels.astype(np.uint8)
+
+    slope = float(getattr(dicom, "RescaleSlope", 1) or 1)
+    intercept = float(getattr(dicom, "RescaleIntercept", 0) or 0)
+    pixels = pixels.astype(np.float32) * slope + intercept
+
+    center, width = header_window(dicom)
+    if center is not None and width and width > 1:
+        low, high = center - width / 2, center + width / 2
+    else:
+        low, high = np.percentile(pixels, (0.5, 99.5))
+
+    rendered = np.clip((pixels - low) / max(high - low, 1e-6), 0, 1) * 255
+    if getattr(dicom, "PhotometricInterpretation", "") == "MONOCHROME1":
+        rendered = 255 - rendered
+    return rendered.astype(np.uint8)
+
+
+def _downscale(image: np.ndarray, max_side: int) -> np.ndarray:
+    import cv2
+
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def _write_image(path: str, image: np.ndarray):
+    """Encode and write atomically, so a reader never sees a partial file"""
+    import cv2
+
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+    if settings.PREVIEW_FORMAT == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, settings.PREVIEW_QUALITY]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 3]
+
+    ok, encoded = cv2.imencode(f".{settings.PREVIEW_FORMAT}", image, params)
+    if not ok:
+        raise ValueError(f"Could not encode {settings.PREVIEW_FORMAT} preview")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(encoded.tobytes())
+    os.replace(temporary_path, path)
+
+
+def write_previews(job_id: str, dicom, pixel_array: np.ndarray, file_path: str) -> str:
+    """Write the preview and thumbnail of a decoded slice; returns its preview id"""
+    preview_id = preview_id_for(dicom, file_path)
+    rendered = render_default_window(dicom, pixel_array)
+
+    # The thumbnail is scaled from the preview rather than the full slice
+    preview = _downscale(rendered, settings.PREVIEW_MAX_SIZE)
+    _write_image(preview_path(job_id, preview_id, "preview"), preview)
+    _write_image(
+        preview_path(job_id, preview_id, "thumbnail"),
+        _downscale(preview, settings.THUMBNAIL_MAX_SIZE)
+    )
+    return preview_id
@@ -0,0 +1,105 @@
+"""
+Result Aggregator
+Running aggregation of per-file predictions so partial results can be published
+"""
+from typing import Any, Dict, List, Optional
+
+CLASS_NAMES = ['normal', 'abnormal', 'enhanced']
+
+
+class IncrementalAggregator:
+    """Accumulates per-file results one batch at a time"""
+
+    def __init__(self):
+        self.total_files = 0
+        self.successful_results: List[Dict[str, Any]] = []
+        self.failed_results: List[Dict[str, Any]] = []
+        self.finding_counts: Dict[str, int] = {}
+        self.probability_sums: Dict[str, float] = {name: 0.0 for name in CLASS_NAMES}
+        self.confidence_sum = 0.0
+
+    def add(self, result: Dict[str, Any]):
+        """Fold a single file result into the running totals"""
+        self.total_files += 1
+
+        if 'error' in result:
+            self.failed_results.append({"file_path": result.get("file_path"), "error": result["error"]})
+            return
+
+        self.successful_results.append(result)
+
+        predictions = result['predictions']
+        finding = predictions['primary_finding']
+        self.finding_counts[finding] = self.finding_counts.get(finding, 0) + 1
+
+        for name in CLASS_NAMES:
+            self.probability_sums[name] += predictions.get(name, 0.0)
+        self.confidence_sum += result.get('confidence', 0.0)
+
+    def add_batch(self, results: List[Dict[str, Any]]):
+        """Fold a batch of file results into the running totals"""
+        for result in results:
+            self.add(result)
+
+    @property
+    def successful_files(self) -> int:
+        return len(self.successful_results)
+
+    def assessment(self) -> Optional[Dict[str, Any]]:
+        """Current overall assessment, or None before any file succeeded"""
+        if not self.finding_counts:
+            return None
+
+        most_common_finding = max(self.finding_counts, key=self.finding_counts.get)
+        successful = self.successful_files
+
+        return {
+            "primary_finding": most_common_finding,
+            "confidence": self.finding_counts[most_common_finding] / successful,
+            "finding_distribution": dict(self.finding_counts)
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Compact partial result suitable for storing on the job record"""
+        successful = self.successful_files
+        snapshot = {
+            "partial": True,
+            "files_processed": self.total_files,
+            "successful_files": successful,
+            "failed_files": self.total_files - successful,
+            "overall_assessment": self.assessment()
+        }
+
+        if successful:
+            snapshot["mean_confidence"] = self.confidence_sum / successful
+            snapshot["mean_class_probabilities"] = {
+                name: total / successful for name, total in self.probability_sums.items()
+            }
+
+        return snapshot
+
+    def should_stop_early(self, confidence_threshold: Optional[float], min_files: int) -> bool:
+        """Whether the running assessment is confident enough to skip remaining files"""
+        if not confidence_threshold or self.successful_files < min_files:
+            return False
+
+        assessment = self.assessment()
+        return assessment is not None and assessment["confidence"] >= confidence_threshold
+
+    def result(self) -> Dict[str, Any]:
+        """Final aggregated result"""
+        if not self.total_files:
+            return {"error": "No results to aggregate"}
+
+        if not self.successful_results:
+            return {"error": "All files failed processing", "failed_file_results": self.failed_results}
+
+        return {
+            "total_files": self.total_files,
+            "successful_files": self.successful_files,
+            "failed_files": self.total_files - self.successful_files,
+            "findings": [],
+            "overall_assessment": self.assessment(),
+            "file_results": self.successful_results,
+            "failed_file_results": self.failed_results
+        }
@@ -0,0 +1,184 @@
+"""
+Result Export Service
+Streams per-file predictions from job history as Arrow IPC or Parquet
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterator, List
+from sqlalchemy import select
+import structlog
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+from app.core.config import settings
+from app.db import session as db_session
+from app.db.models import JobHistory
+from app.services.result_aggregator import CLASS_NAMES
+
+logger = structlog.get_logger(__name__)
+
+EXPORT_FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Job history rows fetched per round trip while streaming a time window
+FETCH_ROWS = 200
+
+
+def export_schema() -> "pa.Schema":
+    """One row per successfully processed file"""
+    return pa.schema([
+        ("job_id", pa.string()),
+        ("tenant", pa.string()),
+        ("job_status", pa.string()),
+        ("created_at", pa.timestamp("us")),
+        ("finished_at", pa.timestamp("us")),
+        ("model_version", pa.string()),
+        ("job_processing_time", pa.float64()),
+        ("file_path", pa.string()),
+        ("patient_id", pa.string()),
+        ("study_instance_uid", pa.string()),
+        ("series_instance_uid", pa.string()),
+        ("modality", pa.string()),
+        *[(f"probability_{name}", pa.float64()) for name in CLASS_NAMES],
+        ("primary_finding", pa.string()),
+        ("confidence", pa.float64()),
+        ("decode_seconds", pa.float64()),
+        ("inference_seconds", pa.float64()),
+    ])
+
+
+def flatten_job(job) -> Iterator[Dict[str, Any]]:
+    """Per-file rows of one job_history row"""
+    result = job.result or {}
+    file_results = (result.get("results") or {}).get("file_results") or []
+
+    for file_result in file_results:
+        predictions = file_result.get("predictions") or {}
+        yield {
+            "job_id": job.job_id,
+            "tenant": job.tenant,
+            "job_status": job.status,
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+            "model_version": result.get("model_version"),
+            "job_processing_time": job.processing_time,
+            "file_path": file_result.get("file_path"),
+            "patient_id": file_result.get("patient_id"),
+            "study_instance_uid": file_result.get("study_instance_uid"),
+            "series_instance_uid": file_result.get("series_instance_uid"),
+            "modality": file_result.get("modality"),
+            **{f"probability_{name}": predictions.get(name) for name in CLASS_NAMES},
+            "primary_finding": predictions.get("primary_finding"),
+            "confidence": file_result.get("confidence"),
+            "decode_seconds": file_result.get("decode_seconds"),
+            "inference_seconds": file_result.get("inference_seconds"),
+        }
+
+
+async def iter_record_batches(since: datetime, until: datetime, status: str = None,
+                              tenant: str = None) -> AsyncIterator["pa.RecordBatch"]:
+    """
+    Flattened rows for jobs finished in [since, until) as Arrow record batches.
+
+    The range is queried in EXPORT_CHUNK_MINUTES windows, each streamed from
+    the database, and rows are emitted every EXPORT_BATCH_ROWS, so memory
+    stays flat however large the range is.
+    """
+    schema = export_schema()
+    window = timedelta(minutes=max(settings.EXPORT_CHUNK_MINUTES, 1))
+    rows: List[Dict[str, Any]] = []
+
+    window_start = since
+    while window_start < until:
+        window_end = min(window_start + window, until)
+
+        statement = (
+            select(JobHistory)
+            .where(JobHistory.finished_at >= window_start, JobHistory.finished_at < window_end)
+            .order_by(JobHistory.finished_at)
+            .execution_options(yield_per=FETCH_ROWS)
+        )
+        if status:
+            statement = statement.where(JobHistory.status == status)
+        if tenant:
+            statement = statement.where(JobHistory.tenant == tenant)
+
+        async with db_session.async_session_maker() as session:
+            async for job in await session.stream_scalars(statement):
+                rows.extend(flatten_job(job))
+                if len(rows) >= settings.EXPORT_BATCH_ROWS:
+                    yield pa.RecordBatch.from_pylist(rows, schema=schema)
+                    rows = []
+                # Loaded rows are not needed again; keep the identity map small
+                session.expunge(job)
+
+        window_start = window_end
+
+    if rows:
+        yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+
+class _StreamSink:
+    """Write-only file object whose written bytes are collected between drains"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_export(export_format: str, since: datetime, until: datetime,
+                        status: str = None, tenant: str = None) -> AsyncIterator[bytes]:
+    """Encoded export, yielded one record batch (Parquet row group) at a time"""
+    schema = export_schema()
+    sink = _StreamSink()
+    output = pa.PythonFile(sink, mode="w")
+
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(output, schema)
+    else:
+        writer = pa.ipc.new_stream(output, schema)
+
+    exported_rows = 0
+    try:
+        async for batch in iter_record_batches(since, until, status=status, tenant=tenant):
+            # Encoding and compression are CPU work; keep them off the event loop
+            await asyncio.to_thread(writer.write_batch, batch)
+            exported_rows += batch.num_rows
+            yield sink.drain()
+    finally:
+        writer.close()
+
+    yield sink.drain()
+    logger.info("Results exported",
+               format=export_format,
+               rows=exported_rows,
+               since=since.isoformat(),
+               until=until.isoformat())
@@ -0,0 +1,218 @@
+"""
+Sharding Service
+Splits large DICOM jobs into per-series shards processed as child jobs, and
+reduces the shard outputs into the parent job
+"""
+import asyncio
+import time
+import uuid
+from itertools import groupby
+from typing import Any, Dict, List, Optional, Tuple
+import structlog
+
+from app.core.config import settings
+from app.services.archive_reader import DicomSource, iter_dicom_sources
+from app.services.job_manager import JOB_TTL_SECONDS, SHARD_JOB_TYPE, TERMINAL_STATUSES, JobManager
+from app.services.ml_processor import MLProcessor
+from app.services.subsampling import merge_sampling_summaries
+
+logger = structlog.get_logger(__name__)
+
+def _slice_order(source: DicomSource) -> Tuple[str, int]:
+    """SeriesInstanceUID and InstanceNumber from a slice's header"""
+    import pydicom
+
+    try:
+        header = pydicom.dcmread(source, stop_before_pixels=True)
+        return str(getattr(header, "SeriesInstanceUID", "")), int(getattr(header, "InstanceNumber", 0) or 0)
+    except Exception:
+        # Unreadable slices still go to a shard; decoding records the failure
+        return "", 0
+
+
+def plan_shards(file_paths: List[str], shard_size: int) -> List[List[str]]:
+    """
+    Group a job's slices by series, in InstanceNumber order, and cut each
+    series into shards of at most `shard_size` source names.
+
+    Archive members are only referenced by name ("archive!member"); the
+    worker running a shard streams them out of the archive itself.
+    """
+    slices = []
+
+    for name, source in iter_dicom_sources(file_paths):
+        series, instance = _slice_order(source)
+        slices.append((series, instance, name))
+
+    slices.sort()
+
+    shards = []
+    for _, series_slices in groupby(slices, key=lambda item: item[0]):
+        files = [name for _, _, name in series_slices]
+        for start in range(0, len(files), max(shard_size, 1)):
+            shards.append(files[start:start + shard_size])
+    return shards
+
+
+class ShardCoordinator:
+    """
+    Fans large jobs out to shard child jobs and reduces their results.
+
+    Shards are ordinary queued jobs (type "dicom_shard") in the parent's lane
+    and tenant, so any worker can pick them up. Each shard completion is
+    counted once; the parent's progress follows the count, and the worker
+    completing the last shard merges every shard's per-file results through
+    MLProcessor._aggregate_results into the parent. A failed shard fails the
+    parent, and shards stop once their parent is finished or cancelled.
+
+    Every fan-out gets its own run id in the shard ids and completion set,
+    so shards left over from an earlier attempt of the parent can neither
+    overwrite nor be counted towards the current one. Checkpoints are keyed
+    by shard index instead, so a retried parent resumes its shards.
+    """
+
+    def __init__(self, job_manager: JobManager, ml_processor: MLProcessor):
+        self.job_manager = job_manager
+        self.ml_processor = ml_processor
+        self.shard_prefix = "pixelence:shards:"
+
+    def should_shard(self, estimated_slices: Optional[int]) -> bool:
+        return bool(settings.SHARD_MIN_SLICES) and (estimated_slices or 0) >= settings.SHARD_MIN_SLICES
+
+    async def fan_out(self, job_id: str, file_paths: List[str]) -> int:
+        """Split a processing job into shard jobs; returns 0 if it is not worth splitting"""
+        shards = await asyncio.to_thread(plan_shards, file_paths, settings.SHARD_SIZE)
+        if len(shards) < 2:
+            return 0
+
+        parent = await self.job_manager.get_job_status(job_id)
+        run = uuid.uuid4().hex[:8]
+        shard_ids = [f"{job_id}-{run}-shard-{index}" for index in range(len(shards))]
+        checkpoint_ids = [f"{job_id}-shard-{index}" for index in range(len(shards))]
+
+        previous_run = parent["payload"].get("shard_run")
+        if previous_run:
+            await self.job_manager.redis.delete(self._done_key(job_id, previous_run))
+        await self.job_manager.update_job_payload(
+            job_id, shard_ids=shard_ids, shard_checkpoint_ids=checkpoint_ids,
+            shard_run=run, fan_out_at=time.time()
+        )
+
+        for index, (shard_id, files) in enumerate(zip(shard_ids, shards)):
+            await self.job_manager.create_job(
+                SHARD_JOB_TYPE,
+                {"parent_id": job_id, "shard_index": index, "shard_run": run,
+                 "checkpoint_id": checkpoint_ids[index], "files": files, "file_count": len(files),
+                 "sampling": parent["payload"].get("sampling") or "full"},
+                priority=parent["priority"],
+                tenant=parent["tenant"],
+                job_id=shard_id
+            )
+
+        logger.info("Job fanned out to shards",
+                   job_id=job_id,
+                   shards=len(shards),
+                   slices=sum(len(files) for files in shards))
+        return len(shards)
+
+    def _done_key(self, parent_id: str, run: str) -> str:
+        """Set of shard ids of one fan-out whose completion has been counted"""
+        return f"{self.shard_prefix}{parent_id}:{run}:done"
+
+    async def parent_finished(self, parent_id: str, run: Optional[str] = None) -> bool:
+        """
+        Whether the parent has expired or reached a terminal status, or,
+        given a shard's run, fanned out again since
+        """
+        parent = await self.job_manager.get_job_status(parent_id)
+        return (parent is None
+                or parent["status"] in TERMINAL_STATUSES
+                or (run is not None and parent["payload"].get("shard_run") != run))
+
+    async def _current_parent(self, shard_job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The shard's parent, or None if it expired or fanned out again since"""
+        payload = shard_job["payload"]
+        parent = await self.job_manager.get_job_status(payload["parent_id"])
+        if not parent or parent["payload"].get("shard_run") != payload.get("shard_run"):
+            logger.info("Ignoring shard of an earlier fan-out",
+                       job_id=shard_job["job_id"],
+                       parent_id=payload["parent_id"])
+            return None
+        return parent
+
+    async def shard_completed(self, shard_job: Dict[str, Any]):
+        """Count a completed shard, and reduce the parent after the last one"""
+        parent_id = shard_job["payload"]["parent_id"]
+        if not await self._current_parent(shard_job):
+            return
+
+        done_key = self._done_key(parent_id, shard_job["payload"]["shard_run"])
+        async with self.job_manager.redis.pipeline(transaction=True) as pipe:
+            pipe.sadd(done_key, shard_job["job_id"])
+            pipe.scard(done_key)
+            pipe.expire(done_key, JOB_TTL_SECONDS)
+            added, done, _ = await pipe.execute()
+
+        if not added:
+            return
+
+        parent = await self.job_manager.get_job_status(parent_id)
+        if not parent:
+            return
+        total = len(parent["payload"]["shard_ids"])
+
+        if done < total:
+            await self.job_manager.update_job_status(
+                parent_id, "processing", progress=50 + int(50 * done / total)
+            )
+        elif done == total:
+            await self.reduce(parent_id)
+
+    async def shard_failed(self, shard_job: Dict[str, Any], error: str):
+        """Fail the parent of a failed shard; a retry of the parent re-runs its shards"""
+        payload = shard_job["payload"]
+        if not await self._current_parent(shard_job):
+            return
+        await self.job_manager.fail_job(
+            payload["parent_id"],
+            f"Shard {payload['shard_index']} failed: {error}",
+            progress=0
+        )
+
+    async def reduce(self, parent_id: str):
+        """Merge the shard outputs into the parent's result"""
+        parent = await self.job_manager.get_job_status(parent_id)
+        payload = parent["payload"]
+
+        file_results: List[Dict[str, Any]] = []
+        sampling_summaries = []
+        for shard_id in payload["shard_ids"]:
+            shard = await self.job_manager.get_job_status(shard_id)
+            if not shard or not shard.get("result"):
+                await self.job_manager.fail_job(parent_id, f"Result of shard {shard_id} is missing")
+                return
+            shard_results = shard["result"]["results"]
+            file_results.extend(shard_results.get("file_results", []))
+            file_results.extend(shard_results.get("failed_file_results", []))
+            sampling_summaries.append(shard_results.get("sampling"))
+
+        aggregated = self.ml_processor._aggregate_results(file_results)
+        aggregated["early_stopped"] = False
+        aggregated["sampling"] = merge_sampling_summaries(sampling_summaries)
+
+        await self.job_manager.update_job_status(
+            parent_id,
+            "completed",
+            progress=100,
+            result={
+                "job_id": parent_id,
+                "status": "completed",
+                "results": aggregated,
+                "processing_time": time.time() - payload["fan_out_at"],
+                "file_count": len(file_results),
+                "model_version": settings.MODEL_VERSION,
+                "shard_count": len(payload["shard_ids"])
+            }
+        )
+
+        logger.info("Sharded job reduced", job_id=parent_id, shards=len(payload["shard_ids"]))
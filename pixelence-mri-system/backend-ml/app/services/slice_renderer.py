@@ -0,0 +1,302 @@
+"""
+Slice Renderer Service
+On-demand window/level renders of job slices from an LRU of decoded pixel arrays
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+import structlog
+
+from app.core.config import settings
+from app.services.archive_reader import open_dicom_source
+from app.services.checkpoint import JobCheckpoint
+from app.services.dicom_decoder import decode_pixels
+from app.services.job_manager import JobManager
+from app.services.previews import header_window
+
+logger = structlog.get_logger(__name__)
+
+RENDER_FORMATS = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+# Per-thread scratch arrays reused across renders, grown as needed up to
+# RENDER_SCRATCH_MAX_MB; only the RENDER_THREADS render threads keep any
+_scratch_buffers = threading.local()
+
+
+@dataclass
+class DecodedSlice:
+    """Stored pixel values of a slice and what is needed to window them"""
+    pixels: np.ndarray
+    samples: int
+    slope: float
+    intercept: float
+    monochrome1: bool
+    default_center: float
+    default_width: float
+
+    @property
+    def frame_count(self) -> int:
+        frame_ndim = 2 if self.samples == 1 else 3
+        return self.pixels.shape[0] if self.pixels.ndim > frame_ndim else 1
+
+    def frame(self, index: Optional[int]) -> np.ndarray:
+        """One frame; the middle one of multi-frame data by default"""
+        count = self.frame_count
+        if count == 1:
+            if index:
+                raise ValueError("Slice has a single frame")
+            return self.pixels
+
+        index = count // 2 if index is None else index
+        if not 0 <= index < count:
+            raise ValueError(f"Frame must be between 0 and {count - 1}")
+        return self.pixels[index]
+
+
+def load_slice(source_name: str) -> DecodedSlice:
+    """Read and decode one slice; its default window falls back to the 0.5-99.5 percentiles"""
+    import pydicom
+
+    dicom = pydicom.dcmread(open_dicom_source(source_name))
+    pixels, _ = decode_pixels(dicom)
+
+    decoded = DecodedSlice(
+        pixels=pixels,
+        samples=int(getattr(dicom, "SamplesPerPixel", 1) or 1),
+        slope=float(getattr(dicom, "RescaleSlope", 1) or 1),
+        intercept=float(getattr(dicom, "RescaleIntercept", 0) or 0),
+        monochrome1=getattr(dicom, "PhotometricInterpretation", "") == "MONOCHROME1",
+        default_center=0.0,
+        default_width=1.0
+    )
+
+    center, width = header_window(dicom)
+    if center is None or not width or width <= 1:
+        low, high = np.percentile(decoded.frame(None), (0.5, 99.5)) * decoded.slope + decoded.intercept
+        center, width = (low + high) / 2, max(high - low, 1.0)
+    decoded.default_center, decoded.default_width = float(center), float(width)
+    return decoded
+
+
+def _scratch(name: str, shape: Tuple[int, ...], dtype) -> np.ndarray:
+    """
+    A reusable array of `shape`, backed by this thread's buffer called
+    `name`; a temporary one if it is over RENDER_SCRATCH_MAX_MB
+    """
+    size = int(np.prod(shape))
+    if size * np.dtype(dtype).itemsize > settings.RENDER_SCRATCH_MAX_MB * 1024 * 1024:
+        return np.empty(shape, dtype=dtype)
+
+    buffer = getattr(_scratch_buffers, name, None)
+    if buffer is None or buffer.size < size:
+        buffer = np.empty(size, dtype=dtype)
+        setattr(_scratch_buffers, name, buffer)
+    return buffer[:size].reshape(shape)
+
+
+def _target_size(shape: Tuple[int, ...], max_side: int) -> Optional[Tuple[int, int]]:
+    """cv2 (width, height) to downscale to, or None when the slice already fits"""
+    height, width = shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return None
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def render_slice(decoded: DecodedSlice, center: Optional[float], width: Optional[float],
+                 max_side: int, frame: Optional[int], image_format: str, quality: int) -> bytes:
+    """
+    Window a slice to 8 bits and encode it.
+
+    The frame is downscaled before windowing, so the per-pixel work follows
+    the output size. Rescale, window and MONOCHROME1 inversion fold into a
+    single multiply-add applied in place on this thread's scratch buffers.
+    """
+    import cv2
+
+    pixels = decoded.frame(frame)
+    target = _target_size(pixels.shape, max_side)
+
+    if decoded.samples > 1:
+        image = pixels.astype(np.uint8, copy=False)
+        if target:
+            image = cv2.resize(image, target, interpolation=cv2.INTER_AREA)
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    else:
+        work = _scratch("float", pixels.shape, np.float32)
+        np.copyto(work, pixels, casting="unsafe")
+        if target:
+            resized = _scratch("resized", (target[1], target[0]), np.float32)
+            cv2.resize(work, target, dst=resized, interpolation=cv2.INTER_AREA)
+            work = resized
+
+        center = decoded.default_center if center is None else center
+        width = decoded.default_width if width is None else width
+        low = center - width / 2
+
+        # (stored * slope + intercept - low) / width * 255, plus 0.5 to round
+        scale = decoded.slope * 255 / width
+        offset = (decoded.intercept - low) * 255 / width
+        if decoded.monochrome1:
+            scale, offset = -scale, 255 - offset
+
+        work *= scale
+        work += offset + 0.5
+        np.clip(work, 0, 255, out=work)
+        image = _scratch("uint8", work.shape, np.uint8)
+        np.copyto(image, work, casting="unsafe")
+
+    if image_format == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif image_format == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+
+    ok, encoded = cv2.imencode(f".{image_format}", image, params)
+    if not ok:
+        raise ValueError(f"Could not encode {image_format} render")
+    return encoded.tobytes()
+
+
+class SliceRenderer:
+    """
+    Renders job slices at any window/level, size and format.
+
+    Decoded slices are kept in an LRU bounded by RENDER_CACHE_MAX_MB of pixel
+    data, keyed by job and preview id, so adjusting the window re-renders
+    from memory instead of re-reading the DICOM. Concurrent requests for a
+    slice that is not cached share a single load. Renders run on a pool of
+    RENDER_THREADS threads, which bounds the scratch memory they keep.
+    """
+
+    def __init__(self, job_manager: JobManager, max_bytes: Optional[int] = None):
+        self.job_manager = job_manager
+        self.checkpoint = JobCheckpoint(job_manager.redis)
+        self.max_bytes = settings.RENDER_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], DecodedSlice]" = OrderedDict()
+        self._loading: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._bytes = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(settings.RENDER_THREADS, 1),
+                                            thread_name_prefix="slice-render")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.renders = 0
+        self.load_seconds = 0.0
+        self.render_seconds = 0.0
+
+    async def render(self, job_id: str, preview_id: str, center: Optional[float] = None,
+                     width: Optional[float] = None, max_side: Optional[int] = None,
+                     frame: Optional[int] = None, image_format: str = "png",
+                     quality: Optional[int] = None) -> Tuple[bytes, bool]:
+        """Encoded render of a slice, and whether its pixels came from the cache"""
+        decoded, cached = await self._get(job_id, preview_id)
+
+        started = time.perf_counter()
+        image = await asyncio.get_running_loop().run_in_executor(
+            self._executor, render_slice, decoded, center, width,
+            min(max_side or settings.RENDER_MAX_SIZE, settings.RENDER_MAX_SIZE),
+            frame, image_format, quality or settings.PREVIEW_QUALITY
+        )
+        self.render_seconds += time.perf_counter() - started
+        self.renders += 1
+        return image, cached
+
+    async def _get(self, job_id: str, preview_id: str) -> Tuple[DecodedSlice, bool]:
+        key = (job_id, preview_id)
+
+        decoded = self._entries.get(key)
+        if decoded is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return decoded, True
+
+        self.misses += 1
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(job_id, preview_id))
+            self._loading[key] = task
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+
+        # A client going away must not cancel a load other requests wait on
+        return await asyncio.shield(task), False
+
+    async def _load(self, job_id: str, preview_id: str) -> DecodedSlice:
+        source_name = await self._resolve(job_id, preview_id)
+
+        started = time.perf_counter()
+        decoded = await asyncio.to_thread(load_slice, source_name)
+        self.load_seconds += time.perf_counter() - started
+        self.loads += 1
+
+        logger.debug("Slice decoded for rendering",
+                    job_id=job_id,
+                    preview_id=preview_id,
+                    mb=round(decoded.pixels.nbytes / (1024 * 1024), 2))
+        self._put((job_id, preview_id), decoded)
+        return decoded
+
+    async def _resolve(self, job_id: str, preview_id: str) -> str:
+        """Source name of a slice, from the job's results or, while it runs, its checkpoints"""
+        job = await self.job_manager.get_job_status(job_id)
+        if not job:
+            raise LookupError("Job not found")
+
+        file_results = ((job.get("result") or {}).get("results") or {}).get("file_results") or []
+        for file_result in file_results:
+            if file_result.get("preview_id") == preview_id:
+                return file_result["file_path"]
+
+        shard_checkpoint_ids = job["payload"].get("shard_checkpoint_ids", job["payload"].get("shard_ids", []))
+        for checkpoint_id in [job_id, *shard_checkpoint_ids]:
+            for name, file_result in (await self.checkpoint.load(checkpoint_id)).items():
+                if file_result.get("preview_id") == preview_id:
+                    return name
+
+        raise LookupError("Slice not found")
+
+    def _put(self, key: Tuple[str, str], decoded: DecodedSlice):
+        size = decoded.pixels.nbytes
+        if size > self.max_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.pixels.nbytes
+
+        self._entries[key] = decoded
+        self._bytes += size
+
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.pixels.nbytes
+            self.evictions += 1
+
+    def close(self):
+        """Shut the render threads down"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache and render statistics for the metrics endpoint"""
+        lookups = self.hits + self.misses
+        return {
+            "slices": len(self._entries),
+            "cached_mb": round(self._bytes / (1024 * 1024), 1),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "loading": len(self._loading),
+            "loads": self.loads,
+            "mean_load_ms": 1000 * self.load_seconds / self.loads if self.loads else 0.0,
+            "renders": self.renders,
+            "mean_render_ms": 1000 * self.render_seconds / self.renders if self.renders else 0.0
+        }
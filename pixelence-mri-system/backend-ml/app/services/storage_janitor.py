@@ -0,0 +1,270 @@
+"""
+Storage Janitor Service
+Enforces disk quota and retention for per-job upload and results directories
+"""
+import asyncio
+import os
+import re
+import shutil
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import structlog
+
+from app.core.config import settings
+from app.services.job_manager import JobManager, TERMINAL_STATUSES
+
+logger = structlog.get_logger(__name__)
+
+# Within the quota pass, evict finished jobs that cannot be retried first
+EVICTION_ORDER = {"completed": 0, "cancelled": 0, "failed": 1}
+
+# Generated job ids; other directories without a job record are left alone
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+@dataclass
+class JobStorage:
+    """Disk usage of one job across the storage roots"""
+    job_id: str
+    paths: List[str] = field(default_factory=list)
+    bytes: int = 0
+    modified_at: float = 0.0
+
+
+def _directory_usage(path: str) -> Tuple[int, float]:
+    """Total bytes and latest mtime of a directory tree"""
+    total = 0
+    latest = os.stat(path).st_mtime
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            total += stat.st_size
+            latest = max(latest, stat.st_mtime)
+    return total, latest
+
+
+def list_job_directories(roots: List[str]) -> Dict[str, List[Tuple[str, str]]]:
+    """(root, path) of every <root>/<job_id> directory, grouped by job"""
+    directories: Dict[str, List[Tuple[str, str]]] = {}
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.setdefault(entry.name, []).append((root, entry.path))
+    return directories
+
+
+def _finished_at(job_dict: Dict[str, Any]) -> float:
+    """Time of a job record's last update"""
+    return datetime.fromisoformat(job_dict["updated_at"]).replace(tzinfo=timezone.utc).timestamp()
+
+
+class StorageJanitor:
+    """
+    Periodically reclaims job storage.
+
+    Each pass removes directories named like job ids that have neither a
+    Redis record nor a job history row (after a grace period), of finished
+    jobs older than STORAGE_RETENTION_HOURS, and then of the oldest finished
+    jobs until usage is back under STORAGE_QUOTA_LOW_WATERMARK of
+    STORAGE_QUOTA_GB. Jobs that
+    are pending, processing or waiting for a retry are never touched. Deletes run in batches of
+    STORAGE_DELETE_BATCH_SIZE with a pause between batches.
+
+    Uploads of jobs with a record are sized from the payload's upload_bytes
+    and aged from the record. Other directories are walked; those of
+    finished jobs no longer change, so their size is remembered.
+    """
+
+    def __init__(self, job_manager: JobManager, roots: List[str] = None):
+        self.job_manager = job_manager
+        self.roots = roots or [settings.UPLOAD_DIR, settings.RESULTS_DIR]
+        self._task: Optional[asyncio.Task] = None
+        self.stats_snapshot: Dict[str, Any] = {}
+        self._finished_usage: Dict[str, Tuple[int, float]] = {}
+        self.jobs_evicted = 0
+        self.orphans_removed = 0
+        self.bytes_freed = 0
+
+    async def start(self):
+        """Start the periodic janitor pass"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic janitor pass"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Storage janitor pass failed", error=str(e))
+            await asyncio.sleep(settings.STORAGE_JANITOR_INTERVAL_SECONDS)
+
+    async def run_once(self) -> Dict[str, Any]:
+        """Run one reconcile, retention and quota pass"""
+        directories = await asyncio.to_thread(list_job_directories, self.roots)
+        now = time.time()
+
+        jobs: List[JobStorage] = []
+        orphans: List[JobStorage] = []
+        expired: List[JobStorage] = []
+        evictable: List[Tuple[int, float, JobStorage]] = []
+
+        records: Dict[str, Optional[Dict[str, Any]]] = {}
+        for job_id in directories:
+            job_dict = await self.job_manager.get_job_status(job_id)
+            if job_dict is not None or JOB_ID_PATTERN.fullmatch(job_id):
+                records[job_id] = job_dict
+
+        orphan_grace = await self._recover_expired_records(records)
+
+        for job_id, job_dict in records.items():
+            job = await self._measure(job_id, directories[job_id], job_dict)
+            jobs.append(job)
+
+            if job_dict is None:
+                if now - job.modified_at > orphan_grace:
+                    orphans.append(job)
+                continue
+
+            status = job_dict["status"]
+            if status not in TERMINAL_STATUSES or job_dict.get("next_retry_at"):
+                # Still running, or failed and waiting for its automatic retry
+                continue
+
+            if now - job.modified_at > settings.STORAGE_RETENTION_HOURS * 3600:
+                expired.append(job)
+            else:
+                evictable.append((EVICTION_ORDER.get(status, 1), job.modified_at, job))
+
+        # Forget the sizes of directories that are gone
+        seen = {path for job in jobs for path in job.paths}
+        self._finished_usage = {path: usage for path, usage in self._finished_usage.items() if path in seen}
+
+        total_bytes = sum(job.bytes for job in jobs)
+        to_delete = orphans + expired
+        remaining = total_bytes - sum(job.bytes for job in to_delete)
+
+        quota_bytes = settings.STORAGE_QUOTA_GB * 1024 ** 3
+        if remaining > quota_bytes:
+            target = quota_bytes * settings.STORAGE_QUOTA_LOW_WATERMARK
+            for _, _, job in sorted(evictable, key=lambda item: item[:2]):
+                if remaining <= target:
+                    break
+                to_delete.append(job)
+                remaining -= job.bytes
+
+            if remaining > quota_bytes:
+                logger.warning("Storage over quota after eviction",
+                              used_bytes=remaining,
+                              quota_bytes=quota_bytes)
+
+        freed = await self._delete(to_delete)
+
+        self.orphans_removed += len(orphans)
+        self.jobs_evicted += len(to_delete) - len(orphans)
+        self.bytes_freed += freed
+        self.stats_snapshot = {
+            "used_bytes": total_bytes - freed,
+            "quota_bytes": quota_bytes,
+            "job_directories": len(jobs) - len(to_delete),
+            "last_run_at": now,
+            "last_run_deleted": len(to_delete)
+        }
+
+        if to_delete:
+            logger.info("Storage janitor reclaimed space",
+                       orphans=len(orphans),
+                       evicted=len(to_delete) - len(orphans),
+                       bytes_freed=freed)
+        return self.stats_snapshot
+
+    async def _recover_expired_records(self, records: Dict[str, Optional[Dict[str, Any]]]) -> float:
+        """
+        Fill in jobs whose Redis record expired from job history, so their
+        directories age from the job's finish under STORAGE_RETENTION_HOURS
+        instead of being removed as orphans. Returns the grace period for
+        directories still without a record.
+        """
+        history = self.job_manager.history
+        if not history or not history.enabled:
+            # An expired record cannot be told apart from an orphan, so keep
+            # both for the retention period
+            return max(settings.STORAGE_ORPHAN_GRACE_SECONDS, settings.STORAGE_RETENTION_HOURS * 3600)
+
+        missing = [job_id for job_id, job_dict in records.items() if job_dict is None]
+        if missing:
+            finished = await history.finished_jobs(missing)
+            for job_id, row in finished.items():
+                records[job_id] = {
+                    "job_id": job_id,
+                    "status": row["status"],
+                    "updated_at": row["finished_at"]
+                }
+        return settings.STORAGE_ORPHAN_GRACE_SECONDS
+
+    async def _measure(self, job_id: str, paths: List[Tuple[str, str]],
+                       job_dict: Optional[Dict[str, Any]]) -> JobStorage:
+        """Bytes and last modification of a job's directories"""
+        job = JobStorage(job_id=job_id)
+        finished = job_dict is not None and job_dict["status"] in TERMINAL_STATUSES
+        upload_bytes = (job_dict or {}).get("payload", {}).get("upload_bytes")
+
+        for root, path in paths:
+            if root == settings.UPLOAD_DIR and upload_bytes is not None:
+                size, modified_at = upload_bytes, _finished_at(job_dict)
+            elif path in self._finished_usage:
+                size, modified_at = self._finished_usage[path]
+            else:
+                size, modified_at = await asyncio.to_thread(_directory_usage, path)
+                if finished:
+                    self._finished_usage[path] = (size, modified_at)
+
+            job.paths.append(path)
+            job.bytes += size
+            job.modified_at = max(job.modified_at, modified_at)
+        return job
+
+    async def _delete(self, jobs: List[JobStorage]) -> int:
+        """Remove job directories in rate-limited batches"""
+        freed = 0
+        batch_size = max(settings.STORAGE_DELETE_BATCH_SIZE, 1)
+
+        for start in range(0, len(jobs), batch_size):
+            if start:
+                await asyncio.sleep(settings.STORAGE_DELETE_BATCH_PAUSE_SECONDS)
+
+            batch = jobs[start:start + batch_size]
+            await asyncio.to_thread(self._remove_batch, batch)
+            freed += sum(job.bytes for job in batch)
+
+        return freed
+
+    @staticmethod
+    def _remove_batch(batch: List[JobStorage]):
+        for job in batch:
+            for path in job.paths:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Storage usage and eviction statistics for the metrics endpoint"""
+        return {
+            **self.stats_snapshot,
+            "jobs_evicted": self.jobs_evicted,
+            "orphans_removed": self.orphans_removed,
+            "bytes_freed": self.bytes_freed
+        }
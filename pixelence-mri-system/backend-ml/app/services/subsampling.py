@@ -0,0 +1,147 @@
+"""
+Subsampling Service
+Adaptive slice selection for triage: an evenly spaced subset of each series,
+refined around slices whose prediction is uncertain or disagrees
+"""
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.services.archive_reader import DicomSource
+
+SAMPLING_MODES = ("full", "adaptive")
+
+
+def _slice_key(header) -> Tuple[str, float]:
+    """Series and position of a slice: its InstanceNumber, else its slice position"""
+    series = str(getattr(header, "SeriesInstanceUID", ""))
+
+    instance = getattr(header, "InstanceNumber", None)
+    if instance not in (None, ""):
+        return series, float(instance)
+
+    position = getattr(header, "ImagePositionPatient", None)
+    if position is not None and len(position) == 3:
+        return series, float(position[2])
+
+    location = getattr(header, "SliceLocation", None)
+    return series, float(location) if location not in (None, "") else 0.0
+
+
+def read_slice_order(sources: Iterable[Tuple[str, DicomSource]]) -> Tuple[List[List[str]], List[str]]:
+    """
+    Source names grouped by series, each series in slice order, read from
+    the headers only; plus the names of slices whose header is unreadable
+    """
+    import pydicom
+
+    keyed = []
+    unreadable = []
+    for name, source in sources:
+        try:
+            keyed.append((_slice_key(pydicom.dcmread(source, stop_before_pixels=True)), name))
+        except Exception:
+            unreadable.append(name)
+
+    keyed.sort()
+    series: Dict[str, List[str]] = {}
+    for (series_uid, _), name in keyed:
+        series.setdefault(series_uid, []).append(name)
+    return list(series.values()), unreadable
+
+
+def _finding(result: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not result or "error" in result:
+        return None
+    return result["predictions"]["primary_finding"]
+
+
+class SubsamplingPlan:
+    """
+    Which slices adaptive mode infers.
+
+    Each series is first sampled every SUBSAMPLE_STRIDE slices, plus its
+    last slice; series of at most SUBSAMPLE_MIN_SERIES_SLICES are taken
+    whole. After the samples are inferred, the skipped slices on both sides
+    of a sample that failed or fell below SUBSAMPLE_MIN_CONFIDENCE, and
+    between two consecutive samples with different findings, are inferred
+    too. Unreadable slices are always included so their failure is recorded.
+    """
+
+    def __init__(self, series: List[List[str]], unreadable: Iterable[str] = (),
+                 stride: Optional[int] = None, min_confidence: Optional[float] = None):
+        self.series = series
+        self.unreadable = set(unreadable)
+        self.stride = max(stride or settings.SUBSAMPLE_STRIDE, 1)
+        self.min_confidence = settings.SUBSAMPLE_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.sampled = [self._sample(len(names)) for names in series]
+        self.refined: Set[str] = set()
+
+    def _sample(self, count: int) -> List[int]:
+        if count <= max(settings.SUBSAMPLE_MIN_SERIES_SLICES, self.stride):
+            return list(range(count))
+
+        indices = list(range(0, count, self.stride))
+        if indices[-1] != count - 1:
+            indices.append(count - 1)
+        return indices
+
+    @property
+    def total_slices(self) -> int:
+        return sum(len(names) for names in self.series) + len(self.unreadable)
+
+    def initial(self) -> Set[str]:
+        """The evenly spaced samples to infer first"""
+        names = set(self.unreadable)
+        for series_names, indices in zip(self.series, self.sampled):
+            names.update(series_names[index] for index in indices)
+        return names
+
+    def _uncertain(self, result: Optional[Dict[str, Any]]) -> bool:
+        return _finding(result) is None or result.get("confidence", 0.0) < self.min_confidence
+
+    def refinement(self, results: Dict[str, Dict[str, Any]]) -> Set[str]:
+        """Skipped slices to infer, given the results of the samples by source name"""
+        for series_names, indices in zip(self.series, self.sampled):
+            for position, index in enumerate(indices):
+                result = results.get(series_names[index])
+                previous = indices[position - 1] if position else None
+                following = indices[position + 1] if position + 1 < len(indices) else None
+
+                gaps = []
+                if self._uncertain(result):
+                    gaps = [(previous, index), (index, following)]
+                elif following is not None and _finding(result) != _finding(results.get(series_names[following])):
+                    gaps = [(index, following)]
+
+                for start, end in gaps:
+                    if start is not None and end is not None:
+                        self.refined.update(series_names[start + 1:end])
+
+        return set(self.refined)
+
+    def summary(self, results: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Sampling mode and coverage for the aggregated result"""
+        names = set(self.unreadable).union(*self.series)
+        inferred = sum(1 for name in names if name in results)
+        return {
+            "mode": "adaptive",
+            "stride": self.stride,
+            "total_slices": self.total_slices,
+            "sampled_slices": len(self.initial()),
+            "refined_slices": len(self.refined),
+            "inferred_slices": inferred,
+            "coverage": inferred / self.total_slices if self.total_slices else 0.0
+        }
+
+
+def merge_sampling_summaries(summaries: List[Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Combine the sampling summaries of a sharded job's shards"""
+    adaptive = [summary for summary in summaries if summary and summary.get("mode") == "adaptive"]
+    if not adaptive:
+        return {"mode": "full"}
+
+    merged = {"mode": "adaptive", "stride": adaptive[0]["stride"]}
+    for key in ("total_slices", "sampled_slices", "refined_slices", "inferred_slices"):
+        merged[key] = sum(summary[key] for summary in adaptive)
+    merged["coverage"] = merged["inferred_slices"] / merged["total_slices"] if merged["total_slices"] else 0.0
+    return merged
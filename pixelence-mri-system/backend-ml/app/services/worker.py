@@ -0,0 +1,313 @@
+"""
+Processing Worker
+Pulls jobs off the priority queue and runs them through the ML pipeline
+"""
+import asyncio
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set
+import structlog
+
+from app.core.config import settings
+from app.services.admission import ThroughputTracker
+from app.services.archive_reader import iter_named_sources
+from app.services.checkpoint import JobCheckpoint
+from app.services.job_manager import SHARD_JOB_TYPE, JobManager
+from app.services.ml_processor import MLProcessor, ProcessingCancelled, ProcessingTimeout
+from app.services.sharding import ShardCoordinator
+
+logger = structlog.get_logger(__name__)
+
+
+class ProcessingWorker:
+    """Runs up to MAX_CONCURRENT_JOBS queued jobs at a time"""
+
+    def __init__(self, job_manager: JobManager, ml_processor: MLProcessor,
+                 concurrency: int = None, throughput: ThroughputTracker = None):
+        self.job_manager = job_manager
+        self.ml_processor = ml_processor
+        self.concurrency = concurrency or settings.MAX_CONCURRENT_JOBS
+        # Measured job throughput feeds admission control and ETAs
+        self.throughput = throughput
+        self.worker_id = uuid.uuid4().hex
+        self.shards = ShardCoordinator(job_manager, ml_processor)
+        # Per-file outcomes, so re-runs only process what is missing or failed
+        self.checkpoints = JobCheckpoint(job_manager.redis)
+        # Jobs this worker is running, whose leases it keeps renewing
+        self._running: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Start the consumer loops"""
+        for index in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._run(index)))
+        self._tasks.append(asyncio.create_task(self._reap_overdue_jobs()))
+        self._tasks.append(asyncio.create_task(self._renew_leases()))
+        self._tasks.append(asyncio.create_task(self._promote_due_retries()))
+        if self.throughput:
+            self._tasks.append(asyncio.create_task(self._heartbeat()))
+        logger.info("Processing worker started", concurrency=self.concurrency)
+
+    async def stop(self):
+        """Stop the consumer loops"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Processing worker stopped")
+
+    async def _run(self, index: int):
+        # Jobs stay queued until the models have been warmed up
+        await self.ml_processor.ready.wait()
+
+        while True:
+            try:
+                job_id = await self.job_manager.get_next_job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Failed to dequeue job", worker=index, error=str(e))
+                job_id = None
+
+            if not job_id:
+                await asyncio.sleep(settings.QUEUE_POLL_INTERVAL_SECONDS)
+                continue
+
+            try:
+                await self.process_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Worker failed to run job", worker=index, job_id=job_id, error=str(e))
+
+    async def _heartbeat(self):
+        """Advertise this worker's job slots once the models are ready"""
+        await self.ml_processor.ready.wait()
+
+        while True:
+            try:
+                await self.throughput.heartbeat(self.worker_id, self.concurrency)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Worker heartbeat failed", error=str(e))
+            await asyncio.sleep(settings.WORKER_HEARTBEAT_SECONDS)
+
+    async def _renew_leases(self):
+        """Keep the leases of running jobs alive while this worker is"""
+        while True:
+            await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+            try:
+                await self.job_manager.renew_leases(list(self._running))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Failed to renew job leases", error=str(e))
+
+    async def _reap_overdue_jobs(self):
+        """
+        Periodically requeue jobs of dead workers, fail jobs stuck in
+        processing past their deadline and sweep the backlog
+        """
+        while True:
+            await asyncio.sleep(settings.JOB_REAPER_INTERVAL_SECONDS)
+            try:
+                await self.job_manager.requeue_orphaned_jobs()
+                await self.job_manager.expire_overdue_jobs()
+                await self.job_manager.sweep_backlog()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Failed to expire overdue jobs", error=str(e))
+
+    async def _promote_due_retries(self):
+        """Periodically requeue failed jobs whose backoff has elapsed"""
+        while True:
+            await asyncio.sleep(settings.RETRY_POLL_INTERVAL_SECONDS)
+            try:
+                await self.job_manager.promote_due_retries()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Failed to promote due retries", error=str(e))
+
+    async def process_job(self, job_id: str):
+        """Run a queued DICOM processing job"""
+        job = await self.job_manager.get_job_status(job_id)
+
+        if not job:
+            # Expired while waiting in the queue; it will never finish
+            await self.job_manager.remove_from_backlog(job_id)
+            return
+
+        if job["status"] != "pending":
+            # Cancelled while waiting, or picked up by another worker
+            return
+
+        self._running.add(job_id)
+        try:
+            if job["job_type"] == SHARD_JOB_TYPE:
+                await self.process_shard(job)
+                return
+
+            payload = job["payload"]
+            await self.process_dicom_files(
+                job_id,
+                payload.get("file_paths", []),
+                early_stop_confidence=payload.get("early_stop_confidence"),
+                estimated_slices=payload.get("estimated_slices"),
+                sampling=payload.get("sampling") or "full"
+            )
+        finally:
+            self._running.discard(job_id)
+
+    async def process_dicom_files(self, job_id: str, file_paths: List[str],
+                                  early_stop_confidence: Optional[float] = None,
+                                  estimated_slices: Optional[int] = None,
+                                  sampling: str = "full"):
+        """Process a job's stored files and record the outcome on the job"""
+        run_id = await self.job_manager.start_processing(job_id, settings.JOB_TIMEOUT_SECONDS)
+        if not run_id:
+            # Picked up by another worker or cancelled in the meantime
+            return
+
+        if self.shards.should_shard(estimated_slices):
+            try:
+                if await self.shards.fan_out(job_id, file_paths):
+                    # Shard jobs finish it; the last one reduces into this job.
+                    # Its deadline still applies, but no worker holds it now.
+                    await self.job_manager.release_lease(job_id)
+                    return
+            except Exception as e:
+                logger.error("Failed to fan out job", job_id=job_id, error=str(e))
+                await self.job_manager.fail_job(job_id, str(e), progress=0, run_id=run_id)
+                return
+
+        deadline = time.monotonic() + settings.JOB_TIMEOUT_SECONDS
+
+        # Stops this run once the job is cancelled, or requeued or failed
+        # under it (e.g. after its lease or deadline ran out)
+        async def is_cancelled() -> bool:
+            return await self.job_manager.is_job_cancelled(job_id, run_id)
+
+        try:
+            await self.job_manager.update_job_status(job_id, "processing", progress=50, run_id=run_id)
+
+            async def publish_partial_result(snapshot: Dict[str, Any]):
+                await self.job_manager.update_job_status(
+                    job_id, "processing", partial_result=snapshot, run_id=run_id
+                )
+
+            # Process files with ML model, resuming from any earlier run
+            results = await self.ml_processor.process_dicom_files(
+                file_paths,
+                job_id,
+                on_partial_result=publish_partial_result,
+                early_stop_confidence=early_stop_confidence,
+                is_cancelled=is_cancelled,
+                deadline=deadline,
+                resume_from=await self.checkpoints.load(job_id),
+                on_batch_results=lambda batch: self.checkpoints.save(job_id, batch),
+                preview_job_id=job_id if settings.PREVIEWS_ENABLED else None,
+                index_job_id=job_id if settings.EMBEDDINGS_ENABLED else None,
+                sampling=sampling
+            )
+
+            # Update job with results
+            if not await self.job_manager.update_job_status(
+                job_id,
+                "completed",
+                progress=100,
+                result=results,
+                run_id=run_id
+            ):
+                logger.info("DICOM processing result discarded", job_id=job_id)
+                return
+
+            await self.checkpoints.clear(job_id)
+            await self._record_throughput(results)
+
+            # Clean up uploaded files (optional - keep for debugging)
+            # shutil.rmtree(os.path.dirname(file_paths[0]), ignore_errors=True)
+
+            logger.info("DICOM processing completed", job_id=job_id)
+
+        except ProcessingCancelled:
+            # Cancelled, or taken over by another run; nothing to record
+            logger.info("DICOM processing stopped", job_id=job_id)
+
+        except ProcessingTimeout:
+            await self.job_manager.fail_job(
+                job_id,
+                f"Job timed out after {settings.JOB_TIMEOUT_SECONDS}s",
+                run_id=run_id
+            )
+
+        except Exception as e:
+            logger.error("DICOM processing failed", job_id=job_id, error=str(e))
+            await self.job_manager.fail_job(job_id, str(e), progress=0, run_id=run_id)
+
+    async def _record_throughput(self, results: Dict[str, Any]):
+        """Feed the files actually processed in this run into the throughput average"""
+        if self.throughput:
+            processed = results["file_count"] - results.get("resumed_files", 0)
+            await self.throughput.record_job(processed, results["processing_time"])
+
+    async def process_shard(self, job: Dict[str, Any]):
+        """Process one shard of a fanned-out job and report it to the parent"""
+        shard_id = job["job_id"]
+        parent_id = job["payload"]["parent_id"]
+        checkpoint_id = job["payload"].get("checkpoint_id", shard_id)
+
+        run_id = await self.job_manager.start_processing(shard_id, settings.JOB_TIMEOUT_SECONDS)
+        if not run_id:
+            return
+
+        deadline = time.monotonic() + settings.JOB_TIMEOUT_SECONDS
+
+        async def is_cancelled() -> bool:
+            return (await self.job_manager.is_job_cancelled(shard_id, run_id)
+                    or await self.shards.parent_finished(parent_id, job["payload"].get("shard_run")))
+
+        try:
+            results = await self.ml_processor.process_dicom_files(
+                [],
+                shard_id,
+                # Only the parent's full result may decide an early stop
+                early_stop_confidence=0,
+                is_cancelled=is_cancelled,
+                deadline=deadline,
+                sources=iter_named_sources(job["payload"]["files"]),
+                # Kept until expiry: a retried parent re-runs its shards
+                resume_from=await self.checkpoints.load(checkpoint_id),
+                on_batch_results=lambda batch: self.checkpoints.save(checkpoint_id, batch),
+                # Previews belong to the job the viewer knows about
+                preview_job_id=parent_id if settings.PREVIEWS_ENABLED else None,
+                index_job_id=parent_id if settings.EMBEDDINGS_ENABLED else None,
+                # Each shard samples its own part of a series
+                sampling=job["payload"].get("sampling") or "full"
+            )
+
+            if not await self.job_manager.update_job_status(
+                shard_id, "completed", progress=100, result=results, run_id=run_id
+            ):
+                return
+
+            await self._record_throughput(results)
+
+            await self.shards.shard_completed(job)
+
+        except ProcessingCancelled:
+            # The parent finished or was cancelled; retire the shard too,
+            # unless another run has taken it over
+            await self.job_manager.update_job_status(shard_id, "cancelled", run_id=run_id)
+
+        except ProcessingTimeout:
+            error = f"Job timed out after {settings.JOB_TIMEOUT_SECONDS}s"
+            if await self.job_manager.fail_job(shard_id, error, run_id=run_id):
+                await self.shards.shard_failed(job, error)
+
+        except Exception as e:
+            logger.error("Shard processing failed", job_id=shard_id, error=str(e))
+            if await self.job_manager.fail_job(shard_id, str(e), progress=0, run_id=run_id):
+                await self.shards.shard_failed(job, str(e))
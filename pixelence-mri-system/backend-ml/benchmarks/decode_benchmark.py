@@ -0,0 +1,169 @@
+"""
+DICOM decode benchmark
+
+Builds synthetic MR slices in each requested transfer syntax and records:
+  - handlers: seconds per slice for every installed handler of the syntax
+  - decoder:  slices per second through DicomDecoder, on one thread and
+              across the process pool
+
+pydicom can only encode RLE Lossless itself; pass --input-dir with real
+JPEG 2000 / JPEG-LS files to include those syntaxes.
+
+Run from the backend-ml directory:
+    python benchmarks/decode_benchmark.py --slices 64 --size 512 --output decode.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, RLELossless, generate_uid
+
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_ROOT)
+
+from app.services.dicom_decoder import DicomDecoder, handlers_for, transfer_syntax_of  # noqa: E402
+
+SYNTHETIC_SYNTAXES = {"explicit": ExplicitVRLittleEndian, "rle": RLELossless}
+
+
+def synthetic_slice(size: int, seed: int, transfer_syntax: str,
+                    patient_id: str = "SYNTHETIC", instance_number: int = 1) -> bytes:
+    """A 12-bit MR-like slice: smooth anatomy-ish structure plus noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    pixels = 2000 + 1000 * np.sin(x / 23 + seed) * np.cos(y / 31) + rng.normal(0, 20, (size, size))
+    pixels = pixels.clip(0, 4095).astype(np.uint16)
+
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = MRImageStorage
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.SOPClassUID = MRImageStorage
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.Modality = "MR"
+    ds.PatientID = patient_id
+    ds.InstanceNumber = instance_number
+    ds.StudyInstanceUID = generate_uid()
+    ds.SeriesInstanceUID = generate_uid()
+    ds.Rows = ds.Columns = size
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 12
+    ds.HighBit = 11
+    ds.PixelRepresentation = 0
+    ds.PixelData = pixels.tobytes()
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+
+    if transfer_syntax == RLELossless:
+        ds.compress(RLELossless, pixels)
+
+    buffer = io.BytesIO()
+    ds.save_as(buffer, write_like_original=False)
+    return buffer.getvalue()
+
+
+def load_input_dir(path: str) -> Dict[str, List[bytes]]:
+    """Real DICOM files grouped by transfer syntax"""
+    datasets = defaultdict(list)
+    for root, _, files in os.walk(path):
+        for name in files:
+            with open(os.path.join(root, name), "rb") as f:
+                data = f.read()
+            try:
+                dataset = pydicom.dcmread(io.BytesIO(data), stop_before_pixels=True)
+            except Exception:
+                continue
+            datasets[transfer_syntax_of(dataset)].append(data)
+    return datasets
+
+
+def bench_handlers(blobs: List[bytes]) -> Dict[str, float]:
+    """Mean decode seconds per slice for each handler of the syntax"""
+    transfer_syntax = transfer_syntax_of(pydicom.dcmread(io.BytesIO(blobs[0]), stop_before_pixels=True))
+    timings = {}
+    for handler in list(handlers_for(transfer_syntax)):
+        try:
+            started = time.perf_counter()
+            for blob in blobs:
+                pydicom.dcmread(io.BytesIO(blob)).convert_pixel_data(handler_name=handler)
+            timings[handler] = (time.perf_counter() - started) / len(blobs)
+        except Exception as e:
+            timings[handler] = f"failed: {e}"
+    return timings
+
+
+async def bench_decoder(blobs: List[bytes], processes: int) -> Dict[str, float]:
+    """Slices per second through DicomDecoder with `processes` processes"""
+    decoder = DicomDecoder(processes)
+    decoder.start()
+    try:
+        # Pay process start-up and imports before timing
+        await decoder.decode_batch([("warm-up", io.BytesIO(blob)) for blob in blobs[:processes]])
+
+        started = time.perf_counter()
+        results = await decoder.decode_batch(
+            [(f"slice-{index}", io.BytesIO(blob)) for index, blob in enumerate(blobs)]
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        decoder.close()
+
+    failed = sum(1 for result in results if "error" in result)
+    return {"processes": processes, "seconds": elapsed,
+            "slices_per_second": len(blobs) / elapsed, "failed": failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--slices", type=int, default=64)
+    parser.add_argument("--size", type=int, default=512, help="Rows and columns per slice")
+    parser.add_argument("--syntaxes", nargs="+", default=list(SYNTHETIC_SYNTAXES),
+                        choices=list(SYNTHETIC_SYNTAXES))
+    parser.add_argument("--input-dir", help="Also benchmark the DICOM files found here")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    datasets: Dict[str, List[bytes]] = {}
+    for name in args.syntaxes:
+        uid = SYNTHETIC_SYNTAXES[name]
+        datasets[uid] = [synthetic_slice(args.size, seed, uid) for seed in range(args.slices)]
+    if args.input_dir:
+        datasets.update(load_input_dir(args.input_dir))
+
+    report = {}
+    for uid, blobs in datasets.items():
+        entry = {
+            "name": pydicom.uid.UID(uid).name,
+            "slices": len(blobs),
+            "mean_slice_bytes": sum(map(len, blobs)) / len(blobs),
+            "handlers": bench_handlers(blobs),
+            "decoder": [
+                asyncio.run(bench_decoder(blobs, 1)),
+                asyncio.run(bench_decoder(blobs, args.processes))
+            ]
+        }
+        report[uid] = entry
+        print(f"{entry['name']}: {entry['handlers']}", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
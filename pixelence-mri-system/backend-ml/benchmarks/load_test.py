@@ -0,0 +1,404 @@
+"""
+End-to-end load test for the ML service
+
+Drives app.main:app with synthetic DICOM uploads over a concurrency sweep.
+For each concurrency level, it records:
+  - endpoints:       request count, status codes, throughput and p50/p95/p99
+                     latency per endpoint
+  - job_completion:  seconds from upload to the status poll that saw the job
+                     finish, plus completed, failed, rejected (429) and
+                     unfinished job counts
+  - within_slo:      whether the upload and status-poll p99 stayed within
+                     --slo-upload-p99-ms and --slo-status-p99-ms
+
+Arrival patterns (--pattern):
+  - steady: each client uploads, polls the job until it finishes, and repeats
+  - burst:  every client uploads at once every --burst-interval seconds
+  - mixed:  steady uploaders plus --viewers-per-client status pollers, like
+            viewers refreshing job pages
+
+By default the app runs in this process against fakeredis, with a temporary
+SQLite job history and storage. Use --redis local for the configured Redis,
+or --url to load a running deployment instead:
+    python benchmarks/load_test.py --concurrency 1 2 4 8 --duration 60 --output load.json
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --pattern mixed
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_ROOT)
+
+PATTERNS = ("steady", "burst", "mixed")
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+MAX_FILES_PER_UPLOAD = 10
+
+UPLOAD = "POST /api/v1/process-dicom"
+STATUS = "GET /api/v1/job/{job_id}/status"
+RESULTS = "GET /api/v1/job/{job_id}/results"
+
+# Fixed-width patient id of the template slices, rewritten per upload so no
+# two uploads have the same content (identical uploads are de-duplicated)
+PATIENT_ID_TEMPLATE = "LOADTEST" + "0" * 8
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def distribution(values: List[float], scale: float = 1.0) -> Dict[str, Any]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": scale * sum(values) / len(values),
+        "p50": scale * percentile(values, 50),
+        "p95": scale * percentile(values, 95),
+        "p99": scale * percentile(values, 99),
+        "max": scale * max(values)
+    }
+
+
+class Payloads:
+    """Synthetic uploads of --slices-per-upload slices, each with unique content"""
+
+    def __init__(self, slices: int, size: int):
+        from decode_benchmark import synthetic_slice
+        from pydicom.uid import ExplicitVRLittleEndian
+
+        self.slices = slices
+        self.templates = [
+            synthetic_slice(size, seed, ExplicitVRLittleEndian,
+                            patient_id=PATIENT_ID_TEMPLATE, instance_number=seed + 1)
+            for seed in range(slices)
+        ]
+        self._counter = itertools.count()
+
+    def __iter__(self) -> Iterator[List[Tuple[str, Tuple[str, bytes, str]]]]:
+        return self
+
+    def __next__(self) -> List[Tuple[str, Tuple[str, bytes, str]]]:
+        upload = next(self._counter)
+        patient_id = f"LT{upload:014d}".encode()
+        slices = [
+            template.replace(PATIENT_ID_TEMPLATE.encode(), patient_id)
+            for template in self.templates
+        ]
+
+        if len(slices) <= MAX_FILES_PER_UPLOAD:
+            return [
+                ("files", (f"slice-{index:04d}.dcm", data, "application/dicom"))
+                for index, data in enumerate(slices)
+            ]
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+            for index, data in enumerate(slices):
+                zf.writestr(f"slice-{index:04d}.dcm", data)
+        return [("files", (f"study-{upload}.zip", archive.getvalue(), "application/zip"))]
+
+
+class Recorder:
+    """Latencies and outcomes of one concurrency level"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.job_seconds: List[float] = []
+        self.jobs = Counter()
+
+    def record(self, endpoint: str, seconds: float, status):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][str(status)] += 1
+
+    def report(self, elapsed: float, slices_per_upload: int) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint, latencies in self.latencies.items():
+            errors = sum(
+                count for status, count in self.statuses[endpoint].items()
+                if not status.startswith("2") and status != "429"
+            )
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "requests_per_second": len(latencies) / elapsed,
+                "errors": errors,
+                "status_codes": dict(self.statuses[endpoint]),
+                "latency_ms": distribution(latencies, scale=1000)
+            }
+
+        return {
+            "elapsed_seconds": elapsed,
+            "jobs": dict(self.jobs),
+            "completed_jobs_per_second": self.jobs["completed"] / elapsed,
+            "completed_slices_per_second": self.jobs["completed"] * slices_per_upload / elapsed,
+            "job_completion_seconds": distribution(self.job_seconds),
+            "endpoints": endpoints
+        }
+
+
+class LoadRun:
+    """One concurrency level of one arrival pattern"""
+
+    def __init__(self, client: httpx.AsyncClient, payloads: Payloads, args, concurrency: int):
+        self.client = client
+        self.payloads = payloads
+        self.args = args
+        self.concurrency = concurrency
+        self.recorder = Recorder()
+        self.job_ids: List[str] = []
+        self.end = 0.0
+        self.drain_deadline = 0.0
+
+    async def request(self, method: str, endpoint: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.record(endpoint, time.perf_counter() - started, type(e).__name__)
+            return None
+        self.recorder.record(endpoint, time.perf_counter() - started, response.status_code)
+        return response
+
+    async def upload_and_wait(self):
+        """Upload one study and poll it until it finishes or the drain deadline passes"""
+        started = time.perf_counter()
+        response = await self.request(
+            "POST", UPLOAD, "/api/v1/process-dicom",
+            files=next(self.payloads),
+            data={"priority": self.args.priority, "facility_id": self.args.facility_id}
+        )
+
+        if response is None or response.status_code != 200:
+            if response is not None and response.status_code == 429:
+                self.recorder.jobs["rejected"] += 1
+                retry_after = float(response.headers.get("Retry-After", 1))
+                await asyncio.sleep(min(retry_after, max(self.end - time.perf_counter(), 0)))
+            else:
+                self.recorder.jobs["upload_failed"] += 1
+            return
+
+        job_id = response.json()["job_id"]
+        self.job_ids.append(job_id)
+
+        while time.perf_counter() < self.drain_deadline:
+            await asyncio.sleep(self.args.poll_interval)
+            response = await self.request("GET", STATUS, f"/api/v1/job/{job_id}/status")
+            if response is None or response.status_code != 200:
+                continue
+
+            status = response.json()["status"]
+            if status in TERMINAL_STATUSES:
+                self.recorder.job_seconds.append(time.perf_counter() - started)
+                self.recorder.jobs[status] += 1
+                if status == "completed":
+                    await self.request("GET", RESULTS, f"/api/v1/job/{job_id}/results")
+                return
+
+        self.recorder.jobs["unfinished"] += 1
+
+    async def steady_client(self, index: int):
+        # Stagger the first uploads over one poll interval
+        await asyncio.sleep(self.args.poll_interval * index / self.concurrency)
+        while time.perf_counter() < self.end:
+            await self.upload_and_wait()
+
+    async def burst_client(self):
+        pending = []
+        while time.perf_counter() < self.end:
+            pending.append(asyncio.create_task(self.upload_and_wait()))
+            await asyncio.sleep(self.args.burst_interval)
+        await asyncio.gather(*pending)
+
+    async def viewer(self):
+        """Poll the status of recently uploaded jobs, as open job pages do"""
+        while time.perf_counter() < self.end:
+            await asyncio.sleep(self.args.viewer_interval)
+            if self.job_ids:
+                job_id = random.choice(self.job_ids[-self.concurrency * 4:])
+                await self.request("GET", STATUS, f"/api/v1/job/{job_id}/status")
+
+    async def run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        self.end = started + self.args.duration
+        self.drain_deadline = self.end + self.args.drain_timeout
+
+        if self.args.pattern == "burst":
+            clients = [self.burst_client() for _ in range(self.concurrency)]
+        else:
+            clients = [self.steady_client(index) for index in range(self.concurrency)]
+            if self.args.pattern == "mixed":
+                clients += [self.viewer() for _ in range(self.concurrency * self.args.viewers_per_client)]
+
+        await asyncio.gather(*clients)
+        report = self.recorder.report(time.perf_counter() - started, self.payloads.slices)
+        report["concurrency"] = self.concurrency
+        report["within_slo"] = self.within_slo(report)
+        return report
+
+    def within_slo(self, report: Dict[str, Any]) -> bool:
+        limits = {UPLOAD: self.args.slo_upload_p99_ms, STATUS: self.args.slo_status_p99_ms}
+        for endpoint, limit in limits.items():
+            p99 = report["endpoints"].get(endpoint, {}).get("latency_ms", {}).get("p99")
+            if p99 is not None and p99 > limit:
+                return False
+        return not report["jobs"].get("unfinished") and not any(
+            stats["errors"] for stats in report["endpoints"].values()
+        )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float):
+    """Wait for model warm-up, so the sweep measures processing rather than start-up"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/health/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError("Service did not become ready")
+
+
+async def service_metrics(client: httpx.AsyncClient) -> Optional[Dict[str, Any]]:
+    try:
+        response = await client.get("/metrics")
+        return response.json() if response.status_code == 200 else None
+    except httpx.HTTPError:
+        return None
+
+
+async def sweep(client: httpx.AsyncClient, args) -> List[Dict[str, Any]]:
+    await wait_until_ready(client, args.ready_timeout)
+    payloads = Payloads(args.slices_per_upload, args.size)
+
+    levels = []
+    for concurrency in args.concurrency:
+        level = await LoadRun(client, payloads, args, concurrency).run()
+        level["service_metrics"] = await service_metrics(client)
+        levels.append(level)
+
+        upload = level["endpoints"].get(UPLOAD, {}).get("latency_ms", {})
+        status = level["endpoints"].get(STATUS, {}).get("latency_ms", {})
+        print(f"concurrency {concurrency}: jobs {level['jobs']}, "
+              f"upload p99 {upload.get('p99')}ms, status p99 {status.get('p99')}ms, "
+              f"within SLO {level['within_slo']}", file=sys.stderr)
+    return levels
+
+
+def fake_redis_client():
+    """The service's instrumented Redis pool, backed by an in-process fakeredis server"""
+    import fakeredis
+    import redis.asyncio as redis
+    from fakeredis.aioredis import FakeConnection
+
+    from app.core.config import settings
+    from app.db.redis_pool import InstrumentedConnectionPool
+
+    pool = InstrumentedConnectionPool(
+        connection_class=FakeConnection,
+        server=fakeredis.FakeServer(),
+        max_connections=settings.REDIS_POOL_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT_SECONDS,
+        decode_responses=True
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+async def run_in_process(args) -> List[Dict[str, Any]]:
+    """Run the app's lifespan in this process and send requests through ASGI"""
+    import app.main
+
+    if args.redis == "fake":
+        app.main.create_redis_client = fake_redis_client
+
+    async with app.main.app.router.lifespan_context(app.main.app):
+        transport = httpx.ASGITransport(app=app.main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest",
+                                     timeout=args.request_timeout) as client:
+            return await sweep(client, args)
+
+
+async def run_against_url(args) -> List[Dict[str, Any]]:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.request_timeout, limits=limits) as client:
+        return await sweep(client, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pattern", choices=PATTERNS, default="steady")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Concurrent clients per level of the sweep")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of arrivals per level")
+    parser.add_argument("--drain-timeout", type=float, default=300.0,
+                        help="Seconds to wait for outstanding jobs after each level")
+    parser.add_argument("--slices-per-upload", type=int, default=1,
+                        help=f"More than {MAX_FILES_PER_UPLOAD} are sent as a ZIP archive")
+    parser.add_argument("--size", type=int, default=256, help="Rows and columns per slice")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--burst-interval", type=float, default=10.0)
+    parser.add_argument("--viewers-per-client", type=int, default=4)
+    parser.add_argument("--viewer-interval", type=float, default=0.2)
+    parser.add_argument("--priority", default="normal")
+    parser.add_argument("--facility-id", default="loadtest")
+    parser.add_argument("--slo-upload-p99-ms", type=float, default=2000.0)
+    parser.add_argument("--slo-status-p99-ms", type=float, default=250.0)
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--redis", choices=("fake", "local"), default="fake",
+                        help="Redis for the in-process app: fakeredis, or the configured REDIS_*")
+    parser.add_argument("--url", help="Load this running service instead of an in-process app")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.url:
+        target = args.url
+        levels = asyncio.run(run_against_url(args))
+    else:
+        # Settings are read when app.main is imported, so set them first
+        work_dir = tempfile.mkdtemp(prefix="pixelence-loadtest-")
+        os.environ.setdefault("UPLOAD_DIR", os.path.join(work_dir, "uploads"))
+        os.environ.setdefault("RESULTS_DIR", os.path.join(work_dir, "results"))
+        os.environ.setdefault("EMBEDDING_INDEX_DIR", os.path.join(work_dir, "embeddings"))
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(work_dir, 'history.db')}")
+        target = f"in-process ({args.redis} redis), storage in {work_dir}"
+        levels = asyncio.run(run_in_process(args))
+
+    compliant = [level["concurrency"] for level in levels if level["within_slo"]]
+    report = {
+        "target": target,
+        "pattern": args.pattern,
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("output", "url")
+        },
+        "levels": levels,
+        "max_concurrency_within_slo": max(compliant) if compliant else None
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Startup benchmark for the ML service
+
+Starts `uvicorn app.main:app` repeatedly and records, per run:
+  - import_seconds: time to import app.main in a fresh interpreter
+  - bind_seconds:   process start until /health/live answers
+  - ready_seconds:  process start until /health/ready answers 200
+
+Run from the backend-ml directory with Redis available:
+    python benchmarks/startup_benchmark.py --runs 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLL_INTERVAL_SECONDS = 0.05
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return 0
+
+
+def _wait_for(url: str, started: float, deadline: float, ok=lambda status: status == 200):
+    while time.perf_counter() < deadline:
+        if ok(_status(url)):
+            return time.perf_counter() - started
+        time.sleep(POLL_INTERVAL_SECONDS)
+    return None
+
+
+def measure_import() -> float:
+    """Seconds to import app.main in a fresh interpreter"""
+    code = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_ROOT,
+        capture_output=True, text=True, check=True
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def measure_startup(timeout: float) -> dict:
+    """Seconds from process start to liveness and to readiness"""
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    try:
+        deadline = started + timeout
+        bind_seconds = _wait_for(f"{base_url}/health/live", started, deadline)
+        ready_seconds = _wait_for(f"{base_url}/health/ready", started, deadline)
+        return {"bind_seconds": bind_seconds, "ready_seconds": ready_seconds}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _summary(values: list) -> dict:
+    values = [value for value in values if value is not None]
+    if not values:
+        return {"runs": 0}
+    return {
+        "runs": len(values),
+        "min": min(values),
+        "median": statistics.median(values),
+        "max": max(values)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300.0,
+                        help="Seconds to wait for readiness per run")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    runs = []
+    for index in range(args.runs):
+        run = {"import_seconds": measure_import(), **measure_startup(args.timeout)}
+        runs.append(run)
+        print(f"run {index + 1}: {run}", file=sys.stderr)
+
+    report = {
+        "runs": runs,
+        "summary": {
+            key: _summary([run[key] for run in runs])
+            for key in ("import_seconds", "bind_seconds", "ready_seconds")
+        }
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest_asyncio
+from fakeredis import aioredis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.job_manager import JobManager  # noqa: E402
+
+
+@pytest_asyncio.fixture
+async def redis_client():
+    client = aioredis.FakeRedis(decode_responses=True)
+    yield client
+    await client.flushall()
+    await client.aclose()
+
+
+@pytest_asyncio.fixture
+async def job_manager(redis_client):
+    return JobManager(redis_client)
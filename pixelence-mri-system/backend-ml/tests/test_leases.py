@@ -0,0 +1,75 @@
+import pytest
+
+from app.core.config import settings
+
+
+async def _start(job_manager, job_id):
+    assert await job_manager.get_next_job() == job_id
+    run_id = await job_manager.start_processing(job_id)
+    assert run_id
+    return run_id
+
+
+@pytest.mark.asyncio
+async def test_live_lease_is_not_requeued(job_manager):
+    job_id = await job_manager.create_job("dicom", {})
+    await _start(job_manager, job_id)
+    await job_manager.renew_leases([job_id])
+
+    assert await job_manager.requeue_orphaned_jobs() == 0
+    assert (await job_manager.get_job_status(job_id))["status"] == "processing"
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_requeues_job(job_manager, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_LEASE_SECONDS", -1)
+    job_id = await job_manager.create_job("dicom", {})
+    await _start(job_manager, job_id)
+
+    assert await job_manager.requeue_orphaned_jobs() == 1
+
+    job = await job_manager.get_job_status(job_id)
+    assert job["status"] == "pending"
+    assert job["orphaned"] == 1
+    assert await job_manager.get_next_job() == job_id
+    assert await job_manager.redis.zcard(job_manager.running_key) == 0
+
+
+@pytest.mark.asyncio
+async def test_stalled_run_is_superseded_after_requeue(job_manager, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_LEASE_SECONDS", -1)
+    job_id = await job_manager.create_job("dicom", {})
+    stalled_run = await _start(job_manager, job_id)
+    await job_manager.requeue_orphaned_jobs()
+
+    # The stalled worker stops at its next check, even before a new run starts
+    assert await job_manager.is_job_cancelled(job_id, stalled_run)
+
+    new_run = await _start(job_manager, job_id)
+    assert new_run != stalled_run
+    assert await job_manager.is_job_cancelled(job_id, stalled_run)
+    assert not await job_manager.is_job_cancelled(job_id, new_run)
+
+    assert not await job_manager.update_job_status(job_id, "completed", result={"run": "stalled"}, run_id=stalled_run)
+    assert not await job_manager.fail_job(job_id, "stalled", run_id=stalled_run)
+    assert (await job_manager.get_job_status(job_id))["status"] == "processing"
+
+    assert await job_manager.update_job_status(job_id, "completed", result={"run": "new"}, run_id=new_run)
+    assert (await job_manager.get_job_status(job_id))["result"] == {"run": "new"}
+
+
+@pytest.mark.asyncio
+async def test_repeatedly_orphaned_job_fails(job_manager, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_LEASE_SECONDS", -1)
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 2)
+    job_id = await job_manager.create_job("dicom", {})
+
+    await _start(job_manager, job_id)
+    assert await job_manager.requeue_orphaned_jobs() == 1
+    await _start(job_manager, job_id)
+    assert await job_manager.requeue_orphaned_jobs() == 0
+
+    job = await job_manager.get_job_status(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "Worker stopped responding"
+    assert await job_manager.redis.zcard(job_manager.lease_key) == 0
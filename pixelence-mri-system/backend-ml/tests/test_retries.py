@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from app.core.config import settings
+
+
+@pytest.fixture(autouse=True)
+def immediate_retries(monkeypatch):
+    monkeypatch.setattr(settings, "RETRY_BASE_DELAY_SECONDS", 0)
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 3)
+
+
+async def _start(job_manager, job_id, timeout_seconds=None):
+    assert await job_manager.get_next_job() == job_id
+    run_id = await job_manager.start_processing(job_id, timeout_seconds)
+    assert run_id
+    return run_id
+
+
+@pytest.mark.asyncio
+async def test_failed_job_is_promoted_and_queued(job_manager):
+    job_id = await job_manager.create_job("dicom", {})
+    run_id = await _start(job_manager, job_id)
+    assert await job_manager.fail_job(job_id, "boom", run_id=run_id)
+
+    assert await job_manager.promote_due_retries() == 1
+
+    job = await job_manager.get_job_status(job_id)
+    assert job["status"] == "pending"
+    assert job["attempts"] == 1
+    assert await job_manager.redis.zcard(job_manager.retry_key) == 0
+    assert await job_manager.get_next_job() == job_id
+
+
+@pytest.mark.asyncio
+async def test_promotion_requeues_job_left_pending(job_manager):
+    job_id = await job_manager.create_job("dicom", {})
+    run_id = await _start(job_manager, job_id)
+    await job_manager.fail_job(job_id, "boom", run_id=run_id)
+
+    # A poller that moved the job to pending but stopped before queueing it
+    await job_manager.update_job_status(job_id, "pending")
+    assert await job_manager.get_next_job() is None
+
+    await job_manager.promote_due_retries()
+    assert await job_manager.get_next_job() == job_id
+    assert await job_manager.redis.zcard(job_manager.retry_key) == 0
+
+
+@pytest.mark.asyncio
+async def test_last_attempt_is_dead_lettered(job_manager):
+    job_id = await job_manager.create_job("dicom", {})
+    for _ in range(settings.JOB_MAX_ATTEMPTS):
+        run_id = await _start(job_manager, job_id)
+        await job_manager.fail_job(job_id, "boom", run_id=run_id)
+        await job_manager.promote_due_retries()
+
+    job = await job_manager.get_job_status(job_id)
+    assert job["status"] == "failed"
+    assert job["dead_lettered"]
+    assert await job_manager.redis.lrange(job_manager.dead_letter_key, 0, -1) == [job_id]
+    assert await job_manager.get_next_job() is None
+
+
+@pytest.mark.asyncio
+async def test_overdue_run_is_stopped_before_its_retry(job_manager):
+    job_id = await job_manager.create_job("dicom", {})
+    overdue_run = await _start(job_manager, job_id, timeout_seconds=-1)
+
+    assert await job_manager.expire_overdue_jobs() == 1
+    assert await job_manager.is_job_cancelled(job_id, overdue_run)
+
+    await job_manager.promote_due_retries()
+    retry_run = await _start(job_manager, job_id)
+
+    # The overdue worker finishing late cannot overwrite the retry
+    assert not await job_manager.update_job_status(job_id, "completed", result={}, run_id=overdue_run)
+    assert not await job_manager.is_job_cancelled(job_id, retry_run)
+    assert await job_manager.redis.zscore(job_manager.running_key, job_id) > time.time()
+
+
+@pytest.mark.asyncio
+async def test_restarted_job_is_not_expired(job_manager, monkeypatch):
+    job_id = await job_manager.create_job("dicom", {})
+    await _start(job_manager, job_id, timeout_seconds=-1)
+    overdue = job_manager.redis.zrangebyscore
+
+    # Restarted with a fresh deadline after the reaper listed it as overdue
+    async def listed_then_restarted(*args, **kwargs):
+        job_ids = await overdue(*args, **kwargs)
+        await job_manager.redis.zadd(job_manager.running_key, {job_id: time.time() + 60})
+        return job_ids
+
+    monkeypatch.setattr(job_manager.redis, "zrangebyscore", listed_then_restarted)
+
+    assert await job_manager.expire_overdue_jobs() == 0
+    assert (await job_manager.get_job_status(job_id))["status"] == "processing"
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from app.services import sharding
+from app.services.sharding import ShardCoordinator
+
+
+@pytest.fixture
+def coordinator(job_manager, monkeypatch):
+    monkeypatch.setattr(sharding, "plan_shards", lambda file_paths, shard_size: [[path] for path in file_paths])
+    coordinator = ShardCoordinator(job_manager, ml_processor=None)
+    coordinator.reduced = []
+
+    async def reduce(parent_id):
+        coordinator.reduced.append(parent_id)
+
+    coordinator.reduce = reduce
+    return coordinator
+
+
+async def _fanned_out_parent(job_manager, coordinator, files):
+    parent_id = await job_manager.create_job("dicom", {"files": files}, enqueue=False)
+    assert await coordinator.fan_out(parent_id, files) == len(files)
+    return parent_id
+
+
+async def _shards(job_manager, parent_id):
+    parent = await job_manager.get_job_status(parent_id)
+    return [await job_manager.get_job_status(shard_id) for shard_id in parent["payload"]["shard_ids"]]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_completions_reduce_once(job_manager, coordinator):
+    parent_id = await _fanned_out_parent(job_manager, coordinator, ["a", "b", "c", "d"])
+    shards = await _shards(job_manager, parent_id)
+
+    # Every shard reported twice, e.g. by a worker and a redelivery
+    await asyncio.gather(*(coordinator.shard_completed(shard) for shard in shards + shards))
+
+    assert coordinator.reduced == [parent_id]
+
+
+@pytest.mark.asyncio
+async def test_progress_follows_completions(job_manager, coordinator):
+    parent_id = await _fanned_out_parent(job_manager, coordinator, ["a", "b", "c", "d"])
+    shards = await _shards(job_manager, parent_id)
+
+    await coordinator.shard_completed(shards[0])
+    await coordinator.shard_completed(shards[0])
+
+    parent = await job_manager.get_job_status(parent_id)
+    assert parent["progress"] == 62
+    assert coordinator.reduced == []
+
+
+@pytest.mark.asyncio
+async def test_refanned_parent_gets_new_shard_ids(job_manager, coordinator):
+    parent_id = await _fanned_out_parent(job_manager, coordinator, ["a", "b"])
+    old_shards = await _shards(job_manager, parent_id)
+    await coordinator.fan_out(parent_id, ["a", "b"])
+    new_shards = await _shards(job_manager, parent_id)
+
+    assert not {shard["job_id"] for shard in old_shards} & {shard["job_id"] for shard in new_shards}
+    assert [shard["payload"]["checkpoint_id"] for shard in old_shards] == \
+        [shard["payload"]["checkpoint_id"] for shard in new_shards]
+
+
+@pytest.mark.asyncio
+async def test_shards_of_earlier_fan_out_are_not_counted(job_manager, coordinator):
+    parent_id = await _fanned_out_parent(job_manager, coordinator, ["a", "b"])
+    old_shards = await _shards(job_manager, parent_id)
+    await coordinator.fan_out(parent_id, ["a", "b"])
+    new_shards = await _shards(job_manager, parent_id)
+
+    for shard in old_shards:
+        await coordinator.shard_completed(shard)
+    assert coordinator.reduced == []
+    assert await coordinator.parent_finished(parent_id, old_shards[0]["payload"]["shard_run"])
+    assert not await coordinator.parent_finished(parent_id, new_shards[0]["payload"]["shard_run"])
+
+    await coordinator.shard_failed(old_shards[0], "stale worker")
+    assert (await job_manager.get_job_status(parent_id))["status"] != "failed"
+
+    for shard in new_shards:
+        await coordinator.shard_completed(shard)
+    assert coordinator.reduced == [parent_id]
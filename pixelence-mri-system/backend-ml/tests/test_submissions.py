@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.services.job_manager import DuplicateJobError
+
+
+async def _submit(job_manager, keys):
+    return await job_manager.create_job("dicom", {}, submission_keys=keys, enqueue=False)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_submissions_create_one_job(job_manager):
+    keys = job_manager.submission_keys("clinic", "request-1", "digest")
+
+    outcomes = await asyncio.gather(*(_submit(job_manager, keys) for _ in range(5)), return_exceptions=True)
+
+    created = [outcome for outcome in outcomes if isinstance(outcome, str)]
+    duplicates = [outcome for outcome in outcomes if isinstance(outcome, DuplicateJobError)]
+    assert len(created) == 1
+    assert len(duplicates) == 4
+    assert {duplicate.job_id for duplicate in duplicates} == set(created)
+    assert await job_manager.find_duplicate_job(keys) == created[0]
+
+
+@pytest.mark.asyncio
+async def test_either_key_identifies_the_submission(job_manager):
+    job_id = await _submit(job_manager, job_manager.submission_keys("clinic", "request-1", "digest"))
+
+    with pytest.raises(DuplicateJobError) as duplicate:
+        await _submit(job_manager, job_manager.submission_keys("clinic", "request-2", "digest"))
+    assert duplicate.value.job_id == job_id
+
+    with pytest.raises(DuplicateJobError):
+        await _submit(job_manager, job_manager.submission_keys("clinic", "request-1", "other-digest"))
+
+
+@pytest.mark.asyncio
+async def test_submissions_are_scoped_to_their_tenant(job_manager):
+    first = await _submit(job_manager, job_manager.submission_keys("clinic-a", "request-1", "digest"))
+    second = await _submit(job_manager, job_manager.submission_keys("clinic-b", "request-1", "digest"))
+
+    assert first != second
+
+
+@pytest.mark.asyncio
+async def test_failed_submission_may_run_again(job_manager):
+    keys = job_manager.submission_keys("clinic", "request-1", "digest")
+    job_id = await _submit(job_manager, keys)
+    await job_manager.fail_job(job_id, "upload lost")
+
+    assert await job_manager.find_duplicate_job(keys) is None
+    retried = await _submit(job_manager, keys)
+    assert retried != job_id
+    assert await job_manager.find_duplicate_job(keys) == retried
+
+
+@pytest.mark.asyncio
+async def test_released_keys_only_free_their_own_job(job_manager):
+    keys = job_manager.submission_keys("clinic", "request-1", "digest")
+    job_id = await _submit(job_manager, keys)
+
+    await job_manager.release_submission("another-job", keys)
+    assert await job_manager.find_duplicate_job(keys) == job_id
+
+    await job_manager.release_submission(job_id, keys)
+    assert await job_manager.redis.exists(*keys) == 0